@@ -0,0 +1,106 @@
+from typing import Dict, Callable
+from pymonad.operators.either import Either
+import sys
+
+from pyfuncify import monad, error
+
+from . import runner
+
+"""
+Micro-benchmark of monad.MEither against the pymonad-based implementation it replaced.
+
+> python -m benchmarks.bench_monad --output monad.json
+"""
+
+CHAIN_LENGTH = 5
+
+
+class PyMonadEither(Either):
+    """
+    The previous monad.MEither; a subclass of the pymonad operators Either.
+    """
+    def __or__(self, fns):
+        return self.either(fns[0], fns[1])
+
+    def lift(self):
+        return self.value if self.is_right() else self.monoid[0]
+
+    def error(self):
+        return self.monoid[0]
+
+
+def pymonad_left(value):
+    return PyMonadEither(None, (value, False))
+
+
+def pymonad_right(value):
+    return PyMonadEither(value, (None, True))
+
+
+def implementations() -> Dict[str, Dict[str, Callable]]:
+    return {'pymonad': {'right': pymonad_right, 'left': pymonad_left},
+            'slotted': {'right': monad.Right, 'left': monad.Left}}
+
+
+def scenarios(right: Callable, left: Callable) -> Dict[str, Callable]:
+    def step(x):
+        return right(x + 1)
+
+    def chain(m):
+        for _ in range(CHAIN_LENGTH):
+            m = m >> step
+        return m
+
+    return {'construct_right': lambda _: right(1),
+            'construct_left': lambda _: left("boom"),
+            'bind_chain_right': lambda _: chain(right(0)),
+            'bind_chain_left': lambda _: chain(left("boom")),
+            'lift_and_test': lambda _: (right(1).is_right(), right(1).lift(), left(1).is_left(), left(1).error()),
+            'either_or': lambda _: right(1) | (str, str)}
+
+
+@monad.monadic_try(error_cls=error.PyFuncifyError)
+def try_failure(_arg):
+    raise ValueError("expected failure")
+
+
+def raise_and_catch(_arg):
+    try:
+        raise ValueError("expected failure")
+    except ValueError as e:
+        return e
+
+
+def try_scenarios() -> Dict[str, Callable]:
+    """
+    The cost of a monadic_try Left compared with raising and catching the exception.
+    """
+    return {'raise_and_catch': raise_and_catch,
+            'monadic_try_left': try_failure}
+
+
+def instance_bytes(either) -> int:
+    return sys.getsizeof(either) + (sys.getsizeof(either.__dict__) if hasattr(either, '__dict__') else 0)
+
+
+def run(iterations: int = runner.DEFAULT_ITERATIONS) -> Dict:
+    results = {}
+    for name, constructors in implementations().items():
+        for scenario, stage in scenarios(constructors['right'], constructors['left']).items():
+            results.setdefault(scenario, {})[name] = runner.measure(stage, iterations=iterations)
+    sizes = {name: instance_bytes(constructors['right'](1)) for name, constructors in implementations().items()}
+    return runner.report('monad',
+                         [{'scenario': scenario, 'stages': stages} for scenario, stages in results.items()] +
+                         [{'scenario': 'instance_bytes', 'stages': {name: {'bytes': size} for name, size in sizes.items()}},
+                          {'scenario': 'try_failure', 'stages': {name: runner.measure(stage, iterations=iterations)
+                                                                 for name, stage in try_scenarios().items()}}],
+                         iterations)
+
+
+def main():
+    args = runner.arg_parser("Benchmark monad.MEither against the pymonad Either").parse_args()
+    runner.emit(run(args.iterations), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+from typing import Dict, List
+from collections import namedtuple
+import json
+
+from pyfuncify import app, app_route, app_serialisers, monad
+
+from . import runner
+
+"""
+Benchmarks the app.pipeline hot path; pipeline -> build_value -> event_factory -> run_pipeline -> responder.
+
+Synthetic API Gateway, S3 and noop events are driven through each stage and through the full pipeline, while varying
+the size of the route table, the Cookie header and the request body.
+
+> python -m benchmarks.bench_pipeline --iterations 500 --output pipeline.json
+"""
+
+ROUTE_TABLE_SIZES = [1, 100, 500]
+COOKIE_COUNTS = [0, 10, 50]
+BODY_SIZES = [0, 1024, 100 * 1024]
+
+DEFAULT_ROUTES = 100
+DEFAULT_COOKIES = 2
+DEFAULT_BODY = 1024
+
+ENV = "bench"
+
+Scenario = namedtuple('Scenario', ['name', 'event_fn', 'routes', 'cookies', 'body_bytes'])
+
+AwsContext = namedtuple('AwsContext', ['aws_request_id'])
+
+
+#
+# Handlers
+#
+def ok_handler(request):
+    return monad.Right(request.replace('response', monad.Right(app.DictToJsonSerialiser({'ok': True}))))
+
+
+def noop_callable(value):
+    return monad.Right(value)
+
+
+def register_routes(route_count: int) -> None:
+    """
+    Resets the route table and registers route_count API routes, of which the last is the one the API events hit.
+    """
+    app_route.RouteMap().routes.clear()
+    app_route.RouteMap().compiled_templates.clear()
+    app_route.RouteMap().index = None
+
+    app.route(pattern=app.NO_MATCHING_ROUTE)(ok_handler)
+    app.route(pattern="bench")(ok_handler)
+    for i in range(route_count - 1):
+        app.route(pattern=('API', 'GET', '/filler{i}/resource/{{id}}'.format(i=i)))(ok_handler)
+    app.route(pattern=('API', 'GET', '/bench/resource/{id}'))(ok_handler)
+    app.route(pattern=('API', 'POST', '/bench/resource/{id}'), opts={'body_parser': app_serialisers.json_parser})(ok_handler)
+
+
+#
+# Events
+#
+def cookie_header(cookie_count: int) -> Dict:
+    if not cookie_count:
+        return {}
+    return {'Cookie': "; ".join("cookie{i}=value-{i}".format(i=i) for i in range(cookie_count))}
+
+
+def json_body(body_bytes: int) -> str:
+    if not body_bytes:
+        return None
+    item = {'key': 'k' * 16, 'value': 'v' * 32}
+    items = max(1, body_bytes // len(json.dumps(item)))
+    return json.dumps({'items': [item] * items})
+
+
+def api_gateway_event(cookies: int, body_bytes: int) -> Dict:
+    return {'httpMethod': 'POST' if body_bytes else 'GET',
+            'path': '/bench/resource/uuid1',
+            'headers': {'Content-Type': 'application/json', **cookie_header(cookies)},
+            'queryStringParameters': {'param1': 'a'},
+            'body': json_body(body_bytes)}
+
+
+def s3_event(_cookies: int, _body_bytes: int) -> Dict:
+    return {'Records': [{'s3': {'bucket': {'name': 'bench.uat.example.io'}, 'object': {'key': 'file.json'}}}]}
+
+
+def noop_event(_cookies: int, _body_bytes: int) -> Dict:
+    return {}
+
+
+def scenarios() -> List[Scenario]:
+    return ([Scenario('api_routes_{}'.format(n), api_gateway_event, n, DEFAULT_COOKIES, 0) for n in ROUTE_TABLE_SIZES] +
+            [Scenario('api_cookies_{}'.format(n), api_gateway_event, DEFAULT_ROUTES, n, 0) for n in COOKIE_COUNTS] +
+            [Scenario('api_body_{}'.format(n), api_gateway_event, DEFAULT_ROUTES, DEFAULT_COOKIES, n) for n in BODY_SIZES] +
+            [Scenario('s3', s3_event, DEFAULT_ROUTES, 0, 0),
+             Scenario('noop', noop_event, DEFAULT_ROUTES, 0, 0)])
+
+
+#
+# Stages
+#
+def run_scenario(scenario: Scenario, iterations: int) -> Dict:
+    register_routes(scenario.routes)
+    event = scenario.event_fn(scenario.cookies, scenario.body_bytes)
+    context = AwsContext(aws_request_id='bench-request-id')
+
+    def request_value():
+        return app.build_value(event, context, ENV)
+
+    def pipeline_result():
+        return app.run_pipeline(request=request_value(), params_parser=noop_callable)
+
+    stages = {'event_factory': runner.measure(lambda _: app.event_factory(event), iterations=iterations),
+              'build_value': runner.measure(lambda _: app.build_value(event, context, ENV), iterations=iterations),
+              'run_pipeline': runner.measure(lambda request: app.run_pipeline(request=request, params_parser=noop_callable),
+                                             setup=request_value,
+                                             iterations=iterations),
+              'responder': runner.measure(app.responder, setup=pipeline_result, iterations=iterations),
+              'pipeline': runner.measure(lambda _: app.pipeline(event=event,
+                                                                context=context,
+                                                                env=ENV,
+                                                                params_parser=noop_callable,
+                                                                pip_initiator=noop_callable,
+                                                                handler_guard_fn=noop_callable),
+                                         iterations=iterations)}
+    return {'scenario': scenario.name,
+            'routes': scenario.routes,
+            'cookies': scenario.cookies,
+            'body_bytes': scenario.body_bytes,
+            'stages': stages}
+
+
+def run(iterations: int = runner.DEFAULT_ITERATIONS) -> Dict:
+    with runner.silenced_stdout():
+        results = [run_scenario(scenario, iterations) for scenario in scenarios()]
+    return runner.report('pipeline', results, iterations)
+
+
+def main():
+    args = runner.arg_parser("Benchmark the app.pipeline hot path").parse_args()
+    runner.emit(run(args.iterations), args.output)
+
+
+if __name__ == '__main__':
+    main()
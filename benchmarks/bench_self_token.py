@@ -0,0 +1,162 @@
+from typing import Dict, Callable
+from jwcrypto import jwk, jwt
+import time
+
+from pyfuncify import self_token, crypto, monad
+
+from . import runner
+
+"""
+Micro-benchmark of self_token.token(), which decodes each serialised token once, against the flow it replaced, which
+decoded the token to check its validity, again to check its retry window, and again on every get.
+
++ acquire.  The token is read from the token persistence provider (a cold container).
++ warm.  The token is held in the token cache.
+
+Each stage also reports the number of times the token is decoded per call ('decodes').
+
+> python -m benchmarks.bench_self_token --output self_token.json
+"""
+
+
+class PersistenceProvider:
+    def __init__(self, bearer_token):
+        self.bearer_token = bearer_token
+
+    def write(self, key, value):
+        self.bearer_token = value
+        return monad.Right(value)
+
+    def read(self, key):
+        self.value = self.bearer_token
+        return monad.Right(self)
+
+
+class Env:
+    def client_id(self):
+        return 'id'
+
+    def client_secret(self):
+        return 'secret'
+
+    def identity_token_endpoint(self):
+        return 'https://idp.example.com/token'
+
+    def bearer_token(self):
+        return None
+
+    def set_env_var_with_value(self, key, value):
+        return ('ok', key, value)
+
+
+#
+# The previous implementation
+#
+def legacy_token():
+    result = legacy_get()
+    if result.is_right() and (result.value.expired() or self_token.in_token_retry_window(result.value)):
+        self_token.invalidate_cache()
+        return legacy_get()
+    return result
+
+
+def legacy_get():
+    result = legacy_cacheable_token()
+    if result.is_right():
+        return crypto.parse_generate_id_token(result.value)
+    return result
+
+
+def legacy_cacheable_token():
+    if legacy_token_cache:
+        return legacy_token_cache[0]
+    result = (self_token.bearer_token_from_env() >>
+              self_token.from_cache(self_token.DEFAULT_TOKEN_KEY) >>
+              legacy_token_service >>
+              self_token.cache(self_token.DEFAULT_TOKEN_KEY))
+    legacy_token_cache.append(monad.Right(result.value[2]) if result.is_right() else result)
+    return legacy_token_cache[0]
+
+
+def legacy_token_service(bearer_token):
+    if bearer_token and crypto.bearer_token_valid(bearer_token) and legacy_not_in_token_retry_window(bearer_token):
+        return monad.Right(('from_cache', bearer_token))
+    return monad.Left(self_token.TokenError(message="The benchmark does not request a token"))
+
+
+def legacy_not_in_token_retry_window(bearer_token: str) -> bool:
+    return not self_token.in_token_retry_window(crypto.parse_generate_id_token(bearer_token).value)
+
+
+legacy_token_cache = []
+
+
+def signed_jwt() -> str:
+    key = jwk.JWK.generate(kty='RSA', size=2048, kid="1")
+    now = int(time.time())
+    token = jwt.JWT(header={"alg": "RS256", "kid": "1"},
+                    claims={'iss': "https://idp.example.com/", 'sub': "1@clients", 'aud': "https://api.example.com",
+                            'iat': now, 'exp': now + (60 * 60 * 24), 'azp': "bench"})
+    token.make_signed_token(key)
+    return token.serialize()
+
+
+def cold_legacy():
+    legacy_token_cache.clear()
+
+
+def cold():
+    self_token.invalidate_cache()
+    self_token.parsed_token.cache_clear()
+
+
+def implementations() -> Dict[str, Dict[str, Callable]]:
+    return {'parse_per_check': {'token': legacy_token, 'cold': cold_legacy},
+            'parse_once': {'token': self_token.token, 'cold': cold}}
+
+
+def decodes(stage: Callable, setup: Callable) -> int:
+    """
+    The number of times the token is decoded in a call of the stage.
+    """
+    count = [0]
+    parse = crypto.parse_generate_id_token
+
+    def counting_parse(*args, **kwargs):
+        count[0] += 1
+        return parse(*args, **kwargs)
+
+    crypto.parse_generate_id_token = counting_parse
+    try:
+        stage(setup())
+    finally:
+        crypto.parse_generate_id_token = parse
+    return count[0]
+
+
+def run(iterations: int = runner.DEFAULT_ITERATIONS) -> Dict:
+    self_token.TokenConfig().configure(token_persistence_provider=PersistenceProvider(signed_jwt()), env=Env())
+    self_token._CTX['tracer'] = None
+    results = {}
+    with runner.silenced_stdout():
+        for name, impl in implementations().items():
+            token, cold_fn = impl['token'], impl['cold']
+            stages = {'acquire': (lambda _: token(), cold_fn),
+                      'warm': (lambda _: token(), runner.no_setup)}
+            for scenario, (stage, setup) in stages.items():
+                cold_fn()
+                token()
+                results.setdefault(scenario, {})[name] = {**runner.measure(stage, setup=setup, iterations=iterations),
+                                                          'decodes': decodes(stage, setup)}
+    return runner.report('self_token',
+                         [{'scenario': scenario, 'stages': stages} for scenario, stages in results.items()],
+                         iterations)
+
+
+def main():
+    args = runner.arg_parser("Benchmark self_token.token() decoding each token once against decoding per check").parse_args()
+    runner.emit(run(args.iterations), args.output)
+
+
+if __name__ == '__main__':
+    main()
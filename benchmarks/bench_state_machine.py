@@ -0,0 +1,81 @@
+from typing import Dict, Callable
+from pymonad.reader import Pipe
+from pymonad.tools import curry
+
+from pyfuncify import state_machine, circuit, fn, monad
+
+from . import runner
+
+"""
+Micro-benchmark of the compiled state_machine transition index against the list scan it replaced, using the circuit
+breaker's state map.
+
+> python -m benchmarks.bench_state_machine --output state_machine.json
+"""
+
+
+#
+# The previous list scan implementation
+#
+def scan_transition(state_map, from_state, with_transition):
+    return (Pipe(state_map)
+            .then(map_selector(extract_from_state_and_transition, (from_state, with_transition, None)))
+            .then(list)
+            .then(validate_and_extract_new_state)
+            .flush())
+
+
+def scan_valid_state_transition(state_map, from_state, with_transition):
+    return (Pipe(state_map)
+            .then(map_selector(extract_from_state_and_transition, (from_state, with_transition, None)))
+            .then(list)
+            .then(fn.only_one)
+            .flush())
+
+
+@curry(3)
+def map_selector(extractor_fn, map_tester, state_map):
+    return fn.select(fn.equality(extractor_fn, map_tester), state_map.stmap)
+
+
+def validate_and_extract_new_state(state_map_items):
+    if fn.only_one(state_map_items):
+        return monad.Right(state_map_items[0][2])
+    return monad.Left("invalid transition")
+
+
+def extract_from_state_and_transition(state_map_item):
+    current, transition, _new = state_map_item
+    return (current, transition, None)
+
+
+def implementations() -> Dict[str, Dict[str, Callable]]:
+    return {'list_scan': {'transition': scan_transition, 'valid': scan_valid_state_transition},
+            'indexed': {'transition': state_machine.transition, 'valid': state_machine.valid_state_transition}}
+
+
+def scenarios(transition: Callable, valid: Callable) -> Dict[str, Callable]:
+    state_map = circuit.circuit_state_map
+    return {'first_entry': lambda _: transition(state_map, None, circuit.transition_failure),
+            'last_entry': lambda _: transition(state_map, circuit.state_closed, circuit.transition_persistent_failure),
+            'invalid': lambda _: transition(state_map, circuit.state_half_open, circuit.transition_failure),
+            'valid_state_transition': lambda _: valid(state_map, circuit.state_open, circuit.transition_success)}
+
+
+def run(iterations: int = runner.DEFAULT_ITERATIONS) -> Dict:
+    results = {}
+    for name, impl in implementations().items():
+        for scenario, stage in scenarios(impl['transition'], impl['valid']).items():
+            results.setdefault(scenario, {})[name] = runner.measure(stage, iterations=iterations)
+    return runner.report('state_machine',
+                         [{'scenario': scenario, 'stages': stages} for scenario, stages in results.items()],
+                         iterations)
+
+
+def main():
+    args = runner.arg_parser("Benchmark the state_machine transition index against the list scan").parse_args()
+    runner.emit(run(args.iterations), args.output)
+
+
+if __name__ == '__main__':
+    main()
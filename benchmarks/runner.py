@@ -0,0 +1,164 @@
+from typing import Callable, Dict, List, Any
+from contextlib import contextmanager
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+"""
+Shared harness for the benchmark suites.
+
+Each measured stage is a pair of callables:
++ setup.  Called before every iteration, outside the timed region.  Its result is passed to the stage.
++ stage.  The callable being measured.
+
+Timings are taken per iteration with perf_counter_ns.  Allocations are measured in a separate pass with tracemalloc, as
+tracing distorts the timings.  Results are plain dicts so that a suite can be emitted as JSON and diffed between releases:
+
+> python -m benchmarks.bench_pipeline --output pipeline-0.6.10.json
+> python -m benchmarks.runner pipeline-0.6.10.json pipeline-0.7.0.json
+"""
+
+DEFAULT_ITERATIONS = 200
+DEFAULT_WARMUP = 10
+
+
+def no_setup():
+    return None
+
+
+def measure(stage: Callable[[Any], Any],
+            setup: Callable[[], Any] = no_setup,
+            iterations: int = DEFAULT_ITERATIONS,
+            warmup: int = DEFAULT_WARMUP) -> Dict:
+    for _ in range(warmup):
+        stage(setup())
+    return {**timings(stage, setup, iterations), **allocations(stage, setup, iterations)}
+
+
+def timings(stage: Callable, setup: Callable, iterations: int) -> Dict:
+    samples = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(iterations):
+            arg = setup()
+            t1 = time.perf_counter_ns()
+            stage(arg)
+            samples.append(time.perf_counter_ns() - t1)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    samples.sort()
+    return {'iterations': iterations,
+            'mean_us': statistics.fmean(samples) / 1000.0,
+            'median_us': statistics.median(samples) / 1000.0,
+            'p95_us': samples[int(len(samples) * 0.95) - 1] / 1000.0 if len(samples) > 1 else samples[0] / 1000.0,
+            'min_us': samples[0] / 1000.0}
+
+
+def allocations(stage: Callable, setup: Callable, iterations: int) -> Dict:
+    """
+    Reports the mean traced memory allocated during a call (peak above the baseline at the start of the call), the mean
+    memory still held once the call returns, and the largest single-call peak.
+    """
+    peak_total, retained_total, peak_max = 0, 0, 0
+    tracemalloc.start()
+    try:
+        for _ in range(iterations):
+            arg = setup()
+            tracemalloc.reset_peak()
+            base, _ = tracemalloc.get_traced_memory()
+            result = stage(arg)
+            current, peak = tracemalloc.get_traced_memory()
+            del result
+            peak_total += peak - base
+            retained_total += current - base
+            peak_max = max(peak_max, peak - base)
+    finally:
+        tracemalloc.stop()
+    return {'alloc_peak_bytes': peak_total / iterations,
+            'alloc_retained_bytes': retained_total / iterations,
+            'alloc_peak_max_bytes': peak_max}
+
+
+@contextmanager
+def silenced_stdout():
+    """
+    The pino logger binds sys.stdout when the module is imported, so redirect the underlying file descriptor rather than
+    sys.stdout itself.
+    """
+    sys.stdout.flush()
+    saved_fd = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved_fd, 1)
+        os.close(devnull)
+        os.close(saved_fd)
+
+
+def report(suite: str, results: List[Dict], iterations: int) -> Dict:
+    return {'suite': suite,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'iterations': iterations,
+            'results': results}
+
+
+def emit(report_dict: Dict, output: str = None) -> None:
+    serialised = json.dumps(report_dict, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(serialised)
+    else:
+        print(serialised)
+
+
+def arg_parser(description: str) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument('--output', help="Write the JSON report to this file rather than stdout")
+    return parser
+
+
+def compare(baseline: Dict, current: Dict, metric: str = 'median_us') -> List[Dict]:
+    """
+    Pairs the results of two reports of the same suite by scenario and stage, returning the ratio current/baseline of
+    the metric.  A ratio above 1 is a regression.
+    """
+    def keyed(report_dict):
+        return {(result['scenario'], stage): values
+                for result in report_dict['results']
+                for stage, values in result['stages'].items()}
+
+    baseline_stages, current_stages = keyed(baseline), keyed(current)
+    return [{'scenario': scenario,
+             'stage': stage,
+             'baseline': baseline_stages[(scenario, stage)][metric],
+             'current': values[metric],
+             'ratio': values[metric] / baseline_stages[(scenario, stage)][metric] if baseline_stages[(scenario, stage)][metric] else None}
+            for (scenario, stage), values in current_stages.items()
+            if (scenario, stage) in baseline_stages]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports")
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--metric', default='median_us')
+    args = parser.parse_args()
+    with open(args.baseline) as b, open(args.current) as c:
+        print(json.dumps(compare(json.load(b), json.load(c), args.metric), indent=2))
+
+
+if __name__ == '__main__':
+    main()
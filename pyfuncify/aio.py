@@ -0,0 +1,70 @@
+from typing import Any, Awaitable, Callable, Coroutine
+from simple_memory_cache import GLOBAL_CACHE
+import asyncio
+import inspect
+
+"""
+Asyncio helpers shared by the async variants of the pipeline and adapters.
+
+The event loop is created on first access and cached across warm Lambda invocations.  Async clients (and their
+connection pools) are bound to the loop they were created on, so running every invocation on the same loop keeps those
+pools usable between invocations.
+
+> aio.run(aio_pipeline(...))
+"""
+
+event_loop_cache = GLOBAL_CACHE.MemoryCachedVar('event_loop_cache')
+
+
+def event_loop() -> asyncio.AbstractEventLoop:
+    loop = event_loop_cache.get()
+    if loop.is_closed():
+        invalidate_event_loop()
+        loop = event_loop_cache.get()
+    return loop
+
+
+def invalidate_event_loop():
+    event_loop_cache.invalidate()
+    pass
+
+
+@event_loop_cache.on_first_access
+def new_event_loop() -> asyncio.AbstractEventLoop:
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    return loop
+
+
+def run(coro: Coroutine) -> Any:
+    """
+    Runs the coroutine to completion on the shared event loop.  This blocks, so can not be called while an event loop
+    is running in the thread (e.g. from async code); await the coroutine instead.
+    """
+    if in_running_loop():
+        coro.close()
+        raise RuntimeError("aio.run can not be called while an event loop is running; await the coroutine instead")
+    return event_loop().run_until_complete(coro)
+
+
+def in_running_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+async def maybe_await(result: Any) -> Any:
+    return await result if inspect.isawaitable(result) else result
+
+
+async def call(f: Callable, *args, **kwargs) -> Any:
+    """
+    Calls a sync or async callable, awaiting the result when it is awaitable.
+    """
+    return await maybe_await(f(*args, **kwargs))
+
+
+def is_async(f: Callable) -> bool:
+    return inspect.iscoroutinefunction(f)
@@ -1,6 +1,10 @@
-from typing import List, Dict, Tuple, Callable, Union
+from typing import List, Dict, Tuple, Callable, Union, Optional
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import base64
 
-from . import (monad,
+from . import (aio,
+               monad,
                span_tracer,
                logger,
                fn,
@@ -8,7 +12,10 @@ from . import (monad,
                app_route,
                app_web_session,
                chronos,
-               app_serialisers)
+               app_serialisers,
+               circuit_state_cache,
+               metrics,
+               self_token)
 
 DEFAULT_SUCCESS_HTTP_CODE = 200
 DEFAULT_FAILURE_HTTP_CODE = 400
@@ -62,6 +69,18 @@ It parses the event, using hints within the event to determine the app.route to
               used to determine the app.route symbol.  The fn domain_from_bucket_name() collects the unique bucket names
               (there should only be one), and takes the most significant part based on the default separator (DEFAULT_S3_BUCKET_SEP)
               This then is the symbol expected on an app.route.  
++ Batch events (SQS and Kinesis).  The object BatchEvent is created with a collection of BatchRecordEvent.  Each record
+              is routed individually; by default the app.route symbol is the queue or stream name taken from the record's
+              eventSourceARN, up to the first DEFAULT_BATCH_SOURCE_SEP (so 'orders.fifo' and 'orders.uat' route to 'orders').
+              The handler receives an app_value.Request whose event is the BatchRecordEvent.  The responder returns the
+              {'batchItemFailures': [...]} shape, listing only those records whose handler returned a Left (or a Left
+              response) or raised, so that the event source only retries the failed records.
+              Records are processed sequentially unless the pipeline is given a batch_concurrency, in which case
+              independent records are processed concurrently; sync handlers on a bounded thread pool, and async
+              handlers (e.g. those decorated with monad.aio_monadic_try) on asyncio, bounded by a semaphore.
+              The records of an SQS FIFO queue are always processed in order, one at a time; once a record fails,
+              it and all later records are listed as failures (the later records unprocessed).  Kinesis data is
+              base64 decoded, with the body being the decoded bytes (which is what a body_parser receives).
 
 On Errors.  Remember when you want your handler to generate an error that is parsable by the responder:
 + Use the request.error property to hold the error.
@@ -71,15 +90,25 @@ On Errors.  Remember when you want your handler to generate an error that is par
 """
 
 DEFAULT_S3_BUCKET_SEP = "."
+DEFAULT_BATCH_SOURCE_SEP = "."
+FIFO_QUEUE_SUFFIX = ".fifo"
 DEFAULT_RESPONSE_HDRS = {'Content-Type': 'application/json'}
 
 NO_MATCHING_ROUTE = "no_matching_route"
 
+SQS_EVENT_SOURCE = "aws:sqs"
+KINESIS_EVENT_SOURCE = "aws:kinesis"
+
+# Batch event sources mapped to their factory_overrides key
+BATCH_EVENT_SOURCES = {SQS_EVENT_SOURCE: 'sqs', KINESIS_EVENT_SOURCE: 'kinesis'}
+
 Request = app_value.Request
 RequestEvent = app_value.RequestEvent
 ApiGatewayRequestEvent = app_value.ApiGatewayRequestEvent
 S3StateChangeEvent = app_value.S3StateChangeEvent
 S3Object = app_value.S3Object
+BatchEvent = app_value.BatchEvent
+BatchRecordEvent = app_value.BatchRecordEvent
 
 Serialiser = app_serialisers.SerialiserProtocol
 DictToJsonSerialiser = app_serialisers.DictToJsonSerialiser
@@ -97,7 +126,8 @@ def pipeline(event: Dict,
              params_parser: Callable,
              pip_initiator: Callable,
              handler_guard_fn: Callable,
-             factory_overrides: Dict = {}):
+             factory_overrides: Dict = {},
+             batch_concurrency: Optional[int] = None):
     """
     Runs a general event handler pipeline.  Initiated by the main handler function.
 
@@ -108,13 +138,17 @@ def pipeline(event: Dict,
     The main handler can then insert 3 functions to configure the pipeline:
     + params_parser: Mandatory.  Callable.  Takes the request object optionally transforms it, and returns it wrapper in an Either.
     + pip_initiator:  Mandatory.  Callable.  Policy Information Point
-    + factory_overrides: Optional. Dict.  Overrides the routing factory token constructor.  Only supports S3 overrides.  For an
-                                          s3 override provide a Dict in the form of {'s3': callable_function}
+    + factory_overrides: Optional. Dict.  Overrides the routing factory token constructor.  Supports S3 and batch overrides.
+                                          For an s3 override provide a Dict in the form of {'s3': callable_function}.  For
+                                          batch events use the 'sqs' or 'kinesis' key, with a callable that takes a
+                                          BatchRecordEvent and returns the route symbol.
     + handler_guard_fn: A pre-processing guard fn to determine whether the handler should be invoked.  It returns an Either.  When the handler
                         shouldnt run the Either wraps an Exception.  In this case, the request is passed directly to the responder
+    + batch_concurrency: Optional. Int.  Opts into concurrent processing of the records of a batch event, and is the maximum
+                         number of records processed at once.  When not provided, records are processed sequentially.
     """
 
-    request = pip_initiator(build_value(event, context, env, factory_overrides).value)
+    request = pip_initiator(build_value(event, context, env, factory_overrides, batch_concurrency=batch_concurrency).value)
 
     guard_outcome = handler_guard_fn(request)
 
@@ -127,7 +161,18 @@ def pipeline(event: Dict,
                                         env=env,
                                         status_code=app_value.HttpStatusCode(guard_outcome.error().code),
                                         error=guard_outcome.error()).value)
-    return responder(result)
+    return end_of_invocation(responder(result))
+
+
+def end_of_invocation(response: Dict) -> Dict:
+    """
+    Flushes the pending writes of cached circuit state, and the metrics, and waits (bounded by the token config's
+    refresh_wait) for background self token refreshes, before the invocation ends (and the container may be frozen).
+    """
+    self_token.wait_for_refresh_at_end_of_invocation()
+    circuit_state_cache.flush_circuits()
+    metrics.flush()
+    return response
 
 
 def run_pipeline(request: monad.EitherMonad[app_value.Request],
@@ -135,16 +180,60 @@ def run_pipeline(request: monad.EitherMonad[app_value.Request],
     return request >> log_start >> params_parser >> route_invoker
 
 
+async def aio_pipeline(event: Dict,
+                       context: Dict,
+                       env: str,
+                       params_parser: Callable,
+                       pip_initiator: Callable,
+                       handler_guard_fn: Callable,
+                       factory_overrides: Dict = {},
+                       batch_concurrency: Optional[int] = None):
+    """
+    The asyncio variant of pipeline.  It takes the same arguments, however, the params_parser, pip_initiator,
+    handler_guard_fn and the route functions may each be either sync or async callables.
+
+    From a (sync) Lambda handler use run_aio_pipeline, which runs the pipeline on the event loop shared across warm
+    invocations.
+    """
+    request = await aio.call(pip_initiator, build_value(event, context, env, factory_overrides, batch_concurrency=batch_concurrency).value)
+
+    guard_outcome = await aio.call(handler_guard_fn, request)
+
+    if guard_outcome.is_right():
+        result = await aio_run_pipeline(request=request,
+                                        params_parser=params_parser)
+    else:
+        result = monad.Left(build_value(event=event,
+                                        context=context,
+                                        env=env,
+                                        status_code=app_value.HttpStatusCode(guard_outcome.error().code),
+                                        error=guard_outcome.error()).value)
+    return end_of_invocation(responder(result))
+
+
+def run_aio_pipeline(**kwargs):
+    """
+    Runs aio_pipeline to completion on the shared event loop; takes the aio_pipeline kwargs.
+    """
+    return aio.run(aio_pipeline(**kwargs))
+
+
+async def aio_run_pipeline(request: monad.EitherMonad[app_value.Request],
+                           params_parser: Callable):
+    return await (request.aio_bind(log_start) >> params_parser >> aio_route_invoker)
+
+
 def build_value(event,
                 context,
                 env,
                 factory_overrides: Dict = {},
                 status_code: app_value.HttpStatusCode = None,
-                error=None) -> monad.EitherMonad[app_value.Request]:
+                error=None,
+                batch_concurrency: Optional[int] = None) -> monad.EitherMonad[app_value.Request]:
     """
     Initialises the app_value.Request object to be passed to the pipeline
     """
-    req = app_value.Request(event=event_factory(event, factory_overrides),
+    req = app_value.Request(event=event_factory(event, factory_overrides, batch_concurrency),
                             context=context,
                             tracer=init_tracer(env=env, aws_context=context),
                             event_time=chronos.time_now(tz=chronos.tz_utc()),
@@ -155,7 +244,9 @@ def build_value(event,
     return monad.Right(req)
 
 
-def event_factory(event: Dict, factory_overrides: Dict = {}) -> app_value.RequestEvent:
+def event_factory(event: Dict, factory_overrides: Dict = {}, batch_concurrency: Optional[int] = None) -> app_value.RequestEvent:
+    if event.get('Records', None) and is_batch_event(event):
+        return build_batch_event(event, factory_overrides, batch_concurrency)
     if event.get('Records', None):
         return build_s3_state_change_event(event, factory_overrides)
     if event.get('httpMethod', None):
@@ -181,6 +272,81 @@ def build_s3_state_change_event(event: Dict, factory_overrides: Dict) -> app_val
                                         objects=objects)
 
 
+def is_batch_event(event: Dict) -> bool:
+    return event['Records'][0].get('eventSource', None) in BATCH_EVENT_SOURCES
+
+
+def build_batch_event(event: Dict, factory_overrides: Dict, batch_concurrency: Optional[int] = None) -> app_value.BatchEvent:
+    """
+    Routes each record.  Records with the same route symbol share a single route lookup.
+    """
+    event_source = event['Records'][0]['eventSource']
+    factory = factory_overrides.get(BATCH_EVENT_SOURCES[event_source], None) or domain_from_event_source_arn
+    routes = {}
+    return app_value.BatchEvent(event=event,
+                                kind=event_source,
+                                request_function=batch_route_invoker,
+                                records=[batch_record(record, factory, routes) for record in event['Records']],
+                                max_concurrency=batch_concurrency,
+                                ordered=is_fifo_batch(event))
+
+
+def is_fifo_batch(event: Dict) -> bool:
+    """
+    An SQS FIFO queue (its name ends with .fifo) requires the records of a message group to be processed in order.
+    """
+    return any(record.get('eventSource', None) == SQS_EVENT_SOURCE and
+               record.get('eventSourceARN', "").endswith(FIFO_QUEUE_SUFFIX) for record in event['Records'])
+
+
+def batch_record(record: Dict, factory: Callable, routes: Dict) -> app_value.BatchRecordEvent:
+    record_event = app_value.BatchRecordEvent(event=record,
+                                              kind=None,
+                                              request_function=None,
+                                              item_identifier=batch_item_identifier(record),
+                                              event_source=record.get('eventSource', None),
+                                              body=batch_record_body(record),
+                                              attributes=record.get('messageAttributes', None))
+    kind = factory(record_event)
+    if kind not in routes:
+        routes[kind] = route_fn_from_kind(kind)
+    _template, route_fn, opts = routes[kind]
+    record_event.kind = kind
+    record_event.request_function = route_fn
+    if opts and opts.get('body_parser', None):
+        record_event.body_parser = opts['body_parser']
+    return record_event
+
+
+def batch_item_identifier(record: Dict) -> str:
+    """
+    SQS reports failures by messageId, Kinesis by the record's sequence number.
+    """
+    if record.get('eventSource', None) == KINESIS_EVENT_SOURCE:
+        return fn.deep_get(record, ['kinesis', 'sequenceNumber'])
+    return record.get('messageId', None)
+
+
+def batch_record_body(record: Dict):
+    """
+    The Kinesis data is delivered base64 encoded; the body is the decoded bytes.
+    """
+    if record.get('eventSource', None) == KINESIS_EVENT_SOURCE:
+        return base64.b64decode(fn.deep_get(record, ['kinesis', 'data']))
+    return record.get('body', None)
+
+
+def domain_from_event_source_arn(record: app_value.BatchRecordEvent) -> str:
+    """
+    Takes the queue or stream name from the ARN; e.g. arn:aws:sqs:ap-southeast-2:123456789012:orders.fifo or
+    arn:aws:kinesis:ap-southeast-2:123456789012:stream/orders, with the most significant part of the name being the route.
+    """
+    arn = record.event.get('eventSourceARN', None)
+    if not arn:
+        return NO_MATCHING_ROUTE
+    return arn.split(":")[-1].split("/")[-1].split(DEFAULT_BATCH_SOURCE_SEP)[0]
+
+
 def build_http_event(event: Dict) -> app_value.ApiGatewayRequestEvent:
     """
     method: str
@@ -190,7 +356,7 @@ def build_http_event(event: Dict) -> app_value.ApiGatewayRequestEvent:
     query_params: Optional[dict]=None
     """
     kind = route_from_http_event(event['httpMethod'], event['path'])
-    template, route_fn, opts = route_fn_from_kind(kind)
+    template, route_fn, opts, path_params = route_match_from_kind(kind)
     body = opts['body_parser'](event['body']) if opts and opts['body_parser'] else event['body']
     return app_value.ApiGatewayRequestEvent(kind=kind,
                                             request_function=route_fn,
@@ -198,7 +364,7 @@ def build_http_event(event: Dict) -> app_value.ApiGatewayRequestEvent:
                                             method=event['httpMethod'],
                                             headers=event['headers'],
                                             path=event['path'],
-                                            path_params=path_template_to_params(kind[2], template[2]),
+                                            path_params=path_params,
                                             body=body,
                                             query_params=event['queryStringParameters'],
                                             web_session=app_web_session.WebSession().session_from_headers(
@@ -211,21 +377,10 @@ def route_from_http_event(method, path):
 
 def path_template_to_params(kind, template) -> Dict:
     """
-    Remove the leading "/"
+    Extracts the path params from the path (kind) using the path template.  Routed http events obtain their path params
+    as a by-product of route matching (see route_match_from_kind), so this is only required for ad-hoc extraction.
     """
-    return params_comparer_builder(kind[1::].split("/"), template[1::].split("/"), {})
-
-
-def params_comparer_builder(kind_xs, template_xs, injector):
-    template_fst, template_rst = fn.first(template_xs), fn.rest(template_xs)
-    kind_fst, kind_rst = fn.first(kind_xs), fn.rest(kind_xs)
-    if not template_fst:
-        return injector
-    if "{" in template_fst:
-        return params_comparer_builder(kind_rst,
-                                       template_rst,
-                                       {**injector, **{template_fst.replace("{", "").replace("}", ""): kind_fst}})
-    return params_comparer_builder(kind_rst, template_rst, injector)
+    return app_route.template_params(app_route.compile_template(template), kind) or {}
 
 
 def s3_objects_from_event(s3_event: Dict) -> List[Dict]:
@@ -248,6 +403,168 @@ def route_invoker(request):
     return request.event.request_function(request=request)
 
 
+async def aio_route_invoker(request):
+    if isinstance(request.event, app_value.BatchEvent):
+        return await aio_batch_route_invoker(request)
+    return await aio.call(request.event.request_function, request=request)
+
+
+async def aio_batch_route_invoker(request):
+    """
+    As batch_route_invoker, but on the running event loop.  Async handlers are awaited directly, sync handlers run on
+    worker threads when the batch is concurrent.
+    """
+    record_requests = [record_request(request, record) for record in request.event.records]
+    if request.event.ordered:
+        request.results = await aio_invoke_records_in_order(record_requests)
+    else:
+        request.results = await gather_record_routes(record_requests, request.event.max_concurrency or 1)
+    return monad.Right(request)
+
+
+def batch_route_invoker(request):
+    """
+    Invokes the route of each record in the batch with its own request.  The per-record results are collected, in record
+    order, in request.results.
+
+    Sync and async handlers are invoked separately; sync handlers on a thread pool, async handlers on the shared event
+    loop, each bounded by the event's max_concurrency.  The records of an ordered (SQS FIFO) batch are invoked one at a
+    time, in order, see invoke_records_in_order.  The async handlers can not be run while an event loop is
+    running in the thread (i.e. when pipeline is called from async code; use aio_pipeline there), so such a batch
+    fails with an AppError before any record is invoked; every record is then reported as failed.
+    """
+    record_requests = [record_request(request, record) for record in request.event.records]
+    max_concurrency = request.event.max_concurrency or 1
+    results = [None] * len(record_requests)
+
+    sync_positions = [i for i, req in enumerate(record_requests) if not is_async_route(req.event)]
+    async_positions = [i for i, req in enumerate(record_requests) if is_async_route(req.event)]
+
+    if async_positions and aio.in_running_loop():
+        return monad.Left(request.replace('error', app_value.AppError(message="Async batch routes can not be run by pipeline while an event loop is running; await aio_pipeline instead",
+                                                                      name="batch_route_invoker",
+                                                                      code=500)))
+
+    if request.event.ordered:
+        request.results = invoke_records_in_order(record_requests)
+        return monad.Right(request)
+
+    sync_results = invoke_record_routes([record_requests[i] for i in sync_positions], max_concurrency)
+    async_results = aio_invoke_record_routes([record_requests[i] for i in async_positions], max_concurrency)
+
+    for position, result in zip(sync_positions + async_positions, sync_results + async_results):
+        results[position] = result
+    request.results = results
+    return monad.Right(request)
+
+
+def is_async_route(record: app_value.BatchRecordEvent) -> bool:
+    return aio.is_async(record.request_function)
+
+
+def invoke_records_in_order(record_requests: List[app_value.Request]) -> List[monad.MEither]:
+    """
+    Invokes the records one at a time, in order.  Once a record fails the later records are not invoked, but are
+    failed as unprocessed, so that the event source redelivers them, in order, after the failed record.
+    """
+    results = []
+    for req in record_requests:
+        if results and record_failed(results[-1]):
+            results.append(unprocessed_record(req))
+        elif is_async_route(req.event):
+            results.append(aio.run(aio_invoke_record_route(req)))
+        else:
+            results.append(invoke_record_route(req))
+    return results
+
+
+async def aio_invoke_records_in_order(record_requests: List[app_value.Request]) -> List[monad.MEither]:
+    results = []
+    for req in record_requests:
+        if results and record_failed(results[-1]):
+            results.append(unprocessed_record(req))
+        elif is_async_route(req.event):
+            results.append(await aio_invoke_record_route(req))
+        else:
+            results.append(invoke_record_route(req))
+    return results
+
+
+def unprocessed_record(request: app_value.Request) -> monad.MEither:
+    return monad.Left(app_value.AppError(message="Not processed; an earlier record of the ordered batch failed",
+                                         name="batch_record",
+                                         ctx={'item_identifier': request.event.item_identifier},
+                                         code=500))
+
+
+def invoke_record_routes(record_requests: List[app_value.Request], max_concurrency: int) -> List[monad.MEither]:
+    if max_concurrency <= 1 or len(record_requests) <= 1:
+        return [invoke_record_route(req) for req in record_requests]
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(record_requests))) as executor:
+        return list(executor.map(invoke_record_route, record_requests))
+
+
+def aio_invoke_record_routes(record_requests: List[app_value.Request], max_concurrency: int) -> List[monad.MEither]:
+    if not record_requests:
+        return []
+    return aio.run(gather_record_routes(record_requests, max_concurrency))
+
+
+async def gather_record_routes(record_requests: List[app_value.Request], max_concurrency: int) -> List[monad.MEither]:
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def bounded(req):
+        async with semaphore:
+            if is_async_route(req.event):
+                return await aio_invoke_record_route(req)
+            if max_concurrency > 1:
+                return await asyncio.to_thread(invoke_record_route, req)
+            return invoke_record_route(req)
+
+    return list(await asyncio.gather(*[bounded(req) for req in record_requests]))
+
+
+def record_request(request: app_value.Request, record: app_value.BatchRecordEvent) -> app_value.Request:
+    return app_value.Request(event=record,
+                             context=request.context,
+                             tracer=record_tracer(request.tracer, record),
+                             event_time=request.event_time,
+                             app_request_context=request.app_request_context,
+                             pip=request.pip)
+
+
+def record_tracer(tracer, record: app_value.BatchRecordEvent):
+    if not isinstance(tracer, span_tracer.SpanTracer):
+        return tracer
+    return tracer.span_child(tags=tracer.tags, kv={**tracer.kv, 'item_identifier': record.item_identifier})
+
+
+def flatten_record_result(result: monad.MEither) -> monad.MEither:
+    return result.value if isinstance(result.value, monad.MEither) else result
+
+
+@monad.monadic_try(name="batch_record", exception_test_fn=flatten_record_result, error_cls=app_value.AppError)
+def invoke_record_route(request):
+    parse_record_body(request.event)
+    return request.event.request_function(request=request)
+
+
+@monad.aio_monadic_try(name="batch_record", exception_test_fn=flatten_record_result, error_cls=app_value.AppError)
+async def aio_invoke_record_route(request):
+    parse_record_body(request.event)
+    return await request.event.request_function(request=request)
+
+
+def parse_record_body(record: app_value.BatchRecordEvent) -> app_value.BatchRecordEvent:
+    """
+    Applies the route's body_parser to the record's body, within the record's try, so a failure to parse is that
+    record's failure.
+    """
+    if record.body_parser is not None:
+        record.body, record.body_parser = record.body_parser(record.body), None
+    return record
+
+
 def route_fn_from_kind(kind):
     """
     Assumes that noop_event function is defined
@@ -255,6 +572,13 @@ def route_fn_from_kind(kind):
     return app_route.RouteMap().get_route(kind)
 
 
+def route_match_from_kind(kind):
+    """
+    As route_fn_from_kind, but also returns the path params extracted while matching the route.
+    """
+    return app_route.RouteMap().match_route(kind)
+
+
 def template_from_route_fn(route_fn: Callable) -> Union[str, Tuple]:
     return app_route.RouteMap().route_pattern_from_function(route_fn)
 
@@ -281,6 +605,9 @@ def responder(request):
     + Otherwise, app_value.Request.error() should be an Either-wrapping an object which responds to error() which is JSON serialisable
     """
 
+    if isinstance(request.lift().event, app_value.BatchEvent):
+        return batch_responder(request)
+
     body = {'headers': build_headers(request.lift().response_headers),
             'multiValueHeaders': build_multi_headers(request.lift().event)}
 
@@ -304,6 +631,35 @@ def responder(request):
 
     return body
 
+def batch_responder(request):
+    """
+    Returns the partial batch response.  When the pipeline failed before the records were invoked, every record is
+    reported as failed.
+    """
+    results = request.value.results if request.is_right() else None
+    failures = batch_item_failures(request.lift().event.records, results)
+
+    logger.info(msg="End Handler",
+                tracer=request.lift().tracer,
+                ctx={'records': len(request.lift().event.records), 'failures': len(failures)},
+                status='fail' if failures else 'ok')
+
+    return {'batchItemFailures': failures}
+
+
+def batch_item_failures(records: List[app_value.BatchRecordEvent], results: Optional[List[monad.MEither]]) -> List[Dict]:
+    if results is None:
+        return [{'itemIdentifier': record.item_identifier} for record in records]
+    return [{'itemIdentifier': record.item_identifier} for record, result in zip(records, results) if record_failed(result)]
+
+
+def record_failed(result: monad.MEither) -> bool:
+    if result.is_left():
+        return True
+    response = result.value.response if isinstance(result.value, app_value.Request) else None
+    return isinstance(response, monad.MEither) and response.is_left()
+
+
 def _error_status_code(request: Request):
     if isinstance(request.response, monad.MEither) and request.response.is_left():
         return request.response.error().code
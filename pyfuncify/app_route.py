@@ -1,14 +1,37 @@
 from typing import Optional, Dict, Any, List, Callable, Union, Tuple
+from dataclasses import dataclass, field
+from collections import namedtuple
 from pymonad.tools import curry
 
-from . import singleton, fn, monad
+from . import singleton, fn, monad, app_value
+
+# A path template segment compiled at @app.route time.  Literal segments carry the literal, templated segments ({param})
+# carry the param name.
+SegmentDescriptor = namedtuple('SegmentDescriptor', ['literal', 'param'])
+
+
+@dataclass
+class RouteNode:
+    """
+    A node in the compiled route index.  Literal path segments are keyed in literals, while every templated segment
+    ({param}) at the same depth shares the single wildcard child.  Routes terminating at this node are held in routes
+    as (pattern, route_fn, opts, param_names).
+    """
+    literals: Dict[str, 'RouteNode'] = field(default_factory=dict)
+    wildcard: Optional['RouteNode'] = None
+    routes: List[Tuple] = field(default_factory=list)
 
 
 class RouteMap(singleton.Singleton):
     routes = {}
+    compiled_templates = {}
+    index = None
 
     def add_route(self, pattern: Union[str, Tuple[str,str,str]], fn: Callable, opts: Dict):
         self.routes[pattern] = (fn, opts)
+        if not isinstance(pattern, str):
+            self.compiled_templates[pattern] = compile_template(pattern[2])
+        self.index = None
         pass
 
     def no_route(self, return_template=False) -> Union[Callable, Tuple[str, Callable]]:
@@ -20,18 +43,62 @@ class RouteMap(singleton.Singleton):
         return no_route_route
 
     def default_no_route(self, request):
-        return monad.Left(request.replace('error', app.AppError(message='no matching route', code=404)))
+        return monad.Left(request.replace('error', app_value.AppError(message='no matching route', code=404)))
 
     def get_route(self, route: Union[str, Tuple]) -> Tuple[Union[str, Tuple], Callable]:
+        # return the route_pattern, route_fn, and route_opts
+        template, route_fn, opts, _path_params = self.match_route(route)
+        return template, route_fn, opts
+
+    def match_route(self, route: Union[str, Tuple]) -> Tuple[Union[str, Tuple], Callable, Dict, Dict]:
+        """
+        Returns the route_pattern, route_fn, route_opts and the path params extracted from the route in a single lookup.
+        Tuple routes are resolved through the compiled route index.
+        """
         if isinstance(route, str):
             match = self.routes.get(route, self.no_route())
-            return route, match[0], match[1]
-        possible_matching_routes = self.event_matches(route[0], route[1], route[2])
-        if not possible_matching_routes or len(possible_matching_routes) > 1:
-            return self.no_route(True)
-
-        # return the route_pattern, route_fn, and route_opts
-        return possible_matching_routes[0][0], possible_matching_routes[0][1][0], possible_matching_routes[0][1][1],
+            return route, match[0], match[1], {}
+        matched = self.index_lookup(route[0], route[1], route[2])
+        if not matched:
+            return (*self.no_route(True), {})
+        return matched
+
+    def route_index(self) -> Dict[Tuple[str, str], RouteNode]:
+        """
+        The route index is rebuilt lazily on the first lookup following an add_route.
+        """
+        if self.index is None:
+            self.index = build_route_index(self.routes, self.compiled_templates)
+        return self.index
+
+    def index_lookup(self, pos1, pos2, pos3) -> Optional[Tuple[Tuple, Callable, Dict, Dict]]:
+        """
+        Walks the index for the (event type, event qualifier) pair, depth first, trying literal segments before the
+        wildcard so that '/resource/special' wins over '/resource/{id}'.  The wildcard branch is only taken when the
+        literal branch fails to terminate on a route.
+        """
+        root = self.route_index().get((pos1, pos2), None)
+        if root is None:
+            return None
+        segments = path_segments(pos3)
+        depth_to_match = len(segments)
+        stack = [(root, 0, ())]
+        while stack:
+            node, depth, captured = stack.pop()
+            if depth == depth_to_match:
+                if not node.routes:
+                    continue
+                if len(node.routes) > 1:
+                    return None
+                pattern, route_fn, opts, param_names = node.routes[0]
+                return pattern, route_fn, opts, dict(zip(param_names, captured))
+            segment = segments[depth]
+            if node.wildcard is not None:
+                stack.append((node.wildcard, depth + 1, captured + (segment,)))
+            literal = node.literals.get(segment, None)
+            if literal is not None:
+                stack.append((literal, depth + 1, captured))
+        return None
 
     def route_pattern_from_function(self, route_fn: Callable):
         route_item = fn.find(self.route_function_predicate(route_fn), self.routes.items())
@@ -43,36 +110,68 @@ class RouteMap(singleton.Singleton):
     def route_function_predicate(self, route_fn, route):
         return route[1][0] == route_fn
 
-    def event_matches(self, pos1, pos2, pos3) -> Dict[Tuple, str]:
-        return list(fn.select(self.match_predicate(pos1, pos2, pos3), self.routes.items()))
 
-    @curry(5)
-    def match_predicate(self, pos1, pos2, pos3, route_item: Tuple[Union[str, Tuple], Callable]):
-        if isinstance(route_item[0], str):
-            return None
-        event_type, event_qual, event_template = route_item[0]
-        if event_type == pos1 and event_qual == pos2 and self.template_matches(event_template, pos3):
-            return True
+def build_route_index(routes: Dict, compiled_templates: Dict) -> Dict[Tuple[str, str], RouteNode]:
+    """
+    Compiles the tuple routes into a trie keyed on (event type, event qualifier), with a node per path segment.
+    String routes are looked up directly from the routes dict and are not indexed.
+    """
+    index = {}
+    for pattern, (route_fn, opts) in routes.items():
+        if isinstance(pattern, str):
+            continue
+        event_type, event_qual, _event_template = pattern
+        node = index.setdefault((event_type, event_qual), RouteNode())
+        param_names = []
+        for descriptor in compiled_templates[pattern]:
+            if descriptor.param is not None:
+                if node.wildcard is None:
+                    node.wildcard = RouteNode()
+                node = node.wildcard
+                param_names.append(descriptor.param)
+            else:
+                node = node.literals.setdefault(descriptor.literal, RouteNode())
+        node.routes.append((pattern, route_fn, opts, tuple(param_names)))
+    return index
+
+
+def compile_template(template: str) -> Tuple[SegmentDescriptor, ...]:
+    """
+    Compiles a path template into segment descriptors; e.g.
+    > compile_template('/resource/{id}')
+    (SegmentDescriptor(literal='resource', param=None), SegmentDescriptor(literal=None, param='id'))
+    """
+    return tuple(SegmentDescriptor(None, segment.replace("{", "").replace("}", "")) if is_template_param(segment)
+                 else SegmentDescriptor(segment, None)
+                 for segment in path_segments(template))
+
+
+def template_params(descriptors: Tuple[SegmentDescriptor, ...], path: str) -> Optional[Dict]:
+    """
+    Matches the path against the compiled template, returning the path params, or None when the path does not match.
+    """
+    segments = path_segments(path)
+    if len(segments) != len(descriptors):
         return None
+    params = {}
+    for descriptor, segment in zip(descriptors, segments):
+        if descriptor.param is not None:
+            params[descriptor.param] = segment
+        elif descriptor.literal != segment:
+            return None
+    return params
+
+
+def path_segments(path: str) -> List[str]:
+    """
+    Splits a path on "/", ignoring the leading and trailing separators.
+    """
+    stripped = path.strip("/")
+    return stripped.split("/") if stripped else []
+
 
-    def template_matches(self, template, event):
-        return self.matcher(fn.rest(template.split("/")), fn.rest(event.split("/")))
-
-    def matcher(self, template_xs: List, event_xs: List):
-        template_fst, template_rst = fn.first(template_xs), fn.rest(template_xs)
-        ev_fst, ev_rst = fn.first(event_xs), fn.rest(event_xs)
-        if not template_fst and not ev_fst:
-            return True
-        if not template_fst and ev_fst:
-            return False
-        if template_fst and not ev_fst:
-            return False
-        if not self.ismatch(template_fst, ev_fst):
-            return False
-        return self.matcher(template_rst, ev_rst)
-
-    def ismatch(self, template_token, ev_token):
-        return ("{" in template_token and "}" in template_token) or template_token == ev_token
+def is_template_param(segment: str) -> bool:
+    return "{" in segment and "}" in segment
 
 
 def route(pattern: Union[str, Tuple[str, str, str]], opts: Dict = None):
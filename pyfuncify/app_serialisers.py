@@ -29,7 +29,7 @@ def json_parser(body: str) -> str:
         return parsed.value
     return body
 
-@monad.monadic_try()
+@monad.monadic_try(overridable=False)
 def try_parser(parser_fn, content):
     return parser_fn(content)
 
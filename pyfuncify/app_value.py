@@ -48,6 +48,31 @@ class S3StateChangeEvent(RequestEvent):
     objects: List[S3Object]
 
 
+@dataclass
+class BatchRecordEvent(RequestEvent):
+    """
+    A single record from a batch event source (SQS or Kinesis).  The event is the raw record, and the kind is the route
+    symbol for the record.  The item_identifier is the id reported back in batchItemFailures.  The route's body_parser
+    is applied when the record is invoked, so a body which fails to parse fails only its own record.
+    """
+    item_identifier: str
+    event_source: str
+    body: Any
+    attributes: Optional[Dict] = None
+    body_parser: Optional[Callable] = None
+
+
+@dataclass
+class BatchEvent(RequestEvent):
+    """
+    ordered is True for SQS FIFO queues; the records are processed one at a time, in order, stopping at the first
+    failure.
+    """
+    records: List[BatchRecordEvent]
+    max_concurrency: Optional[int] = None
+    ordered: bool = False
+
+
 @dataclass
 class ApiGatewayRequestEvent(RequestEvent):
     method: str
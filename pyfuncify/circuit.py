@@ -1,7 +1,10 @@
-from typing import Any, Callable, Union, Optional, Protocol, TypeVar, Type
+from typing import Any, Callable, Union, Optional, Protocol, TypeVar, Type, List
+from collections import namedtuple
 from datetime import datetime
+import threading
+import time
 
-from . import monad, error, state_machine, chronos, singleton
+from . import monad, error, state_machine, chronos, singleton, metrics
 
 T = TypeVar('T', bound='CircuitStateProviderProtocol')
 
@@ -22,6 +25,8 @@ circuit_state_map = state_machine.state_transition_map([(None,              tran
                                                        (state_half_open,    transition_success,            state_closed),
                                                        (state_open,         transition_success,            state_half_closed),
                                                        (state_closed,       transition_success,            state_closed),
+                                                       (state_closed,       transition_failure,            state_half_open),
+                                                       (state_closed,       transition_persistent_failure, state_open),
                                                        (state_half_closed,  transition_success,            state_closed)])
 
 
@@ -52,6 +57,10 @@ class CircuitStateProviderProtocol(Protocol):
         """
         ...
 
+    # Optionally, a provider may persist the circuit's sliding window by providing a window attribute and an
+    # update_window method.  The window is a list of buckets; [bucket_index, calls, failures, slow_calls, latency].
+    # Without them, the window is held in-process for the circuit_name (or, without a circuit_name, by the provider).
+
 class CircuitConfiguration(singleton.Singleton):
     # Factors that determine if a circuit should be placed in open state.
     # 3 failures in a 5 min period, opens the circuit
@@ -61,11 +70,38 @@ class CircuitConfiguration(singleton.Singleton):
     # The number of minutes from the time a circuit transitioned to open before it can be retried
     open_stand_down_period = 5 * 60
 
+    # Outcomes are counted in a sliding window of failure_threshold_seconds, divided into window_buckets buckets.
+    # Rate thresholds (e.g. 0.5 for 50%) only apply once the window holds minimum_calls calls.
+    window_buckets = 10
+    failure_rate_threshold = None
+    # The concurrent probe calls admitted once an open circuit's stand down period has passed, and while it is half closed
+    half_open_max_probes = 1
+    slow_call_seconds = None
+    slow_call_rate_threshold = None
+    minimum_calls = 5
+
     def configure(self,
                   max_retries: int =None,
-                  circuit_state_provider: Optional[CircuitStateProviderProtocol] = None):
+                  circuit_state_provider: Optional[CircuitStateProviderProtocol] = None,
+                  failure_rate_threshold: Optional[float] = None,
+                  slow_call_seconds: Optional[float] = None,
+                  slow_call_rate_threshold: Optional[float] = None,
+                  minimum_calls: int = 5,
+                  half_open_max_probes: int = 1):
+        """
+        + failure_rate_threshold.  Optional.  Opens the circuit when the proportion of failed calls in the window reaches it.
+        + slow_call_seconds.  Optional.  Calls taking at least this long are counted as slow.
+        + slow_call_rate_threshold.  Optional.  Opens the circuit when the proportion of slow calls in the window reaches it.
+        + minimum_calls.  The calls in the window before the rate thresholds apply.
+        + half_open_max_probes.  The concurrent calls admitted to probe a recovering circuit; others are short circuited.
+        """
         self.circuit_state_provider = circuit_state_provider
-        self.max_retries = 3 if max_retries is None else max_retries # used by the backoff decorator to configure the number of retry attempts
+        self.max_retries = 3 if max_retries is None else max_retries # the default number of attempts made by the http_adapter's retry policy
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.minimum_calls = minimum_calls
+        self.half_open_max_probes = half_open_max_probes
         pass
 
     def provider(self):
@@ -89,26 +125,90 @@ def circuit_breaker():
 
     When a circuit_state_provider is not provided, the the circuit is a no-op.
 
+    Once the stand down period of an open circuit has passed, and while the circuit is half closed, only
+    half_open_max_probes concurrent calls are admitted to probe the dependency.  The others are short circuited.
+    A failed probe re-opens the circuit for a further stand down period.
     """
     def inner(fn):
         def breaker(*args, **kwargs):
             circuit_state_provider = get_a_provider(kwargs, CircuitConfiguration())
-            if circuit_state_provider and is_open(circuit_state_provider) and is_in_stand_down_period(circuit_state_provider.last_state_chg_time):
-                return monad.Left(CircuitOpen(message="Circuit Open",
-                                              code=500,
-                                              ctx={'circuit_state': circuit_state_provider.circuit_state, 'failures': circuit_state_provider.failures}))
-
-            result = fn(*args, **kwargs)
-
-            if circuit_state_provider:
-                if result.is_left():
-                    circuit_failure(circuit_state_provider)
-                else:
-                    transition_circuit_on_success(circuit_state_provider)
-            return result
+            name = kwargs.get('name', None) or fn.__name__
+            if circuit_is_standing_down(circuit_state_provider):
+                return short_circuit(circuit_state_provider, name)
+            probe = is_probing(circuit_state_provider)
+            if probe and not acquire_probe(circuit_state_provider):
+                return short_circuit(circuit_state_provider, name)
+
+            try:
+                started = time.monotonic()
+                result = fn(*args, **kwargs)
+                return circuit_result(circuit_state_provider, result, time.monotonic() - started, name)
+            finally:
+                if probe:
+                    release_probe(circuit_state_provider)
+        return breaker
+    return inner
+
+def aio_circuit_breaker():
+    """
+    Circuit Breaker Decorator for async fns.  Has the same circuit_state_provider semantics as circuit_breaker.
+    """
+    def inner(fn):
+        async def breaker(*args, **kwargs):
+            circuit_state_provider = get_a_provider(kwargs, CircuitConfiguration())
+            name = kwargs.get('name', None) or fn.__name__
+            if circuit_is_standing_down(circuit_state_provider):
+                return short_circuit(circuit_state_provider, name)
+            probe = is_probing(circuit_state_provider)
+            if probe and not acquire_probe(circuit_state_provider):
+                return short_circuit(circuit_state_provider, name)
+
+            try:
+                started = time.monotonic()
+                result = await fn(*args, **kwargs)
+                return circuit_result(circuit_state_provider, result, time.monotonic() - started, name)
+            finally:
+                if probe:
+                    release_probe(circuit_state_provider)
         return breaker
     return inner
 
+def circuit_is_standing_down(circuit_state_provider: Any) -> bool:
+    return bool(circuit_state_provider) and is_open(circuit_state_provider) and is_in_stand_down_period(circuit_state_provider.last_state_chg_time)
+
+def is_probing(circuit_state_provider: Any) -> bool:
+    return bool(circuit_state_provider) and circuit_state_provider.circuit_state in (state_open, state_half_closed)
+
+def circuit_open_result(circuit_state_provider: Any) -> monad.MEither:
+    return monad.Left(CircuitOpen(message="Circuit Open",
+                                  code=500,
+                                  ctx={'circuit_state': circuit_state_provider.circuit_state, 'failures': circuit_state_provider.failures}))
+
+def short_circuit(circuit_state_provider: Any, name: str) -> monad.MEither:
+    metrics.count('short_circuits', metrics.circuit_dimensions(circuit_state_provider, name))
+    return circuit_open_result(circuit_state_provider)
+
+def circuit_result(circuit_state_provider: Any, result: monad.MEither, latency: float = 0.0, name: str = None) -> monad.MEither:
+    from_state = circuit_state_provider.circuit_state if circuit_state_provider else None
+    if circuit_state_provider:
+        window = record_outcome(circuit_state_provider, failed=result.is_left(), latency=latency)
+        if result.is_left():
+            circuit_failure(circuit_state_provider, window)
+        else:
+            transition_circuit_on_success(circuit_state_provider, window)
+    if metrics.enabled():
+        record_call_metrics(circuit_state_provider, name, result, latency, from_state)
+    return result
+
+def record_call_metrics(circuit_state_provider: Any, name: str, result: monad.MEither, latency: float, from_state: Optional[str]):
+    dimensions = metrics.circuit_dimensions(circuit_state_provider, name)
+    metrics.count('calls', dimensions)
+    metrics.count('failures' if result.is_left() else 'successes', dimensions)
+    metrics.observe('latency', latency * 1000.0, dimensions)
+    if circuit_state_provider and circuit_state_provider.circuit_state != from_state:
+        metrics.count('state_transitions', {**dimensions, 'to_state': str(circuit_state_provider.circuit_state)})
+    pass
+
 def get_a_provider(from_args, from_config):
     """
     From Args takes precidence.
@@ -129,15 +229,19 @@ def http_retryable_monad_failure_predicate(monad_result: Union[Any, monad.MEithe
         return False
     return monad_result.is_left() and monad_result.error().retryable
 
-def circuit_failure(circuit_state_provider: Any) -> Any:
-    if exhasted_failures_over_period(last_state_chg_time=circuit_state_provider.last_state_chg_time, failures=circuit_state_provider.failures):
+def circuit_failure(circuit_state_provider: Any, window: 'SlidingWindow' = None) -> Any:
+    if is_probing(circuit_state_provider):
+        reopen_circuit(circuit_state_provider)
+    elif window is not None and window_thresholds_exceeded(window, circuit_state_provider):
         open_circuit(circuit_state_provider)
         pass
     else:
         update_circuit_failures(circuit_state_provider)
     pass
 
-def transition_circuit_on_success(circuit_state_provider: Any) -> Any:
+def transition_circuit_on_success(circuit_state_provider: Any, window: 'SlidingWindow' = None) -> Any:
+    if window is not None and slow_call_threshold_exceeded(window.totals(window_now())):
+        return open_circuit(circuit_state_provider)
     transition = circuit_transition(from_state=circuit_state_provider.circuit_state, with_transition=transition_success)
     if circuit_state_provider.circuit_state != transition.value:
         circuit_state_provider.update_state(circuit_state=transition.value,
@@ -145,16 +249,44 @@ def transition_circuit_on_success(circuit_state_provider: Any) -> Any:
                                             failures=0)
     return circuit_state_provider
 
-def exhasted_failures_over_period(last_state_chg_time: datetime, failures: int) -> bool:
-    if last_state_chg_time is None:
-        return False
-    return failures_within_time_threshold(last_state_chg_time) and (failures >= (CircuitConfiguration().failure_count_threshold) )
-
-def failures_within_time_threshold(circuit_time: datetime) -> bool:
+def window_thresholds_exceeded(window: 'SlidingWindow', circuit_state_provider: Any = None) -> bool:
+    """
+    The circuit opens on failure_count_threshold failures within the window, or when a rate threshold is reached.
     """
-    When the circuit is half open, we can retry until we reach the failure threshold.
+    totals = window.totals(window_now())
+    config = CircuitConfiguration()
+    if failure_count(circuit_state_provider, totals) >= config.failure_count_threshold:
+        return True
+    if config.failure_rate_threshold is not None and rate_reached(totals.failures, totals, config.failure_rate_threshold):
+        return True
+    return slow_call_threshold_exceeded(totals)
+
+def failure_count(circuit_state_provider: Any, totals: 'WindowTotals') -> int:
     """
-    return (chronos.time_now(tz=chronos.tz_utc(), apply=[chronos.epoch()]) - circuit_time.timestamp()) < CircuitConfiguration().failure_threshold_seconds
+    The failures in the window.  A provider which does not persist its window may be rebuilt from its store on every
+    call, losing the in-process window, so its persisted failures since the last state change (within
+    failure_threshold_seconds) are also counted, with the failure being recorded.
+    """
+    if circuit_state_provider is None or hasattr(circuit_state_provider, 'update_window'):
+        return totals.failures
+    return max(totals.failures, persisted_failures_within_period(circuit_state_provider) + 1)
+
+def persisted_failures_within_period(circuit_state_provider: Any) -> int:
+    last_state_chg_time = circuit_state_provider.last_state_chg_time
+    if last_state_chg_time is None or not circuit_state_provider.failures:
+        return 0
+    if (window_now() - last_state_chg_time.timestamp()) >= CircuitConfiguration().failure_threshold_seconds:
+        return 0
+    return circuit_state_provider.failures
+
+def slow_call_threshold_exceeded(totals: 'WindowTotals') -> bool:
+    config = CircuitConfiguration()
+    if config.slow_call_rate_threshold is None:
+        return False
+    return rate_reached(totals.slow_calls, totals, config.slow_call_rate_threshold)
+
+def rate_reached(count: int, totals: 'WindowTotals', threshold: float) -> bool:
+    return totals.calls >= CircuitConfiguration().minimum_calls and (count / totals.calls) >= threshold
 
 def is_in_stand_down_period(last_state_chg_time: datetime) -> bool:
     """
@@ -169,17 +301,189 @@ def open_circuit(circuit_state_provider: Any) -> Any:
     circuit_state_provider.update_state(circuit_state=circuit_transition(from_state=circuit_state_provider.circuit_state, with_transition=transition_persistent_failure).value,
                                         last_state_chg_time=chronos.time_now(tz=chronos.tz_utc()),
                                         failures=0)
+    reset_window(circuit_state_provider)
+    return circuit_state_provider
+
+def reopen_circuit(circuit_state_provider: Any) -> Any:
+    """
+    A failed probe opens the circuit (from half closed), or restarts the stand down period of the open circuit.
+    """
+    circuit_state_provider.update_state(circuit_state=state_open,
+                                        last_state_chg_time=chronos.time_now(tz=chronos.tz_utc()),
+                                        failures=0)
+    reset_window(circuit_state_provider)
     return circuit_state_provider
 
 def update_circuit_failures(circuit_state_provider: Any) -> Any:
-    transition = circuit_transition(from_state=circuit_state_provider.circuit_state, with_transition=transition_failure).value
-    if transition !=circuit_state_provider.circuit_state:
-        circuit_state_provider.update_state(circuit_state=transition,
+    """
+    Counts the failure.  The failure transition only applies from the closed (and initial) states; in other states the
+    circuit stays put.
+    """
+    transition = circuit_transition(from_state=circuit_state_provider.circuit_state, with_transition=transition_failure)
+    failures = 1 if circuit_state_provider.failures is None else circuit_state_provider.failures + 1
+    if transition.is_right() and transition.value != circuit_state_provider.circuit_state:
+        circuit_state_provider.update_state(circuit_state=transition.value,
                                             last_state_chg_time=chronos.time_now(tz=chronos.tz_utc()),
-                                            failures=1 if circuit_state_provider.failures is None else circuit_state_provider.failures + 1)
-
+                                            failures=failures)
+    else:
+        circuit_state_provider.update_state(circuit_state=circuit_state_provider.circuit_state,
+                                            last_state_chg_time=circuit_state_provider.last_state_chg_time,
+                                            failures=failures)
     return circuit_state_provider
 
+#
+# Half Open Probes
+#
+class CircuitProbes(singleton.Singleton):
+    """
+    The in-process probe counts of providers which do not limit probes themselves, keyed on circuit_name.
+    """
+    probes = {}
+    lock = threading.Lock()
+
+
+def acquire_probe(circuit_state_provider: Any) -> bool:
+    """
+    A provider may limit probes across containers by providing acquire_probe(max_probes) -> bool and release_probe().
+    Otherwise probes are limited in-process.
+    """
+    max_probes = CircuitConfiguration().half_open_max_probes
+    if hasattr(circuit_state_provider, 'acquire_probe'):
+        return circuit_state_provider.acquire_probe(max_probes)
+    with CircuitProbes().lock:
+        in_flight = in_process_state(CircuitProbes().probes, circuit_state_provider, '_circuit_probes', 0)
+        if in_flight >= max_probes:
+            return False
+        set_in_process_state(CircuitProbes().probes, circuit_state_provider, '_circuit_probes', in_flight + 1)
+        return True
+
+def release_probe(circuit_state_provider: Any):
+    if hasattr(circuit_state_provider, 'release_probe'):
+        circuit_state_provider.release_probe()
+        return
+    with CircuitProbes().lock:
+        in_flight = in_process_state(CircuitProbes().probes, circuit_state_provider, '_circuit_probes', 1)
+        set_in_process_state(CircuitProbes().probes, circuit_state_provider, '_circuit_probes', max(in_flight - 1, 0))
+    pass
+
+#
+# Sliding Window
+#
+WindowTotals = namedtuple('WindowTotals', ['calls', 'failures', 'slow_calls', 'latency'])
+
+class SlidingWindow:
+    """
+    Counts call outcomes over the last window_seconds.  The window is divided into a fixed number of buckets, each
+    holding the calls, failures, slow calls and total latency of its slice of time, so the memory per circuit is
+    constant.  A bucket is reset when it is reused for a later slice.
+    """
+    __slots__ = ('window_seconds', 'buckets')
+
+    def __init__(self, window_seconds: float, bucket_count: int, buckets: List[List] = None):
+        self.window_seconds = window_seconds
+        self.buckets = buckets if buckets else [[None, 0, 0, 0, 0.0] for _ in range(bucket_count)]
+
+    def bucket_index(self, now: float) -> int:
+        return int(now // (self.window_seconds / len(self.buckets)))
+
+    def record(self, now: float, failed: bool, latency: float, slow: bool) -> 'SlidingWindow':
+        index = self.bucket_index(now)
+        bucket = self.buckets[index % len(self.buckets)]
+        if bucket[0] != index:
+            bucket[:] = [index, 0, 0, 0, 0.0]
+        bucket[1] += 1
+        bucket[2] += 1 if failed else 0
+        bucket[3] += 1 if slow else 0
+        bucket[4] += latency
+        return self
+
+    def totals(self, now: float) -> WindowTotals:
+        oldest = self.bucket_index(now) - len(self.buckets)
+        current = [bucket for bucket in self.buckets if bucket[0] is not None and bucket[0] > oldest]
+        return WindowTotals(calls=sum(bucket[1] for bucket in current),
+                            failures=sum(bucket[2] for bucket in current),
+                            slow_calls=sum(bucket[3] for bucket in current),
+                            latency=sum(bucket[4] for bucket in current))
+
+    def state(self) -> List[List]:
+        return [list(bucket) for bucket in self.buckets]
+
+
+class CircuitWindows(singleton.Singleton):
+    """
+    The in-process windows of providers which do not persist their window, keyed on circuit_name.
+    """
+    windows = {}
+
+
+def record_outcome(circuit_state_provider: Any, failed: bool, latency: float) -> SlidingWindow:
+    config = CircuitConfiguration()
+    slow = config.slow_call_seconds is not None and latency >= config.slow_call_seconds
+    window = window_for(circuit_state_provider).record(window_now(), failed=failed, latency=latency, slow=slow)
+    save_window(circuit_state_provider, window)
+    return window
+
+def window_for(circuit_state_provider: Any) -> SlidingWindow:
+    config = CircuitConfiguration()
+    if hasattr(circuit_state_provider, 'update_window'):
+        buckets = getattr(circuit_state_provider, 'window', None)
+        return SlidingWindow(config.failure_threshold_seconds,
+                             config.window_buckets,
+                             buckets if buckets and len(buckets) == config.window_buckets else None)
+    window = in_process_state(CircuitWindows().windows, circuit_state_provider, '_circuit_window')
+    if window is None or len(window.buckets) != config.window_buckets or window.window_seconds != config.failure_threshold_seconds:
+        window = SlidingWindow(config.failure_threshold_seconds, config.window_buckets)
+        set_in_process_state(CircuitWindows().windows, circuit_state_provider, '_circuit_window', window)
+    return window
+
+def save_window(circuit_state_provider: Any, window: SlidingWindow):
+    if hasattr(circuit_state_provider, 'update_window'):
+        circuit_state_provider.update_window(window.state())
+    pass
+
+def reset_window(circuit_state_provider: Any):
+    if hasattr(circuit_state_provider, 'update_window'):
+        circuit_state_provider.update_window(None)
+    else:
+        set_in_process_state(CircuitWindows().windows, circuit_state_provider, '_circuit_window', None)
+    pass
+
+def window_now() -> float:
+    return chronos.time_now(tz=chronos.tz_utc(), apply=[chronos.epoch()])
+
+#
+# In-process circuit state
+#
+def in_process_state(store: dict, circuit_state_provider: Any, attribute: str, default: Any = None) -> Any:
+    """
+    In-process state is keyed on the provider's circuit_name, so it is shared by the providers of a circuit (e.g.
+    a provider rebuilt from its store on every call), and providers need not be hashable.  A provider without a
+    circuit_name holds its own state, as the attribute.
+    """
+    circuit_name = getattr(circuit_state_provider, 'circuit_name', None)
+    if circuit_name is None:
+        return getattr(circuit_state_provider, attribute, default)
+    return store.get(circuit_name, default)
+
+def set_in_process_state(store: dict, circuit_state_provider: Any, attribute: str, value: Any):
+    circuit_name = getattr(circuit_state_provider, 'circuit_name', None)
+    if circuit_name is not None:
+        store[circuit_name] = value
+        return
+    try:
+        setattr(circuit_state_provider, attribute, value)
+    except AttributeError:
+        pass  # e.g. a frozen dataclass provider without a circuit_name; no in-process state is held
+    pass
+
+def clear_in_process_state():
+    """
+    Clears the in-process windows (and probe counts) of every circuit.
+    """
+    CircuitWindows().windows.clear()
+    CircuitProbes().probes.clear()
+    pass
+
 #
 # Circuit State Management
 #
@@ -0,0 +1,172 @@
+from typing import Any, Callable, Union
+from collections import namedtuple
+from datetime import datetime
+import threading
+import time
+import weakref
+
+from . import singleton, monad, error, logger
+
+"""
+An in-process cache in front of a CircuitStateProvider.
+
+The circuit breaker reads the circuit state on every call, and writes it on every state change (and on every failure
+while half open).  With a remote store (e.g. DynamoDB) that is a round trip on every outbound call.  The cache:
++ Serves reads from memory, reloading from the store when the local copy is older than ttl_seconds.
++ Coalesces writes; each update replaces the pending write, so several failures become a single write of the latest
+  count.  Pending writes are flushed on a background timer no later than max_staleness_seconds after the first, and
+  at the end of the invocation by flush_circuits() (which the app pipeline calls).
++ Writes a change of circuit_state through immediately (unless write_through_state_changes is False), so other
+  containers see a circuit open within their ttl_seconds.
++ Holds the circuit's sliding window, which is written behind with the state when the provider persists its window
+  (see CircuitStateProviderProtocol), and otherwise kept in-process.
+
+> provider = circuit_state_cache.CachedCircuitStateProvider(DynamoCircuitStore, circuit_name="token-circuit")
+> circuit.CircuitConfiguration().configure(circuit_state_provider=provider)
+
+The provider_cls is constructed with the circuit name, per the CircuitStateProviderProtocol, to load the state.
+"""
+
+DEFAULT_TTL_SECONDS = 5.0
+DEFAULT_MAX_STALENESS_SECONDS = 1.0
+
+CircuitStateValue = namedtuple('CircuitStateValue', ['failures', 'last_state_chg_time', 'circuit_state'])
+
+
+class CircuitStateCacheError(error.PyFuncifyError):
+    pass
+
+
+class CircuitStateCache(singleton.Singleton):
+    providers = weakref.WeakSet()
+
+    def register(self, provider):
+        self.providers.add(provider)
+        pass
+
+    def flush(self):
+        for provider in list(self.providers):
+            provider.flush()
+        pass
+
+
+class CachedCircuitStateProvider:
+    def __init__(self,
+                 provider_cls: Callable,
+                 circuit_name: Union[None, str] = None,
+                 ttl_seconds: float = DEFAULT_TTL_SECONDS,
+                 max_staleness_seconds: float = DEFAULT_MAX_STALENESS_SECONDS,
+                 write_through_state_changes: bool = True):
+        self.provider_cls = provider_cls
+        self.circuit_name = circuit_name
+        self.ttl_seconds = ttl_seconds
+        self.max_staleness_seconds = max_staleness_seconds
+        self.write_through_state_changes = write_through_state_changes
+        self.lock = threading.RLock()
+        self.pending = None
+        self.window = None
+        self.window_pending = False
+        self.flush_timer = None
+        self.load()
+        CircuitStateCache().register(self)
+
+    @property
+    def circuit_state(self) -> Union[None, str]:
+        return self.current().circuit_state
+
+    @property
+    def failures(self) -> int:
+        return self.current().failures
+
+    @property
+    def last_state_chg_time(self) -> datetime:
+        return self.current().last_state_chg_time
+
+    def update_state(self, failures: int, last_state_chg_time: datetime, circuit_state: Union[None, str]):
+        with self.lock:
+            state_changed = circuit_state != self.state.circuit_state
+            self.state = CircuitStateValue(failures, last_state_chg_time, circuit_state)
+            self.pending = self.state
+            if state_changed and self.write_through_state_changes:
+                self.flush()
+            else:
+                self.schedule_flush()
+        return self
+
+    def current(self) -> CircuitStateValue:
+        with self.lock:
+            if self.expired():
+                self.flush()
+                if self.pending is None and not self.window_pending:
+                    self.load()
+            return self.state
+
+    def update_window(self, window):
+        with self.lock:
+            self.window = window
+            self.window_pending = True
+            self.schedule_flush()
+        pass
+
+    def expired(self) -> bool:
+        return (time.monotonic() - self.loaded_at) >= self.ttl_seconds
+
+    def load(self):
+        self.provider = self.provider_cls(self.circuit_name)
+        self.state = CircuitStateValue(self.provider.failures, self.provider.last_state_chg_time, self.provider.circuit_state)
+        if hasattr(self.provider, 'update_window'):
+            self.window = getattr(self.provider, 'window', None)
+        self.loaded_at = time.monotonic()
+        pass
+
+    def schedule_flush(self):
+        if self.flush_timer is None:
+            self.flush_timer = threading.Timer(self.max_staleness_seconds, self.flush)
+            self.flush_timer.daemon = True
+            self.flush_timer.start()
+        pass
+
+    def flush(self):
+        """
+        Writes the pending state to the store.  On a failure to write, the write remains pending.
+        """
+        with self.lock:
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+            if self.window_pending and self.flushed(write_window(self.provider, self.window)):
+                self.window_pending = False
+            if self.pending is not None and self.flushed(write_state(self.provider, self.pending)):
+                self.pending = None
+        pass
+
+    def flushed(self, result: monad.MEither) -> bool:
+        if result.is_left():
+            logger.info(msg="Circuit State Flush Failure",
+                        status='error',
+                        ctx={'circuit_name': self.circuit_name, 'error': result.error().message})
+        return result.is_right()
+
+
+def flush_circuits():
+    """
+    Flushes the pending writes of every cached circuit state provider.  Call at the end of the invocation (the app
+    pipeline does so).
+    """
+    CircuitStateCache().flush()
+    pass
+
+
+@monad.monadic_try(name="circuit_state_flush", error_cls=CircuitStateCacheError)
+def write_state(provider: Any, state: CircuitStateValue) -> Any:
+    return provider.update_state(failures=state.failures,
+                                 last_state_chg_time=state.last_state_chg_time,
+                                 circuit_state=state.circuit_state)
+
+
+@monad.monadic_try(name="circuit_window_flush", error_cls=CircuitStateCacheError)
+def write_window(provider: Any, window: Any) -> Any:
+    """
+    The window is only written to providers which persist it; otherwise it is held by the cache.
+    """
+    return provider.update_window(window) if hasattr(provider, 'update_window') else None
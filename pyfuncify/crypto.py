@@ -53,7 +53,7 @@ def validate(token):
 
 @curry(3)
 @monad.monadic_try(name="decode_jwt", status=401, error_cls=JwtDecodingError)
-def decode_jwt(claims_to_assert, serialised_jwt: str, jwks: Optional[jwk.JWKSet]) -> Tuple:
+def decode_jwt(claims_to_assert, serialised_jwt: str, jwks: Optional[Union[jwk.JWK, jwk.JWKSet]]) -> Tuple:
     """
     Parses the jwt, validing the signature (from JWKS) and the EXP/AUD claims
     """
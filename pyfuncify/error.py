@@ -1,6 +1,53 @@
+import traceback as tb
+
 from . import console
 
-class PyFuncifyError(Exception):
+
+class LazyTraceback:
+    """
+    Holds the exception from which a traceback is formatted, on first use, when the traceback is converted to a str.
+    Formatting a traceback is far more expensive than raising, and most expected failures never look at it.
+    """
+    __slots__ = ('exception', 'formatted')
+
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+        self.formatted = None
+
+    def __str__(self):
+        if self.formatted is None:
+            self.formatted = "".join(tb.format_exception(self.exception))
+            self.exception = None
+        return self.formatted
+
+    def __repr__(self):
+        return str(self)
+
+    def __eq__(self, other):
+        return str(self) == str(other)
+
+    def __hash__(self):
+        return hash(str(self))
+
+class LazyTracebackMixin:
+    """
+    The traceback property of an error holding its traceback as a str or a LazyTraceback, in _traceback.
+    """
+    @property
+    def traceback(self):
+        """
+        The traceback str; materialised from a LazyTraceback on first access.
+        """
+        if isinstance(self._traceback, LazyTraceback):
+            self._traceback = str(self._traceback)
+        return self._traceback
+
+    @traceback.setter
+    def traceback(self, value):
+        self._traceback = value
+
+
+class PyFuncifyError(LazyTracebackMixin, Exception):
     def __init__(self,
                  message="",
                  name="",
@@ -16,7 +63,7 @@ class PyFuncifyError(Exception):
         self.name = name
         self.ctx = ctx
         self.klass = klass
-        self.traceback = traceback
+        self._traceback = traceback
         self.request_kwargs = request_kwargs
         super().__init__(self.message)
 
@@ -30,7 +77,7 @@ class PyFuncifyError(Exception):
         console.cons.print(f"{self.message}\n\n{self.traceback}")
 
 
-class PyFuncifyBaseError(Exception):
+class PyFuncifyBaseError(LazyTracebackMixin, Exception):
 
     def __init__(self,
                  message="",
@@ -47,7 +94,7 @@ class PyFuncifyBaseError(Exception):
         self.name = name
         self.ctx = ctx
         self.klass = klass
-        self.traceback = traceback
+        self._traceback = traceback
         self.request_kwargs = request_kwargs
         super().__init__(self.message)
 
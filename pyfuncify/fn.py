@@ -158,5 +158,13 @@ def compose_iter(fn_list: List, initial_val):
 def either_compose(fn_list: List, initial_val):
     return reduce(lambda m, fn: m.bind(fn), fn_list, initial_val)
 
+
+async def aio_either_compose(fn_list: List, initial_val):
+    """
+    The async equivalent of either_compose.  The fns may be sync or async, and the composition short-circuits on the
+    first Left without calling (or creating coroutines for) the remaining fns.
+    """
+    return await monad.AioEither(initial_val, tuple(fn_list))
+
 def flatten(xs: List):
     return reduce(iconcat, xs, [])
@@ -1,12 +1,83 @@
-from typing import Dict, Tuple
+from typing import Dict, Tuple, Optional, Any, Iterator, Callable
+from dataclasses import dataclass
 from pymonad.tools import curry
 import requests
+import codecs
+import json
+import time
 
 from . import monad, error
 
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 5.0
+DEFAULT_DEADLINE_RESERVE_MS = 500  # Time held back from the Lambda's remaining time to handle the failure and respond
+DEFAULT_STREAM_CHUNK_SIZE = 64 * 1024
+
+
 class HttpError(error.PyFuncifyError):
     pass
 
+
+class DeadlineExceeded(HttpError):
+    pass
+
+
+@dataclass(frozen=True)
+class RequestOptions:
+    """
+    Per-phase timeouts and an optional deadline for an http_adapter call.  The deadline is a time.monotonic() value
+    which applies across all attempts of the call (including retries); each attempt's timeouts are clipped to
+    the time remaining before it.
+    """
+    connect_timeout: float = DEFAULT_CONNECT_TIMEOUT
+    read_timeout: float = DEFAULT_READ_TIMEOUT
+    deadline: Optional[float] = None
+
+    def remaining(self) -> Optional[float]:
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.deadline is not None and self.remaining() <= 0
+
+    def timeout(self) -> Tuple[float, float]:
+        """
+        The (connect, read) timeout tuple, in the form taken by requests.
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return self.connect_timeout, self.read_timeout
+        return min(self.connect_timeout, max(remaining, 0)), min(self.read_timeout, max(remaining, 0))
+
+
+def request_options(connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                    read_timeout: float = DEFAULT_READ_TIMEOUT,
+                    lambda_context: Any = None,
+                    budget_ms: Optional[int] = None,
+                    reserve_ms: int = DEFAULT_DEADLINE_RESERVE_MS) -> RequestOptions:
+    """
+    Builds the request options.  The deadline is taken from the Lambda context's get_remaining_time_in_millis (less
+    reserve_ms), or from budget_ms.  When both are provided the earlier deadline applies.
+    > http.request_options(connect_timeout=1.0, read_timeout=3.0, lambda_context=context)
+    """
+    budgets = [ms for ms in [budget_ms, lambda_remaining_ms(lambda_context, reserve_ms)] if ms is not None]
+    if not budgets:
+        return RequestOptions(connect_timeout, read_timeout)
+    return RequestOptions(connect_timeout, read_timeout, time.monotonic() + (max(min(budgets), 0) / 1000.0))
+
+
+def lambda_remaining_ms(lambda_context: Any, reserve_ms: int) -> Optional[int]:
+    if lambda_context is None or not hasattr(lambda_context, 'get_remaining_time_in_millis'):
+        return None
+    return lambda_context.get_remaining_time_in_millis() - reserve_ms
+
+
+def deadline_exceeded(step: str, options: RequestOptions) -> monad.MEither:
+    return monad.Left(DeadlineExceeded(message="HTTP deadline exceeded before the request could be made",
+                                       name=step,
+                                       code=504,
+                                       ctx={'deadline_exceeded_by': -options.remaining()},
+                                       retryable=False))
+
 class BearerTokenAuth(requests.auth.AuthBase):
     """
     Custom Bearer token Authn
@@ -27,6 +98,20 @@ def extract_fn_json(response):
 def extract_fn_text(response):
     return response.text()
 
+def cache_control_max_age(headers: Dict) -> Optional[int]:
+    """
+    The max-age (in seconds) of a response's Cache-Control header.  no-cache and no-store are a max-age of 0.  None
+    when the response does not say.
+    """
+    directives = [directive.strip().lower() for directive in (headers.get('Cache-Control') or "").split(",")]
+    if 'no-cache' in directives or 'no-store' in directives:
+        return 0
+    for directive in directives:
+        name, _, value = directive.partition("=")
+        if name.strip() == 'max-age' and value.strip().strip('"').isdigit():
+            return int(value.strip().strip('"'))
+    return None
+
 def extract_by_content_type(response):
     """
     Looks for the content type in the response; e.g. application/json; charset=utf-8
@@ -50,6 +135,92 @@ def http_response_monad(step, extract_fn, response) -> Tuple[int, dict]:
                                     ctx=extract_fn(response.value),
                                     retryable=http_retryable_status(response.value.status_code)))
 
+@curry(3)
+def http_stream_monad(step, stream_fn, response) -> Tuple[int, Iterator]:
+    """
+    The streaming counterpart of http_response_monad.  A success is wrapped as (status, iterator), where the iterator is
+    produced by the stream_fn from the open response, and the response is closed when the iterator is exhausted (or
+    closed).  The body of a failure is read in full (error bodies are expected to be small) and closed.
+    """
+    if response.value.status_code in [200,201]:
+        return monad.Right((response.value.status_code, closing_stream(response.value, stream_fn)))
+    with response.value:
+        return http_response_monad(step, extract_by_content_type, response)
+
+
+def closing_stream(response, stream_fn: Callable) -> Iterator:
+    with response:
+        yield from stream_fn(response)
+
+
+def stream_fn_for(stream: str) -> Callable:
+    """
+    + ndjson.  An iterator of the decoded JSON values, one per line.
+    + json_array.  An iterator of the decoded elements of a top level JSON array, decoded incrementally.
+    + chunks.  An iterator of raw byte chunks.
+    """
+    return {'ndjson': stream_ndjson, 'json_array': stream_json_array, 'chunks': stream_chunks}[stream]
+
+
+def stream_chunks(response, chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    yield from response.iter_content(chunk_size=chunk_size)
+
+
+def stream_ndjson(response, chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE) -> Iterator[Any]:
+    for line in response.iter_lines(chunk_size=chunk_size):
+        if line.strip():
+            yield json.loads(line)
+
+
+def stream_json_array(response, chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE) -> Iterator[Any]:
+    """
+    Decodes the elements of a top level JSON array as the chunks arrive, holding only the undecoded remainder of the
+    body.  An element is only taken as decoded when a ',' or ']' follows it, so a value split across chunks (e.g. the
+    float '1.5' arriving as '1.' and '5') is not decoded early.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')()
+    buffer, pos, started = "", 0, False
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        buffer = buffer[pos:] + text_decoder.decode(chunk)
+        pos = 0
+        while True:
+            pos = skip_json_separators(buffer, pos)
+            if pos >= len(buffer):
+                break
+            if not started:
+                if buffer[pos] != '[':
+                    raise json.JSONDecodeError("Expecting a JSON array", buffer, pos)
+                started, pos = True, pos + 1
+                continue
+            if buffer[pos] == ']':
+                return
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break
+            if not json_value_delimited(buffer, end):
+                break
+            yield value
+            pos = end
+    raise json.JSONDecodeError("Unterminated JSON array", buffer, pos)
+
+
+def json_value_delimited(buffer: str, end: int) -> bool:
+    """
+    True when the next non-whitespace character after a decoded value is a ',' or ']'.  Anything else (including the
+    end of the buffer) may be the rest of the value, e.g. the '5' of '1.5' or the exponent of '2.5e3'.
+    """
+    pos = skip_json_separators(buffer, end, separators=" \t\r\n")
+    return pos < len(buffer) and buffer[pos] in ",]"
+
+
+def skip_json_separators(buffer: str, pos: int, separators: str = " \t\r\n,") -> int:
+    while pos < len(buffer) and buffer[pos] in separators:
+        pos += 1
+    return pos
+
+
 def http_retryable_status(code):
     return code >= 500
 
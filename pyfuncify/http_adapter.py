@@ -1,17 +1,61 @@
 import requests
-import backoff
-from typing import Dict, Tuple, Any
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Tuple, Any, List, Optional, Callable
 
-from . import monad, http, logger, circuit
+from . import monad, http, logger, circuit, http_pool, retry
 
-DEFAULT_MAX_RETRIES = 2
+DEFAULT_BATCH_WORKERS = 4
 
-def determine_retries():
-    return circuit.max_retries() or DEFAULT_MAX_RETRIES
+def resolve_request_options(request_options: Optional[http.RequestOptions], http_timeout: float) -> http.RequestOptions:
+    """
+    Request options take precedence.  Otherwise http_timeout applies to both the connect and read phases.
+    """
+    if request_options is not None:
+        return request_options
+    return http.RequestOptions(connect_timeout=http_timeout, read_timeout=http_timeout)
 
 
+def get_retry_predicate(monad_result: Any) -> bool:
+    """
+    Any get failure is retried, except when the call's deadline has passed.
+    """
+    return circuit.monad_failure_predicate(monad_result) and not isinstance(monad_result.error(), http.DeadlineExceeded)
+
+
+def deadline_guard():
+    """
+    Fails a call whose request_options deadline has already passed before it enters the circuit breaker, so the
+    caller's expired deadline is not counted as a failure of the (possibly healthy) upstream.
+    """
+    def inner(fn):
+        def guard(*args, **kwargs):
+            options = resolve_request_options(kwargs.get('request_options'), kwargs.get('http_timeout', 5.0))
+            if options.expired():
+                return http.deadline_exceeded(kwargs.get('name', __name__), options)
+            return fn(*args, **kwargs)
+        return guard
+    return inner
+
+
+def aio_deadline_guard():
+    """
+    deadline_guard for async fns.
+    """
+    def inner(fn):
+        async def guard(*args, **kwargs):
+            options = resolve_request_options(kwargs.get('request_options'), kwargs.get('http_timeout', 5.0))
+            if options.expired():
+                return http.deadline_exceeded(kwargs.get('name', __name__), options)
+            return await fn(*args, **kwargs)
+        return guard
+    return inner
+
+
+@deadline_guard()
 @circuit.circuit_breaker()
-@backoff.on_predicate(backoff.expo, circuit.http_retryable_monad_failure_predicate, max_tries=determine_retries(), jitter=None)
+@retry.retrying(circuit.http_retryable_monad_failure_predicate)
 def post(endpoint,
          body,
          auth=None,
@@ -19,25 +63,60 @@ def post(endpoint,
          encoding='json',
          circuit_state_provider=None,
          name: str = __name__,
-         http_timeout: float=5.0):
+         http_timeout: float=5.0,
+         request_options: http.RequestOptions = None,
+         retry_policy: retry.RetryPolicy = None):
+    options = resolve_request_options(request_options, http_timeout)
+    if options.expired():
+        return http.deadline_exceeded(name, options)
     return post_invoke(endpoint=endpoint,
                        headers=headers,
                        auth=auth,
                        body=body,
                        encoding=encoding,
                        name=name,
-                       http_timeout=http_timeout)
+                       request_options=options)
+
+@aio_deadline_guard()
+@circuit.aio_circuit_breaker()
+@retry.aio_retrying(circuit.http_retryable_monad_failure_predicate)
+async def aio_post(endpoint,
+                   body,
+                   auth=None,
+                   headers={},
+                   encoding='json',
+                   circuit_state_provider=None,
+                   name: str = __name__,
+                   http_timeout: float=5.0,
+                   request_options: http.RequestOptions = None,
+                   retry_policy: retry.RetryPolicy = None):
+    """
+    Async variant of post.  The request is made on a worker thread through the pooled session, so concurrent calls
+    (e.g. asyncio.gather over several downstream services) overlap rather than serialise.
+    """
+    options = resolve_request_options(request_options, http_timeout)
+    if options.expired():
+        return http.deadline_exceeded(name, options)
+    return await asyncio.to_thread(post_invoke,
+                                   endpoint=endpoint,
+                                   headers=headers,
+                                   auth=auth,
+                                   body=body,
+                                   encoding=encoding,
+                                   name=name,
+                                   request_options=options)
 
 @monad.monadic_try(name="http_adapter", exception_test_fn=http.http_response_monad(__name__, http.extract_by_content_type))
 @logger.with_perf_log(perf_log_type='http', name=__name__)
-def post_invoke(endpoint: str, headers: Dict, auth: Tuple, body: Any, encoding: str, name: str, http_timeout: float):
+def post_invoke(endpoint: str, headers: Dict, auth: Tuple, body: Any, encoding: str, name: str, request_options: http.RequestOptions):
     if encoding == 'json':
-        return requests.post(endpoint, auth=auth, headers=headers, json=body, timeout=http_timeout)
+        return http_pool.session_for(endpoint).post(endpoint, auth=auth, headers=headers, json=body, timeout=request_options.timeout())
     else:
-        return requests.post(endpoint, auth=auth, headers={**headers, **encoding_to_content_type(encoding)}, data=body, timeout=http_timeout)
+        return http_pool.session_for(endpoint).post(endpoint, auth=auth, headers={**headers, **encoding_to_content_type(encoding)}, data=body, timeout=request_options.timeout())
 
+@deadline_guard()
 @circuit.circuit_breaker()
-@backoff.on_predicate(backoff.expo, circuit.monad_failure_predicate, max_tries=determine_retries(), jitter=None)
+@retry.retrying(get_retry_predicate)
 def get(endpoint,
         auth=None,
         headers={},
@@ -45,14 +124,101 @@ def get(endpoint,
         name: str = __name__,
         http_timeout: float=5.0,
         exception_test_fn: callable=None,
-        error_cls: Any=None):
+        error_cls: Any=None,
+        request_options: http.RequestOptions = None,
+        retry_policy: retry.RetryPolicy = None,
+        stream: str = None):
+    """
+    + stream.  Optional.  'ndjson', 'json_array' or 'chunks'.  The body is not read; a success is wrapped as
+               (status, iterator), the iterator decoding the body as it is consumed.  See http.stream_fn_for.
+               Failures reading the body raise from the iterator.
+    """
+    return get_attempt(endpoint=endpoint,
+                       auth=auth,
+                       headers=headers,
+                       name=name,
+                       http_timeout=http_timeout,
+                       exception_test_fn=exception_test_fn,
+                       error_cls=error_cls,
+                       request_options=request_options,
+                       stream=stream)
+
+@deadline_guard()
+@circuit.circuit_breaker()
+@retry.retrying(circuit.http_retryable_monad_failure_predicate)
+def batch_get(endpoint,
+              auth=None,
+              headers={},
+              circuit_state_provider=None,
+              name: str = __name__,
+              http_timeout: float=5.0,
+              exception_test_fn: callable=None,
+              error_cls: Any=None,
+              request_options: http.RequestOptions = None,
+              retry_policy: retry.RetryPolicy = None):
+    """
+    The get of a batch.  Unlike get, only retryable failures (i.e. not 400-series responses) are retried, as with post.
+    """
+    return get_attempt(endpoint=endpoint,
+                       auth=auth,
+                       headers=headers,
+                       name=name,
+                       http_timeout=http_timeout,
+                       exception_test_fn=exception_test_fn,
+                       error_cls=error_cls,
+                       request_options=request_options)
+
+def get_attempt(endpoint,
+                auth,
+                headers,
+                name: str,
+                http_timeout: float,
+                exception_test_fn: callable,
+                error_cls: Any,
+                request_options: Optional[http.RequestOptions],
+                stream: str = None):
+    options = resolve_request_options(request_options, http_timeout)
+    if options.expired():
+        return http.deadline_exceeded(name, options)
     return get_invoke(endpoint=endpoint,
                       headers=headers,
                       auth=auth,
                       name=name,
-                      http_timeout=http_timeout,
-                      exception_test_fn=exception_test_fn,
-                      error_cls=error_cls)
+                      request_options=options,
+                      exception_test_fn=stream_test_fn(name, stream) if stream else exception_test_fn,
+                      error_cls=error_cls,
+                      stream=stream is not None)
+
+@aio_deadline_guard()
+@circuit.aio_circuit_breaker()
+@retry.aio_retrying(get_retry_predicate)
+async def aio_get(endpoint,
+                  auth=None,
+                  headers={},
+                  circuit_state_provider=None,
+                  name: str = __name__,
+                  http_timeout: float=5.0,
+                  exception_test_fn: callable=None,
+                  error_cls: Any=None,
+                  request_options: http.RequestOptions = None,
+                  retry_policy: retry.RetryPolicy = None,
+                  stream: str = None):
+    """
+    Async variant of get.  See aio_post.  A streamed body is read as its iterator is consumed, which blocks, so consume
+    it off the event loop; e.g. with asyncio.to_thread.
+    """
+    options = resolve_request_options(request_options, http_timeout)
+    if options.expired():
+        return http.deadline_exceeded(name, options)
+    return await asyncio.to_thread(get_invoke,
+                                   endpoint=endpoint,
+                                   headers=headers,
+                                   auth=auth,
+                                   name=name,
+                                   request_options=options,
+                                   exception_test_fn=stream_test_fn(name, stream) if stream else exception_test_fn,
+                                   error_cls=error_cls,
+                                   stream=stream is not None)
 
 
 @monad.monadic_try(name="http_adapter",
@@ -63,10 +229,72 @@ def get_invoke(endpoint: str,
                headers: Dict,
                auth: Tuple,
                name: str,
-               http_timeout: float,
+               request_options: http.RequestOptions,
                exception_test_fn: callable,
-               error_cls: Any):
-    return requests.get(endpoint, auth=auth)
+               error_cls: Any,
+               stream: bool = False):
+    return http_pool.session_for(endpoint).get(endpoint, auth=auth, headers=headers, timeout=request_options.timeout(), stream=stream)
+
+
+def stream_test_fn(name: str, stream: str) -> Callable:
+    return http.http_stream_monad(name, http.stream_fn_for(stream))
+
+
+@dataclass
+class RequestSpec:
+    """
+    A single request in a batch.  method is 'get' or 'post'.  A circuit_state_provider can be given per spec so that
+    each endpoint is protected by its own circuit.
+    """
+    endpoint: str
+    method: str = 'get'
+    headers: Dict = field(default_factory=dict)
+    body: Any = None
+    name: str = __name__
+    auth: Any = None
+    encoding: str = 'json'
+    circuit_state_provider: Any = None
+    http_timeout: float = 5.0
+    request_options: Optional[http.RequestOptions] = None
+    retry_policy: Optional[retry.RetryPolicy] = None
+
+
+def batch(specs: List[RequestSpec], max_workers: Optional[int] = None) -> List[monad.MEither]:
+    """
+    Executes the requests concurrently on at most max_workers threads, returning the results in the order of the
+    specs.  Each request goes through batch_get or post, so is subject to that fn's circuit breaker and retry policy;
+    neither retries a 400-series response.
+    > http_adapter.batch([RequestSpec(endpoint=a_url), RequestSpec(endpoint=b_url, method='post', body={'a': 1})])
+    """
+    if not specs:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers or DEFAULT_BATCH_WORKERS, len(specs))) as executor:
+        return list(executor.map(invoke_spec, specs))
+
+
+def invoke_spec(spec: RequestSpec) -> monad.MEither:
+    if spec.method.lower() == 'post':
+        return post(endpoint=spec.endpoint,
+                    body=spec.body,
+                    auth=spec.auth,
+                    headers=spec.headers,
+                    encoding=spec.encoding,
+                    circuit_state_provider=spec.circuit_state_provider,
+                    name=spec.name,
+                    http_timeout=spec.http_timeout,
+                    request_options=spec.request_options,
+                    retry_policy=spec.retry_policy)
+    if spec.method.lower() == 'get':
+        return batch_get(endpoint=spec.endpoint,
+                         auth=spec.auth,
+                         headers=spec.headers,
+                         circuit_state_provider=spec.circuit_state_provider,
+                         name=spec.name,
+                         http_timeout=spec.http_timeout,
+                         request_options=spec.request_options,
+                         retry_policy=spec.retry_policy,
+                         exception_test_fn=http.http_response_monad(spec.name, http.extract_by_content_type))
+    return monad.Left(http.HttpError(message="Unsupported batch method {}".format(spec.method), name=spec.name, code=500))
 
 
 def encoding_to_content_type(encoding):
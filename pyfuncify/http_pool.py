@@ -0,0 +1,140 @@
+"""
+Pooled HTTP sessions for the http_adapter.
+
+A requests.Session is created per endpoint host (scheme and netloc) on first use, and held by the module for the life of
+the Lambda container, so warm invocations reuse the open (keep-alive) TCP+TLS connections rather than opening a new
+connection for every token grant, JWKS fetch or downstream call.  As a session is shared by unrelated callers (and
+tokens), it does not hold cookies; a Set-Cookie on one response is not sent with later requests.
+
+Configure the pools before first use (the configuration applies to sessions created after it is set):
+> http_pool.HttpPoolConfiguration().configure(pool_maxsize=20, max_retries=1)
+
+Pool stats, per host, are available from pool_stats():
++ session_hits/session_misses.  Requests which reused/created the host's session.
++ connections.  Connections opened by the host's connection pools.
++ requests.  Requests made through the host's connection pools.
++ connection_reuse.  The proportion of requests made on an already open connection.
+"""
+
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+from http.cookiejar import DefaultCookiePolicy
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import singleton
+
+
+class HttpPoolConfiguration(singleton.Singleton):
+    pool_connections = 10  # The number of per-host urllib3 pools to cache
+    pool_maxsize = 10  # The number of connections to keep open per pool
+    pool_block = False  # When the pool is full, block rather than open (and discard) an extra connection
+    max_retries = 0  # Connection-level retries (connect and read errors).  Retries on HTTP status are the retry policy's concern
+    keep_alive = True
+    transport_factory = None
+
+    def configure(self,
+                  pool_connections: int = 10,
+                  pool_maxsize: int = 10,
+                  pool_block: bool = False,
+                  max_retries: int = 0,
+                  keep_alive: bool = True,
+                  transport_factory: Optional[Callable[[str], requests.Session]] = None):
+        """
+        + transport_factory.  Optional.  A callable which takes the host key (e.g. https://idp.example.com) and returns a
+                              requests.Session-like object.  Replaces the default pooled session.
+        """
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.max_retries = max_retries
+        self.keep_alive = keep_alive
+        self.transport_factory = transport_factory
+        pass
+
+
+class SessionPool(singleton.Singleton):
+    sessions = {}
+    stats = {}
+    lock = threading.Lock()
+
+    def session(self, endpoint: str) -> requests.Session:
+        key = host_key(endpoint)
+        with self.lock:
+            if key not in self.sessions:
+                self.sessions[key] = build_session(key, HttpPoolConfiguration())
+                self.stats[key] = {'session_hits': 0, 'session_misses': 1}
+            else:
+                self.stats[key]['session_hits'] += 1
+            return self.sessions[key]
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
+            self.stats.clear()
+        pass
+
+
+def session_for(endpoint: str) -> requests.Session:
+    return SessionPool().session(endpoint)
+
+
+def close_sessions():
+    SessionPool().close()
+    pass
+
+
+def host_key(endpoint: str) -> str:
+    url = urlsplit(endpoint)
+    return "{scheme}://{netloc}".format(scheme=url.scheme, netloc=url.netloc)
+
+
+def build_session(key: str, config: HttpPoolConfiguration) -> requests.Session:
+    if config.transport_factory:
+        return config.transport_factory(key)
+    session = requests.Session()
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    adapter = HTTPAdapter(pool_connections=config.pool_connections,
+                          pool_maxsize=config.pool_maxsize,
+                          pool_block=config.pool_block,
+                          max_retries=Retry(total=config.max_retries, status=0, redirect=0, raise_on_status=False))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if not config.keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
+
+
+def pool_stats() -> Dict[str, Dict]:
+    return {key: {**stats, **connection_stats(SessionPool().sessions.get(key, None))}
+            for key, stats in dict(SessionPool().stats).items()}
+
+
+def connection_stats(session) -> Dict:
+    pools = list(connection_pools(session))
+    connections = sum(getattr(pool, 'num_connections', 0) for pool in pools)
+    reqs = sum(getattr(pool, 'num_requests', 0) for pool in pools)
+    return {'connections': connections,
+            'requests': reqs,
+            'connection_reuse': (1 - (connections / reqs)) if reqs else None}
+
+
+def connection_pools(session):
+    if not isinstance(session, requests.Session):
+        return []
+    adapters = {id(adapter): adapter for adapter in session.adapters.values() if isinstance(adapter, HTTPAdapter)}
+    return [pool for adapter in adapters.values() for pool in adapter_pools(adapter)]
+
+
+def adapter_pools(adapter: HTTPAdapter) -> List:
+    """
+    The adapter's connection pools, through the (locked) mapping interface of the pool manager's pools.  A pool
+    evicted while being listed is skipped.  Reading a pool marks it as recently used; as the session is for a single
+    host, its adapter holds a pool per scheme and port, so this does not affect which pools are evicted in practice.
+    """
+    pools = adapter.poolmanager.pools
+    return [pool for pool in (pools.get(key) for key in pools.keys()) if pool is not None]
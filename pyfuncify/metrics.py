@@ -0,0 +1,187 @@
+from typing import Any, Callable, Dict, List, Optional, Protocol, Tuple
+from collections import deque
+import json
+import sys
+import threading
+import time
+
+from . import singleton
+
+"""
+Metrics for the circuit breaker and http_adapter retries, recorded to a pluggable sink.
+
+Metrics are recorded per circuit (the dimension 'circuit'; the provider's circuit_name, or the name of the call):
++ calls, successes, failures.  Counts of the calls made through the circuit breaker.
++ short_circuits.  Calls refused by an open circuit (or while the probes of a recovering circuit are in flight).
++ retries.  Retries made by the http_adapter's retry policy (first attempts are not counted).
++ state_transitions.  Changes of circuit state, with the additional dimension 'to_state'.
++ latency.  A histogram of call latency in milliseconds.
+
+No sink is configured by default, and nothing is recorded.
+
+> metrics.MetricsConfiguration().configure(sink=metrics.EmfMetricsSink(namespace="orders-service"))
+
+A sink provides count, observe and flush.  The app pipeline calls metrics.flush() at the end of the invocation.
+"""
+
+COUNT = 'Count'
+MILLISECONDS = 'Milliseconds'
+EMF_MAX_VALUES = 100  # The maximum number of values for a metric in an EMF document
+DEFAULT_MAX_HISTOGRAM_VALUES = 10_000  # The most recent values held per histogram by the InMemoryMetricsSink
+
+
+class MetricsSinkProtocol(Protocol):
+    def count(self, name: str, value: float, dimensions: Dict[str, str]) -> None:
+        ...
+
+    def observe(self, name: str, value: float, unit: str, dimensions: Dict[str, str]) -> None:
+        ...
+
+    def flush(self) -> None:
+        ...
+
+
+class MetricsConfiguration(singleton.Singleton):
+    sink = None
+
+    def configure(self, sink: Optional[MetricsSinkProtocol] = None):
+        self.sink = sink
+        pass
+
+
+class InMemoryMetricsSink:
+    """
+    Holds the counters and histograms in memory; for tests, or to export from the process by other means.  Each
+    histogram holds its most recent max_histogram_values values, so a warm container does not grow without bound.
+    > sink.counter('failures', circuit='token_service')
+    """
+    def __init__(self, max_histogram_values: int = DEFAULT_MAX_HISTOGRAM_VALUES):
+        self.counters = {}
+        self.histograms = {}
+        self.max_histogram_values = max_histogram_values
+        self.lock = threading.Lock()
+
+    def count(self, name: str, value: float, dimensions: Dict[str, str]) -> None:
+        with self.lock:
+            key = metric_key(name, dimensions)
+            self.counters[key] = self.counters.get(key, 0) + value
+        pass
+
+    def observe(self, name: str, value: float, unit: str, dimensions: Dict[str, str]) -> None:
+        with self.lock:
+            self.histograms.setdefault(metric_key(name, dimensions), deque(maxlen=self.max_histogram_values)).append(value)
+        pass
+
+    def flush(self) -> None:
+        pass
+
+    def counter(self, name: str, **dimensions) -> float:
+        return self.counters.get(metric_key(name, dimensions), 0)
+
+    def histogram(self, name: str, **dimensions) -> List[float]:
+        return list(self.histograms.get(metric_key(name, dimensions), []))
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+        pass
+
+
+class EmfMetricsSink:
+    """
+    Aggregates the metrics of the invocation and, on flush, writes a CloudWatch Embedded Metric Format log line for
+    each set of dimensions.  Counters are summed; histogram values are written as a list of values.  EMF allows at
+    most EMF_MAX_VALUES values for a metric in a document, so larger histograms are split across several documents
+    (the counters being written in the first).
+    """
+    def __init__(self, namespace: str, writer: Callable[[str], Any] = None):
+        self.namespace = namespace
+        self.writer = writer or write_line
+        self.counters = {}
+        self.histograms = {}
+        self.units = {}
+        self.lock = threading.Lock()
+
+    def count(self, name: str, value: float, dimensions: Dict[str, str]) -> None:
+        with self.lock:
+            metrics = self.counters.setdefault(dimension_key(dimensions), {})
+            metrics[name] = metrics.get(name, 0) + value
+            self.units[name] = COUNT
+        pass
+
+    def observe(self, name: str, value: float, unit: str, dimensions: Dict[str, str]) -> None:
+        with self.lock:
+            self.histograms.setdefault(dimension_key(dimensions), {}).setdefault(name, []).append(value)
+            self.units[name] = unit
+        pass
+
+    def flush(self) -> None:
+        with self.lock:
+            counters, histograms = self.counters, self.histograms
+            self.counters, self.histograms = {}, {}
+        for dimensions in set(counters) | set(histograms):
+            for values in emf_values(counters.get(dimensions, {}), histograms.get(dimensions, {})):
+                self.writer(json.dumps(self.emf_document(dict(dimensions), values)))
+        pass
+
+    def emf_document(self, dimensions: Dict[str, str], values: Dict[str, Any]) -> Dict:
+        return {'_aws': {'Timestamp': int(time.time() * 1000),
+                         'CloudWatchMetrics': [{'Namespace': self.namespace,
+                                                'Dimensions': [sorted(dimensions.keys())],
+                                                'Metrics': [{'Name': name, 'Unit': self.units.get(name, COUNT)} for name in values]}]},
+                **dimensions,
+                **values}
+
+
+def emf_values(counters: Dict[str, float], histograms: Dict[str, List[float]]) -> List[Dict[str, Any]]:
+    """
+    The metric values of each EMF document for a set of dimensions; the histograms in chunks of EMF_MAX_VALUES.
+    """
+    chunks = max([-(-len(values) // EMF_MAX_VALUES) for values in histograms.values()] + [1])
+    return [{**(counters if chunk == 0 else {}),
+             **{name: values[chunk * EMF_MAX_VALUES:(chunk + 1) * EMF_MAX_VALUES]
+                for name, values in histograms.items() if len(values) > chunk * EMF_MAX_VALUES}}
+            for chunk in range(chunks)]
+
+
+def count(name: str, dimensions: Dict[str, str], value: float = 1) -> None:
+    sink = MetricsConfiguration().sink
+    if sink is not None:
+        sink.count(name, value, dimensions)
+    pass
+
+
+def observe(name: str, value: float, dimensions: Dict[str, str], unit: str = MILLISECONDS) -> None:
+    sink = MetricsConfiguration().sink
+    if sink is not None:
+        sink.observe(name, value, unit, dimensions)
+    pass
+
+
+def flush() -> None:
+    sink = MetricsConfiguration().sink
+    if sink is not None:
+        sink.flush()
+    pass
+
+
+def enabled() -> bool:
+    return MetricsConfiguration().sink is not None
+
+
+def circuit_dimensions(circuit_state_provider: Any, name: Optional[str]) -> Dict[str, str]:
+    return {'circuit': str(getattr(circuit_state_provider, 'circuit_name', None) or name)}
+
+
+def metric_key(name: str, dimensions: Dict[str, str]) -> Tuple:
+    return (name, dimension_key(dimensions))
+
+
+def dimension_key(dimensions: Dict[str, str]) -> Tuple:
+    return tuple(sorted(dimensions.items()))
+
+
+def write_line(line: str) -> None:
+    sys.stdout.write(line + "\n")
+    pass
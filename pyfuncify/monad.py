@@ -1,7 +1,9 @@
 from typing import List, Self
-import traceback
+from collections import namedtuple
 from pymonad.operators.either import Either
-from typing import TypeVar, Callable, Union, Any, Generic
+from typing import TypeVar, Callable, Union, Any, Generic, Awaitable, Tuple
+
+from . import aio, error
 
 T = TypeVar('T')
 
@@ -10,7 +12,57 @@ class EitherMonad(Generic[T]):
     pass
 
 
-class MEither(Either):
+class MEither(Generic[T]):
+    """
+    A slotted Either.  Behaviour compatible with the pymonad Either it replaces (value, monoid, is_right, is_left, bind,
+    map, then, either and >>), without pymonad's generic monad machinery on each construction and bind.
+
+    Like pymonad, the state is held as (value, monoid); a Right is (value, (None, True)) and a Left is (None, (value, False)).
+    """
+    __slots__ = ('value', 'monoid')
+
+    def __init__(self, value, monoid):
+        self.value = value
+        self.monoid = monoid
+
+    @classmethod
+    def insert(cls, value: T) -> 'MEither':
+        return cls(value, (None, True))
+
+    def is_right(self) -> bool:
+        return self.monoid[1]
+
+    def is_left(self) -> bool:
+        return not self.monoid[1]
+
+    def bind(self, kleisli_function: Callable) -> 'MEither':
+        if self.monoid[1]:
+            return kleisli_function(self.value)
+        return self
+
+    def __rshift__(self, kleisli_function: Callable) -> 'MEither':
+        if self.monoid[1]:
+            return kleisli_function(self.value)
+        return self
+
+    def map(self, function: Callable) -> 'MEither':
+        if self.monoid[1]:
+            return self.__class__(function(self.value), (None, True))
+        return self
+
+    def then(self, function: Callable) -> 'MEither':
+        """
+        Binds when the function returns an MEither, otherwise maps.
+        """
+        if not self.monoid[1]:
+            return self
+        result = function(self.value)
+        return result if isinstance(result, MEither) else self.__class__(result, (None, True))
+
+    def either(self, left_function: Callable, right_function: Callable):
+        if self.monoid[1]:
+            return right_function(self.value)
+        return left_function(self.monoid[0])
 
     def __or__(self, fns):
         """
@@ -21,11 +73,49 @@ class MEither(Either):
 
     # Lifts the Either; returning the wrapped value regardless of Left or Right
     def lift(self):
-        return self.value if self.is_right() else self.monoid[0]
+        return self.value if self.monoid[1] else self.monoid[0]
 
     def error(self):
         return self.monoid[0]
 
+    def aio_bind(self, fn: Callable) -> 'AioEither':
+        """
+        An awaitable bind.  The fn may be sync or async, and further steps can be chained with >>; e.g.
+        > await (request.aio_bind(log_start) >> params_parser >> route_invoker)
+        """
+        return AioEither(self, (fn,))
+
+    def __eq__(self, other):
+        return isinstance(other, MEither) and self.value == other.value and self.monoid == other.monoid
+
+    def __repr__(self):
+        return f'Right {self.value}' if self.monoid[1] else f'Left {self.monoid[0]}'
+
+
+class AioEither:
+    """
+    An awaitable Either.  Binding with >> adds the step to the chain without calling it.  The chain is run in order when
+    awaited; once a step returns a Left the remaining steps are not called, so no coroutines are created for them.
+    """
+
+    def __init__(self, either: Union[Either, Awaitable[Either]], steps: Tuple[Callable, ...] = ()):
+        self.either = either
+        self.steps = steps
+
+    def __rshift__(self, fn: Callable) -> 'AioEither':
+        return AioEither(self.either, self.steps + (fn,))
+
+    def __await__(self):
+        return self.resolve().__await__()
+
+    async def resolve(self) -> Either:
+        result = await aio.maybe_await(self.either)
+        for step in self.steps:
+            if result.is_left():
+                return result
+            result = await aio.maybe_await(step(result.value))
+        return result
+
 
 def Left(value: Either[T, T]) -> Either[T, T]:  # pylint: disable=invalid-name
     """ Creates a value of the first possible type in the Either monad. """
@@ -49,11 +139,16 @@ def maybe_value_fail(value: Either) -> bool:
     return value.is_left()
 
 
+# The monadic_try configuration; resolved once at decoration, and only re-resolved for a call which provides kwargs
+TryConfig = namedtuple('TryConfig', ['name', 'status', 'exception_test_fn', 'error_cls', 'error_result_fn', 'error_result_fn_arg'])
+
+
 def monadic_try(name: str = None,
                 status: int = None,
                 exception_test_fn: Callable[[Either], Either] = None,
                 error_cls: Any = None,
-                error_result_fn: Callable = None):
+                error_result_fn: Callable = None,
+                overridable: bool = True):
     """
     Monadic Try Decorator.  Decorate any function which might return an exception.  When the function does not return an exception,
     the decorator wraps the result in a Right(), otherwise, it wraps the exception in a Left()
@@ -67,6 +162,12 @@ def monadic_try(name: str = None,
                            This fn can also be obtained from the expectation_fn to the main fn in the first instance
         error_result_fn:   A function whose result will be returned in the exception flow.  It takes a built exception (either str or error_cls).
                            If it takes an injected arg (error_result_fn_arg from main fn), it should be partially applied.
+        overridable:       When True (the default), the name, exception_test_fn, error_cls, error_result_fn and error_result_fn_arg
+                           may be provided as kwargs to the call, overriding the decorator's configuration.  When False, the kwargs are
+                           never inspected and the configuration resolved at decoration time is always used.
+
+    The traceback provided to the error_cls is an error.LazyTraceback; it is only formatted when it is read (e.g. by error.print()),
+    so an expected failure costs little more than raising the exception.
 
     The @monadic_try(name="step") is really syntax sugar for:
         $ monadic_try(name="x")(fn)(args)
@@ -75,25 +176,15 @@ def monadic_try(name: str = None,
     """
 
     def inner(fn):
+        config = TryConfig(name or fn.__name__, status, exception_test_fn, error_cls, error_result_fn, None)
+
         def try_it(*args, **kwargs):
+            call_config = resolve_try_config(config, kwargs) if overridable and kwargs else config
             try:
                 result = Right(fn(*args, **kwargs))
-                test_fn = kwargs.get('exception_test_fn', exception_test_fn)
-                return test_fn(result) if test_fn else result
+                return call_config.exception_test_fn(result) if call_config.exception_test_fn else result
             except Exception as e:
-                ex_cls = kwargs.get('error_cls', None) or error_cls
-
-                error_result = Left(ex_cls(message=str(e),
-                                           name=(kwargs.get('name', None) or name or fn.__name__),
-                                           code=status, klass=str(e.__class__),
-                                           traceback=traceback.format_exc())) if ex_cls else Left(str(e))
-
-                return_fn = kwargs.get('error_result_fn', error_result_fn)
-                if not return_fn:
-                    return error_result
-
-                injected_arg = kwargs.get('error_result_fn_arg', None)
-                return return_fn(injected_arg, error_result)
+                return try_failure(e, call_config)
 
         return try_it
 
@@ -104,34 +195,53 @@ def aio_monadic_try(name: str = None,
                     status: int = None,
                     exception_test_fn: Callable[[Either], Either] = None,
                     error_cls: Any = None,
-                    error_result_fn: Callable = None):
+                    error_result_fn: Callable = None,
+                    overridable: bool = True):
     def inner(f):
+        config = TryConfig(name or f.__name__, status, exception_test_fn, error_cls, error_result_fn, None)
+
         async def try_it(*args, **kwargs):
+            call_config = resolve_try_config(config, kwargs) if overridable and kwargs else config
             try:
                 result = Right(await f(*args, **kwargs))
-                test_fn = kwargs.get('exception_test_fn', exception_test_fn)
-                return test_fn(result) if test_fn else result
+                return call_config.exception_test_fn(result) if call_config.exception_test_fn else result
             except Exception as e:
-                ex_cls = kwargs.get('error_cls', None) or error_cls
-
-                error_result = Left(ex_cls(message=str(e),
-                                           name=(kwargs.get('name', None) or name or f.__name__),
-                                           code=status, klass=str(e.__class__),
-                                           request_kwargs=kwargs,
-                                           traceback=traceback.format_exc())) if ex_cls else Left(str(e))
-
-                return_fn = kwargs.get('error_result_fn', error_result_fn)
-                if not return_fn:
-                    return error_result
-
-                injected_arg = kwargs.get('error_result_fn_arg', None)
-                return return_fn(injected_arg, error_result)
+                return try_failure(e, call_config, request_kwargs=kwargs)
 
         return try_it
 
     return inner
 
 
+def resolve_try_config(config: TryConfig, kwargs: dict) -> TryConfig:
+    return TryConfig(name=kwargs.get('name', None) or config.name,
+                     status=config.status,
+                     exception_test_fn=kwargs.get('exception_test_fn', config.exception_test_fn),
+                     error_cls=kwargs.get('error_cls', None) or config.error_cls,
+                     error_result_fn=kwargs.get('error_result_fn', config.error_result_fn),
+                     error_result_fn_arg=kwargs.get('error_result_fn_arg', None))
+
+
+def try_failure(e: Exception, config: TryConfig, request_kwargs: dict = None) -> Any:
+    if not config.error_cls:
+        error_result = Left(str(e))
+    elif request_kwargs is None:
+        error_result = Left(config.error_cls(message=str(e),
+                                             name=config.name,
+                                             code=config.status, klass=str(e.__class__),
+                                             traceback=error.LazyTraceback(e)))
+    else:
+        error_result = Left(config.error_cls(message=str(e),
+                                             name=config.name,
+                                             code=config.status, klass=str(e.__class__),
+                                             request_kwargs=request_kwargs,
+                                             traceback=error.LazyTraceback(e)))
+
+    if not config.error_result_fn:
+        return error_result
+    return config.error_result_fn(config.error_result_fn_arg, error_result)
+
+
 Try = monadic_try
 
 AIOTry = aio_monadic_try
@@ -0,0 +1,213 @@
+from typing import Any, Callable, Dict, Optional
+from dataclasses import dataclass
+import asyncio
+import random
+import threading
+import time
+
+from . import singleton, circuit, logger, http_pool, metrics
+
+"""
+Per-call retry policy for the http_adapter.
+
+The policy is resolved when the call is made (rather than when the module is imported), from, in order of precedence:
+1. The retry_policy kwarg of the call.
+2. The policy configured for the endpoint's host.
+3. The default policy.
+
+> retry.RetryConfiguration().configure(policy=retry.RetryPolicy(max_tries=3, budget_seconds=2.0),
+                                       endpoint_policies={'https://idp.example.com': retry.RetryPolicy(max_tries=1)})
+
+Delays between attempts use decorrelated jitter; each delay is a random value between base_delay and 3 times the
+previous delay, capped at max_delay.  Retries stop when max_tries is reached, when the next delay would take the call
+past its time budget (or past the deadline of its request_options), or when the host's retry token bucket is empty.
+
+The token bucket is held for the life of the container.  Each retry takes a token, and each successful call returns a
+fraction of a token, so during a downstream outage retries are shed once the bucket is drained rather than multiplying
+the outbound request volume by max_tries.
+"""
+
+DEFAULT_MAX_TRIES = 2
+DEFAULT_BUCKET_CAPACITY = 10.0
+DEFAULT_BUCKET_REFILL = 0.1
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    + max_tries.  The total number of attempts.  When None, circuit.max_retries() (or DEFAULT_MAX_TRIES) is used.
+    + jitter.  'decorrelated' or None.  When None, delays double from base_delay.
+    + budget_seconds.  Optional.  The total time, from the first attempt, within which a retry can start.
+    + retry_cost.  The number of tokens a retry takes from the host's bucket.  0 disables the bucket.
+    """
+    max_tries: Optional[int] = None
+    base_delay: float = 0.1
+    max_delay: float = 2.0
+    jitter: Optional[str] = 'decorrelated'
+    budget_seconds: Optional[float] = None
+    retry_cost: float = 1.0
+
+
+class RetryTokenBucket:
+    def __init__(self, capacity: float = DEFAULT_BUCKET_CAPACITY, refill: float = DEFAULT_BUCKET_REFILL):
+        self.capacity = capacity
+        self.refill = refill
+        self.tokens = capacity
+        self.lock = threading.Lock()
+
+    def acquire(self, cost: float) -> bool:
+        with self.lock:
+            if self.tokens < cost:
+                return False
+            self.tokens -= cost
+            return True
+
+    def success(self):
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + self.refill)
+        pass
+
+
+class RetryConfiguration(singleton.Singleton):
+    policy = RetryPolicy()
+    endpoint_policies = {}
+    bucket_capacity = DEFAULT_BUCKET_CAPACITY
+    bucket_refill = DEFAULT_BUCKET_REFILL
+    buckets = {}
+    lock = threading.Lock()
+
+    def configure(self,
+                  policy: RetryPolicy = None,
+                  endpoint_policies: Dict[str, RetryPolicy] = None,
+                  bucket_capacity: float = DEFAULT_BUCKET_CAPACITY,
+                  bucket_refill: float = DEFAULT_BUCKET_REFILL):
+        """
+        + endpoint_policies.  Optional.  Policies keyed by host; e.g. {'https://idp.example.com': RetryPolicy(max_tries=1)}
+        + bucket_capacity/bucket_refill.  The retry tokens held per host, and the tokens returned on each success.
+        """
+        self.policy = policy or RetryPolicy()
+        self.endpoint_policies = endpoint_policies or {}
+        self.bucket_capacity = bucket_capacity
+        self.bucket_refill = bucket_refill
+        self.buckets.clear()
+        pass
+
+    def bucket(self, key: str) -> RetryTokenBucket:
+        bucket = self.buckets.get(key, None)
+        if bucket is None:
+            with self.lock:
+                bucket = self.buckets.setdefault(key, RetryTokenBucket(self.bucket_capacity, self.bucket_refill))
+        return bucket
+
+
+class Retry:
+    """
+    The retry state of a single call.  next_delay returns the delay before the next attempt, or None when the call
+    should not be retried.
+    """
+    def __init__(self, policy: RetryPolicy, bucket: RetryTokenBucket, remaining_fn: Callable[[], Optional[float]]):
+        self.policy = policy
+        self.bucket = bucket
+        self.remaining_fn = remaining_fn
+        self.max_tries = policy.max_tries or circuit.max_retries() or DEFAULT_MAX_TRIES
+        self.started = time.monotonic()
+        self.tries = 1
+        self.delay = None
+
+    def next_delay(self) -> Optional[float]:
+        if self.tries >= self.max_tries:
+            return None
+        delay = jittered_delay(self.policy, self.delay)
+        if not within_budget(self.policy, self.started, self.remaining_fn(), delay):
+            return None
+        if self.policy.retry_cost and not self.bucket.acquire(self.policy.retry_cost):
+            return None
+        self.tries += 1
+        self.delay = delay
+        return delay
+
+    def completed(self, result: Any):
+        if hasattr(result, 'is_right') and result.is_right():
+            self.bucket.success()
+        pass
+
+
+def retrying(predicate: Callable[[Any], bool]):
+    """
+    Retry Decorator.  Retries the fn while the predicate holds for its result, under the policy resolved for the call.
+    The kwargs of the wrapped fn are expected to include the endpoint, and MAY include a retry_policy and request_options.
+    """
+    def inner(fn):
+        def retrier(*args, **kwargs):
+            retry = retry_for(kwargs)
+            while True:
+                result = fn(*args, **kwargs)
+                delay = retry.next_delay() if predicate(result) else None
+                if delay is None:
+                    retry.completed(result)
+                    return result
+                record_retry(kwargs, retry, delay)
+                time.sleep(delay)
+        return retrier
+    return inner
+
+
+def aio_retrying(predicate: Callable[[Any], bool]):
+    """
+    Retry Decorator for async fns.  See retrying.
+    """
+    def inner(fn):
+        async def retrier(*args, **kwargs):
+            retry = retry_for(kwargs)
+            while True:
+                result = await fn(*args, **kwargs)
+                delay = retry.next_delay() if predicate(result) else None
+                if delay is None:
+                    retry.completed(result)
+                    return result
+                record_retry(kwargs, retry, delay)
+                await asyncio.sleep(delay)
+        return retrier
+    return inner
+
+
+def retry_for(kwargs: Dict) -> Retry:
+    key = host_key(kwargs.get('endpoint', None))
+    request_options = kwargs.get('request_options', None)
+    return Retry(policy=policy_for(key, kwargs.get('retry_policy', None)),
+                 bucket=RetryConfiguration().bucket(key),
+                 remaining_fn=request_options.remaining if request_options is not None else lambda: None)
+
+
+def policy_for(key: str, call_policy: Optional[RetryPolicy] = None) -> RetryPolicy:
+    if call_policy is not None:
+        return call_policy
+    return RetryConfiguration().endpoint_policies.get(key, RetryConfiguration().policy)
+
+
+def host_key(endpoint: Optional[str]) -> str:
+    return http_pool.host_key(endpoint) if endpoint else ""
+
+
+def jittered_delay(policy: RetryPolicy, previous_delay: Optional[float]) -> float:
+    if policy.jitter == 'decorrelated':
+        return min(policy.max_delay, random.uniform(policy.base_delay, (previous_delay or policy.base_delay) * 3))
+    return min(policy.max_delay, policy.base_delay if previous_delay is None else previous_delay * 2)
+
+
+def within_budget(policy: RetryPolicy, started: float, remaining: Optional[float], delay: float) -> bool:
+    """
+    A retry must be able to start within the policy's budget, and before the call's deadline.
+    """
+    if policy.budget_seconds is not None and (time.monotonic() - started + delay) >= policy.budget_seconds:
+        return False
+    return remaining is None or delay < remaining
+
+
+def record_retry(kwargs: Dict, retry: Retry, delay: float):
+    metrics.count('retries', metrics.circuit_dimensions(circuit.get_a_provider(kwargs, circuit.CircuitConfiguration()),
+                                                        kwargs.get('name', None)))
+    logger.info(msg='HTTP Retry',
+                ctx={'name': kwargs.get('name', None), 'endpoint': kwargs.get('endpoint', None), 'try': retry.tries,
+                     'delay': delay})
+    pass
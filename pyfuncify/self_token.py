@@ -1,5 +1,11 @@
-from typing import Tuple, Callable, Any, Protocol
-from simple_memory_cache import GLOBAL_CACHE
+from typing import Tuple, Callable, Any, Protocol, Optional, List
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pymonad.tools import curry
+from simple_memory_cache import CachedVar, NO_VALUE_STORED
+import functools
+import hashlib
+import threading
 
 from . import chronos, monad, http_adapter, crypto, random_retry_window, logger, singleton, circuit
 from .tracer import Tracer
@@ -7,13 +13,40 @@ from .tracer import Tracer
 expected_envs = ['client_id',
                  'client_secret']
 
-token_cache = GLOBAL_CACHE.MemoryCachedVar('token_cache')
 
 BEARER_TOKEN = "BEARER_TOKEN"  # Name of bearer token in PS
 
+DEFAULT_AUDIENCE = 'https://api.jarden.io'
+DEFAULT_SCOPES = 'openid'
+DEFAULT_TOKEN_WORKERS = 4
+
+PARSED_TOKEN_CACHE_SIZE = 8  # The current token, and those it replaced or is being replaced by
+
 _CTX = {}
 
 
+class TokenCacheVar(CachedVar):
+    """
+    A simple_memory_cache CachedVar held in memory, which can also be set; so a refreshed token can be swapped in.
+    """
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.value = NO_VALUE_STORED
+
+    def _get_stored_value(self):
+        return self.value
+
+    def _set_stored_value(self, value):
+        self.value = value
+
+    def set(self, value):
+        self._set_stored_value(value)
+        pass
+
+
+token_cache = TokenCacheVar('token_cache')
+
+
 class Error(Exception):
     def __init__(self, message="", name="", ctx={}, code=500, klass="", retryable=False):
         self.code = 500 if code is None else code
@@ -65,60 +98,257 @@ The token config is setup by the library caller to provide 4 arguments:
 + window_width.  Int in seconds defining the width of the token getting window (used for randomly selecting a position to reduce
                  competing lambdas from obtaining the token at the same time).
 + expiry_threshold. Int in seconds.  The number of seconds before the token expires that it will be refreshed.
++ background_refresh.  Bool.  When True, a token in the retry window (but not expired) continues to be served while
+                       its replacement is obtained (and persisted) on a background thread; one refresh at a time per
+                       token.  Otherwise the replacement is obtained on the request path.
++ refresh_wait.  Float in seconds.  At the end of the invocation the app pipeline waits (up to this long for each token)
+                 for the background refreshes in flight, as Lambda freezes background threads between invocations.
+
+Tokens for other audiences, scopes or clients are obtained with token_for (or token with a TokenKey).  Each has its own
+cache entry, persistence key, retry window and refresh.  A named client's credentials are provided by the env:
+   + client_credentials.  Optional.  Takes the client name and returns a tuple of its client id and client secret.
 """
 
 
+@dataclass(frozen=True)
+class TokenKey:
+    """
+    Identifies a token by the audience and scopes requested, and the client making the client credentials grant.  The
+    client is a name resolved to credentials by the env's client_credentials; None is the env's client_id and
+    client_secret.
+    """
+    audience: str = DEFAULT_AUDIENCE
+    scopes: str = DEFAULT_SCOPES
+    client: Optional[str] = None
+
+    def is_default(self) -> bool:
+        return self == DEFAULT_TOKEN_KEY
+
+    def persistence_key(self) -> str:
+        """
+        The default token is persisted as BEARER_TOKEN.  Other tokens are suffixed with a digest of the key; safe for
+        use in a parameter store name.
+        """
+        if self.is_default():
+            return BEARER_TOKEN
+        digest = hashlib.sha256(repr((self.client, self.audience, self.scopes)).encode('utf-8')).hexdigest()
+        return "{}_{}".format(BEARER_TOKEN, digest[:16])
+
+
+DEFAULT_TOKEN_KEY = TokenKey()
+
+
 class TokenConfig(singleton.Singleton):
     default_window_width = (60 * 60)  # chance of refreshing token within 1 hour band
     default_expiry_threshold = (60 * 60)  # The room to leave before the actual token expiry
+    default_refresh_wait = 2.0  # The seconds the end of an invocation waits for each background refresh in flight
+    refresh_wait = default_refresh_wait
 
     def configure(self,
                   token_persistence_provider: TokenPersistenceProviderProtocol,
                   env: Any,
                   circuit_state_provider: circuit.CircuitStateProviderProtocol = None,
                   window_width: int = default_window_width,
-                  expiry_threshold: int = default_expiry_threshold) -> None:
+                  expiry_threshold: int = default_expiry_threshold,
+                  background_refresh: bool = False,
+                  refresh_wait: float = default_refresh_wait) -> None:
         self.token_persistence_provider = token_persistence_provider
         self.env = env
         self.circuit_state_provider = circuit_state_provider
         self.window_width = window_width
         self.expiry_threshold = expiry_threshold
+        self.background_refresh = background_refresh
+        self.refresh_wait = refresh_wait
         pass
 
 
-def token(tracer: Tracer = None):
+class TokenRefresh:
+    """
+    The background refresh of a token; at most one in flight.
+    """
+    def __init__(self, token_key: TokenKey):
+        self.token_key = token_key
+        self.lock = threading.Lock()
+        self.worker = None
+
+    def start(self) -> bool:
+        with self.lock:
+            if self.in_flight():
+                return False
+            self.worker = threading.Thread(target=refresh_token, args=(self.token_key,), name="self_token_refresh", daemon=True)
+            self.worker.start()
+        return True
+
+    def in_flight(self) -> bool:
+        return self.worker is not None and self.worker.is_alive()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        worker = self.worker
+        if worker is not None:
+            worker.join(timeout)
+        return not self.in_flight()
+
+
+class ManagedToken:
+    """
+    The cache entry and refresh of a token.  The lock serialises the acquisition of the token, so concurrent calls for
+    the same token make a single grant, while tokens for other keys are acquired concurrently.
+    """
+    def __init__(self, token_key: TokenKey, cache_var: Any = None):
+        self.token_key = token_key
+        self.lock = threading.RLock()
+        self.refresh = TokenRefresh(token_key)
+        if cache_var is None:
+            cache_var = TokenCacheVar("token_cache_{}".format(token_key.persistence_key()))
+            cache_var.on_first_access(functools.partial(get_token, token_key))
+        self.cache = cache_var
+
+    def swap(self, result: monad.MEither) -> monad.MEither:
+        """
+        Replaces the cached token; the lock orders the swap with acquisitions.
+        """
+        with self.lock:
+            self.cache.set(result)
+        return result
+
+
+class TokenManager(singleton.Singleton):
+    """
+    The ManagedToken of each TokenKey.  The default token is cached in token_cache.
+    """
+    entries = {}
+    lock = threading.Lock()
+
+    def managed(self, token_key: TokenKey) -> ManagedToken:
+        entry = self.entries.get(token_key)
+        if entry is not None:
+            return entry
+        with self.lock:
+            if token_key not in self.entries:
+                self.entries[token_key] = ManagedToken(token_key, token_cache if token_key.is_default() else None)
+            return self.entries[token_key]
+
+    def invalidate(self):
+        for entry in list(self.entries.values()):
+            entry.cache.invalidate()
+        pass
+
+
+def token(tracer: Tracer = None, token_key: TokenKey = DEFAULT_TOKEN_KEY):
     _CTX['tracer'] = tracer
-    if not env_set_up(TokenConfig().env):
+    if not env_set_up(TokenConfig().env, token_key):
         return monad.Left(TokenEnvError(message="Token can not the retrieved due to a failure in env setup"))
-    result = get()
-    if result.is_right() and (result.value.expired() or in_token_retry_window(result.value)):
+    result = get(token_key)
+    if result.is_left():
+        return result
+    expired, in_window = result.value.expired(), in_token_retry_window(result.value)
+    if not expired and in_window and background_refresh():
+        start_background_refresh(token_key)
+        return result
+    if expired or in_window:
         logger.info(msg='Self Token Cache Miss',
-                    ctx={'expired': result.value.expired(), 'in_window': in_token_retry_window(result.value)},
+                    ctx={'expired': expired, 'in_window': in_window, 'audience': token_key.audience},
                     tracer=tracer_from_ctx())
-        invalidate_cache()
-        return get()
+        invalidate_cache(token_key)
+        return get(token_key)
     return result
 
 
-def get():
-    result = cacheable_token()
+def token_for(audience: str, scopes: str = DEFAULT_SCOPES, client: Optional[str] = None, tracer: Tracer = None):
+    """
+    The token for the audience and scopes, obtained by the client.
+    > self_token.token_for(audience="https://payments.example.com", scopes="payments:write")
+    """
+    return token(tracer=tracer, token_key=TokenKey(audience=audience, scopes=scopes, client=client))
+
+
+def tokens(token_keys: List[TokenKey], tracer: Tracer = None, max_workers: Optional[int] = None) -> List[monad.MEither]:
+    """
+    Obtains the tokens concurrently on at most max_workers threads, returning the results in the order of the keys.
+    """
+    if not token_keys:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers or DEFAULT_TOKEN_WORKERS, len(token_keys))) as executor:
+        return list(executor.map(lambda token_key: token(tracer=tracer, token_key=token_key), token_keys))
+
+
+def get(token_key: TokenKey = DEFAULT_TOKEN_KEY):
+    result = cacheable_token(token_key)
     if result.is_right():
-        return crypto.parse_generate_id_token(result.value)
+        return parsed_token(result.value)
     else:
         return result
 
 
-def cacheable_token():
-    return token_cache.get()
+@functools.lru_cache(maxsize=PARSED_TOKEN_CACHE_SIZE)
+def parsed_token(serialised_jwt: str) -> monad.MEither:
+    """
+    The IdToken (claims decoded, signature not verified) of the serialised JWT, memoised per serialised token, so each
+    token is decoded once however many times it is checked for validity and its retry window.
+    """
+    return crypto.parse_generate_id_token(serialised_jwt)
+
+
+def background_refresh() -> bool:
+    return TokenConfig().background_refresh
+
+
+def start_background_refresh(token_key: TokenKey = DEFAULT_TOKEN_KEY) -> bool:
+    """
+    Starts the refresh of the token on a background thread, unless one is already in flight.
+    """
+    started = TokenManager().managed(token_key).refresh.start()
+    if started:
+        logger.info(msg='Self Token Background Refresh', ctx={'audience': token_key.audience}, tracer=tracer_from_ctx())
+    return started
+
+
+def wait_for_refresh(timeout: Optional[float] = None) -> bool:
+    """
+    Waits for the background refreshes in flight; e.g. before the end of the invocation, as Lambda freezes background
+    threads between invocations.  The timeout applies to each token.  Returns False when a refresh is still in flight
+    after the timeout.
+    """
+    return all([entry.refresh.wait(timeout) for entry in list(TokenManager().entries.values())])
+
+
+def wait_for_refresh_at_end_of_invocation() -> bool:
+    """
+    Waits, for at most the configured refresh_wait for each token, for the background refreshes in flight.  Called by
+    the app pipeline, so a refresh is not frozen part way through its grant and resumed against a stale connection.
+    """
+    return wait_for_refresh(timeout=TokenConfig().refresh_wait)
 
 
-def invalidate_cache():
-    token_cache.invalidate()
+def refresh_token(token_key: TokenKey = DEFAULT_TOKEN_KEY) -> monad.MEither:
+    """
+    Obtains (with a client credentials grant, regardless of the retry window) and persists the replacement token, then
+    swaps it into the token cache.  The cached token is replaced only when the refresh succeeds, so a failed refresh
+    leaves the still valid token to be served (and a later call to retry the refresh).
+    """
+    result = grant(token_key) >> cache(token_key)
+    if result.is_right():
+        return TokenManager().managed(token_key).swap(monad.Right(result.value[2]))
+    logger.info(msg='Self Token Background Refresh Failure',
+                status='error',
+                ctx={'error': result.error().message, 'audience': token_key.audience},
+                tracer=tracer_from_ctx())
+    return result
+
+
+def cacheable_token(token_key: TokenKey = DEFAULT_TOKEN_KEY):
+    entry = TokenManager().managed(token_key)
+    with entry.lock:
+        return entry.cache.get()
+
+
+def invalidate_cache(token_key: TokenKey = DEFAULT_TOKEN_KEY):
+    TokenManager().managed(token_key).cache.invalidate()
     pass
 
 
 @token_cache.on_first_access
-def get_token():
+def get_token(token_key: TokenKey = DEFAULT_TOKEN_KEY):
     """
     First ever access is when the token is not set in parameter store and hence the environment:
         + Check the env anyway
@@ -130,9 +360,10 @@ def get_token():
         + get a new token from the token service (check whether expired)
         + write it to parameter store (only when expired)
         + add it to the env and return it (only when expired)
+    The env only holds the default token; other tokens are read from, and written to, the token persistence provider.
     """
     # returns Either((status, name, value))
-    result = bearer_token_from_env() >> from_cache >> token_service >> cache
+    result = bearer_token_from_env(token_key) >> from_cache(token_key) >> token_service(token_key) >> cache(token_key)
 
     if result.is_right():
         return monad.Right(result.value[2])
@@ -140,16 +371,18 @@ def get_token():
         return result
 
 
-def token_service(bearer_token):
-    if bearer_token and crypto.bearer_token_valid(bearer_token) and not_in_token_retry_window(bearer_token):
-        if bearer_token_from_env().value is None:
-            return monad.Right(('from_cache', bearer_token))
-        else:
-            return monad.Right(('from_env', bearer_token))
-
+@curry(2)
+def token_service(token_key: TokenKey, bearer_token):
     if bearer_token:
-        not_in_wind = not_in_token_retry_window(bearer_token)
-        token_state = (crypto.bearer_token_valid(bearer_token), crypto.parse_generate_id_token(bearer_token).value.exp)
+        id_token = parsed_token(bearer_token)
+        valid = id_token.is_right() and crypto.validate(id_token.value)
+        not_in_wind = id_token.is_right() and not_in_token_retry_window(id_token.value)
+        if valid and not_in_wind:
+            if bearer_token_from_env(token_key).value is None:
+                return monad.Right(('from_cache', bearer_token))
+            else:
+                return monad.Right(('from_env', bearer_token))
+        token_state = (valid, id_token.value.exp() if id_token.is_right() else None)
     else:
         not_in_wind = None
         token_state = ("No Token", "No Exp")
@@ -157,13 +390,21 @@ def token_service(bearer_token):
     logger.info(msg='Self Token Expired or not in Window',
                 ctx={'valid': token_state[0],
                      'exp': token_state[1],
-                     'in_window': not_in_wind},
+                     'in_window': not_in_wind,
+                     'audience': token_key.audience},
                 tracer=tracer_from_ctx())
 
+    return grant(token_key)
+
+
+def grant(token_key: TokenKey = DEFAULT_TOKEN_KEY) -> monad.MEither:
+    """
+    Obtains a new token with the client credentials grant.  Returns Right(('from_grant', token)).
+    """
     result = http_adapter.post(endpoint=identity_token_endpoint(),
-                               auth=(client_id(), client_secret()),
+                               auth=client_credentials(token_key),
                                headers={},
-                               body=token_request_data(),
+                               body=token_request_data(token_key),
                                encoding='urlencoded',
                                name='token_service',
                                circuit_state_provider=TokenConfig().circuit_state_provider)
@@ -172,41 +413,50 @@ def token_service(bearer_token):
         build_token_error(result.error()))
 
 
-def from_cache(bearer_token):
-    result = cache_reader(TokenConfig().token_persistence_provider)
+@curry(2)
+def from_cache(token_key: TokenKey, bearer_token):
+    result = cache_reader(TokenConfig().token_persistence_provider, token_key.persistence_key())
     if result is None or result.is_left():
         return monad.Right(bearer_token)
     return monad.Right(result.value.value)
 
 
-def cache(bearer_token_tuple: Tuple[str, str]) -> monad.MEither:
+@curry(2)
+def cache(token_key: TokenKey, bearer_token_tuple: Tuple[str, str]) -> monad.MEither:
     """
     Cache the token.  This is a dispatcher.  It takes the configured token persistence provider (Parameter Store or Dynamo)
     and writes to the provider.
     """
     get_location, bearer_token = bearer_token_tuple
+    key = token_key.persistence_key()
     if get_location == 'from_env':
-        return monad.Right(('ok', BEARER_TOKEN, bearer_token))
+        return monad.Right(('ok', key, bearer_token))
 
     if get_location == "from_cache":
-        TokenConfig().env.set_env_var_with_value(BEARER_TOKEN, bearer_token)
-        return monad.Right(('ok', BEARER_TOKEN, bearer_token))
+        set_env_token(token_key, bearer_token)
+        return monad.Right(('ok', key, bearer_token))
 
-    result = cache_writer(TokenConfig().token_persistence_provider, bearer_token)
-    TokenConfig().env.set_env_var_with_value(BEARER_TOKEN, bearer_token)
+    result = cache_writer(TokenConfig().token_persistence_provider, bearer_token, key)
+    set_env_token(token_key, bearer_token)
     return result
 
 
-def cache_reader(provider: Callable):
+def set_env_token(token_key: TokenKey, bearer_token: str):
+    if token_key.is_default():
+        TokenConfig().env.set_env_var_with_value(BEARER_TOKEN, bearer_token)
+    pass
+
+
+def cache_reader(provider: Callable, key: str = BEARER_TOKEN):
     if not hasattr(provider, 'read'):
         return None
-    return provider.read(key=BEARER_TOKEN)
+    return provider.read(key=key)
 
 
-def cache_writer(provider: Callable, bearer_token: str) -> monad.MEither:
-    result = provider.write(BEARER_TOKEN, bearer_token)
+def cache_writer(provider: Callable, bearer_token: str, key: str = BEARER_TOKEN) -> monad.MEither:
+    result = provider.write(key, bearer_token)
     if result.is_right():
-        return monad.Right(('ok', BEARER_TOKEN, bearer_token))
+        return monad.Right(('ok', key, bearer_token))
     return result
 
 
@@ -218,22 +468,29 @@ def client_secret() -> str:
     return TokenConfig().env.client_secret()
 
 
+def client_credentials(token_key: TokenKey = DEFAULT_TOKEN_KEY) -> Tuple[str, str]:
+    if token_key.client is None:
+        return client_id(), client_secret()
+    return TokenConfig().env.client_credentials(token_key.client)
+
+
 def identity_token_endpoint() -> str:
     return TokenConfig().env.identity_token_endpoint()
 
 
-def bearer_token_from_env():
+def bearer_token_from_env(token_key: TokenKey = DEFAULT_TOKEN_KEY):
+    if not token_key.is_default():
+        return monad.Right(None)
     return monad.Right(TokenConfig().env.bearer_token())
 
 
-def token_request_data():
-    return {'audience': 'https://api.jarden.io', 'grant_type': 'client_credentials', 'scopes': 'openid'}
+def token_request_data(token_key: TokenKey = DEFAULT_TOKEN_KEY):
+    return {'audience': token_key.audience, 'grant_type': 'client_credentials', 'scopes': token_key.scopes}
 
 
-def not_in_token_retry_window(bearer_token: str) -> bool:
-    id_token = crypto.parse_generate_id_token(bearer_token)
+def not_in_token_retry_window(id_token: crypto.IdToken) -> bool:
     return random_retry_window.left_of_window(width=TokenConfig().window_width,
-                                              end=id_token.value.exp() - TokenConfig().expiry_threshold,
+                                              end=id_token.exp() - TokenConfig().expiry_threshold,
                                               at=int(chronos.time_now(tz=chronos.tz_utc(), apply=[chronos.epoch()])))
 
 
@@ -250,8 +507,10 @@ def build_token_error(result):
                       code=result.code, retryable=False)
 
 
-def env_set_up(env):
-    return all(getattr(env, var)() for var in expected_envs)
+def env_set_up(env, token_key: TokenKey = DEFAULT_TOKEN_KEY):
+    if token_key.client is None:
+        return all(getattr(env, var)() for var in expected_envs)
+    return hasattr(env, 'client_credentials') and all(env.client_credentials(token_key.client))
 
 
 def tracer_from_ctx():
@@ -1,61 +1,54 @@
-from typing import List, Any, Tuple, Callable
+from typing import List, Tuple, Dict, Optional
 from dataclasses import dataclass, field
-from pymonad.reader import Pipe
-from pymonad.tools import curry
 
-from . import fn, monad
+from . import monad, error
+
+invalid_transition = object()
+
+
+class StateMachineError(error.PyFuncifyError):
+    pass
+
 
 @dataclass
 class StateTransitionMap:
+    """
+    The map is compiled, on construction, into an index keyed on (from_state, transition), and the transitions valid
+    from each state (in map order).  A map with more than one next state for a (from_state, transition) is ambiguous
+    and raises a StateMachineError.
+    """
     stmap: List[Tuple[str, str, str]]
+    index: Dict[Tuple[Optional[str], str], str] = field(init=False, repr=False, compare=False)
+    transitions_from: Dict[Optional[str], List[str]] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.index, self.transitions_from = compile_state_map(self.stmap)
+
 
 def state_transition_map(stmap: List[Tuple[str]]) -> StateTransitionMap:
     return StateTransitionMap(stmap)
 
+def compile_state_map(stmap: List[Tuple[str, str, str]]) -> Tuple[Dict, Dict]:
+    index = {}
+    transitions_from = {}
+    for current, transition, new in stmap:
+        if (current, transition) in index:
+            raise StateMachineError(message="Ambiguous state transition",
+                                    name="state_machine",
+                                    ctx={'from_state': current, 'transition': transition})
+        index[(current, transition)] = new
+        transitions_from.setdefault(current, []).append(transition)
+    return index, transitions_from
+
 def valid_transitions_from(state_map: StateTransitionMap, from_state: str) -> List[str]:
-    return (Pipe(state_map)
-           .then(map_selector(extract_from_state, (from_state, None, None)))
-           .then(extract_transition_from_map)
-           .flush())
+    return list(state_map.transitions_from.get(from_state, []))
 
 def valid_state_transition(state_map: StateTransitionMap, from_state: str, with_transition: str) -> bool:
-    return (Pipe(state_map)
-           .then(map_selector(extract_from_state_and_transition, (from_state, with_transition, None)))
-           .then(list)
-           .then(fn.only_one)
-           .flush())
+    return (from_state, with_transition) in state_map.index
 
 def transition(state_map: StateTransitionMap, from_state: str, with_transition: str) -> monad.EitherMonad[str]:
-    return (Pipe(state_map)
-           .then(map_selector(extract_from_state_and_transition, (from_state, with_transition, None)))
-           .then(list)
-           .then(validate_and_extract_new_state)
-           .flush())
-
-
-@curry(3)
-def map_selector(extractor_fn: Callable, map_tester: Tuple, state_map: StateTransitionMap) -> filter:
-    return fn.select(fn.equality(extractor_fn, map_tester), state_map.stmap)
-
-def validate_and_extract_new_state(state_map_items: List[Tuple[str, str, str]]) -> str:
-    if fn.only_one(state_map_items):
-        return monad.Right(state_map_items[0][2])
-    return monad.Left("invalid transition")
-
-
-def extract_from_state(state_map_item: Tuple) -> Tuple[str, None, None]:
-    current, _transition, _new = state_map_item
-    return (current, None, None)
-
-def extract_from_state_and_transition(state_map_item: Tuple) -> Tuple:
-    current, transition, _new = state_map_item
-    return (current, transition, None)
-
-
-def extract_transition(state_map_item: Tuple[str, str, str]) -> str:
-    _current, transition, new = state_map_item
-    return transition
-
+    new_state = state_map.index.get((from_state, with_transition), invalid_transition)
+    if new_state is invalid_transition:
+        return monad.Left("invalid transition")
+    return monad.Right(new_state)
 
-def extract_transition_from_map(state_map: List[Tuple[str, str, str]]) -> str:
-    return list(map(extract_transition, state_map))
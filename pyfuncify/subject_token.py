@@ -1,17 +1,24 @@
-from typing import Tuple, Protocol, Union, Callable
+from typing import Tuple, Protocol, Union, Callable, Optional, Dict
+from collections import OrderedDict
 from jwcrypto import jwk, jwt
+from jwcrypto.common import base64url_decode
 from pymonad.tools import curry
-from simple_memory_cache import GLOBAL_CACHE
+import hashlib
+import json
 import re
+import threading
+import time
 
 from . import monad, http_adapter, http, logger, singleton, circuit, chronos, error, crypto
 
-jwks_cache = GLOBAL_CACHE.MemoryCachedVar('jwks_cache')
-
 event_authorisation_hdr_key = "Authorization"
 
 JWKS = "JWKS"  # name in cache
 
+DEFAULT_VERIFIED_TOKEN_CACHE_SIZE = 1024
+DEFAULT_JWKS_MAX_AGE_SECONDS = 3600  # When the JWKS response has no Cache-Control max-age
+DEFAULT_JWKS_MIN_REFRESH_SECONDS = 60  # The least time between refetches of the JWKS
+
 
 class JwksGetError(error.PyFuncifyError):
     pass
@@ -33,61 +40,254 @@ class SubjectTokenConfig(singleton.Singleton):
     + jwks_endpoint. Returns the endpoint of the IDP for the JWKS call.
     + circuit_state_provider.  An implementation of the CircuitStateProviderProtocol
     + asserted_iss: The iss must be asserted when decoding the JWT.  Provide the iss str as it will appear in the JWT
+    + verified_token_cache_size: The maximum number of verified tokens held by the VerifiedTokenCache.  0 disables it.
+    + jwks_max_age_seconds: How long the JWKS is held when the JWKS response has no Cache-Control max-age.
+    + jwks_min_refresh_seconds: The least time between refetches of the JWKS; e.g. on tokens with an unknown kid.
     """
 
     def configure(self,
                   jwks_endpoint: str,
                   asserted_iss: str = "",
                   jwks_persistence_provider: JwksPersistenceProviderProtocol = None,
-                  circuit_state_provider: circuit.CircuitStateProviderProtocol = None):
+                  circuit_state_provider: circuit.CircuitStateProviderProtocol = None,
+                  verified_token_cache_size: int = DEFAULT_VERIFIED_TOKEN_CACHE_SIZE,
+                  jwks_max_age_seconds: float = DEFAULT_JWKS_MAX_AGE_SECONDS,
+                  jwks_min_refresh_seconds: float = DEFAULT_JWKS_MIN_REFRESH_SECONDS):
         self.jwks_persistence_provider = jwks_persistence_provider
         self.jwks_endpoint = jwks_endpoint
         self.circuit_state_provider = circuit_state_provider
         self.asserted_iss = asserted_iss
+        self.jwks_max_age_seconds = jwks_max_age_seconds
+        self.jwks_min_refresh_seconds = jwks_min_refresh_seconds
+        VerifiedTokenCache().configure(max_size=verified_token_cache_size)
+        JwksKeyStore().invalidate()
+        pass
+
+
+class JwksKeyStore(singleton.Singleton):
+    """
+    The JWKS, with its keys indexed on kid.
+    + The JWKS is loaded on first use (from the jwks_persistence_provider when it has them), and refetched from the
+      jwks_endpoint once it is older than the Cache-Control max-age of the JWKS response (or jwks_max_age_seconds).
+    + A token signed with a kid not in the JWKS (the IDP has rotated its keys) triggers a refetch.  Refetches are
+      made one at a time, and at most once every jwks_min_refresh_seconds, so a flood of tokens with an unknown kid
+      makes a single call to the IDP.  JWKS loaded from the jwks_persistence_provider may be stale, so the first
+      unknown kid after loading them always refetches.
+    + When a refetch fails, the JWKS already held continue to be used.
+    """
+    jwks = None
+    keys = {}
+    expires_at = None
+    refreshed_at = None
+    lock = threading.RLock()
+
+    def key_set(self) -> monad.MEither:
+        with self.lock:
+            if self.jwks is None or (self.stale() and self.refresh_permitted()):
+                result = self.refresh(from_persistence=self.jwks is None)
+                if self.jwks is None:
+                    return result
+            return monad.Right(self.jwks)
+
+    def key_for(self, kid: str) -> monad.MEither:
+        key = self.keys.get(kid)
+        if key is not None and not self.stale():
+            return monad.Right(key)
+        key_set = self.key_set()
+        if key_set.is_left():
+            return key_set
+        with self.lock:
+            if kid not in self.keys and self.refresh_permitted():
+                self.refresh(from_persistence=False)
+            key = self.keys.get(kid)
+        if key is None:
+            return monad.Left(crypto.JwtDecodingError(message="Unknown kid {}".format(kid), name="decode_jwt", code=401))
+        return monad.Right(key)
+
+    def refresh(self, from_persistence: bool) -> monad.MEither:
+        """
+        Loads the JWKS from the jwks_persistence_provider (when from_persistence and it has them), otherwise fetches
+        them from the jwks_endpoint.  Only a fetch from the endpoint counts towards jwks_min_refresh_seconds, so a
+        token with a kid not in persisted (and possibly stale) JWKS always gets one fetch from the endpoint.
+        """
+        result = persisted_jwks() if from_persistence else monad.Left(None)
+        if result.is_left():
+            result = fetch_jwks(from_persistence=False)
+            self.refreshed_at = time.monotonic()
+        if result.is_right():
+            self.load(*result.value)
+        elif self.jwks is not None:
+            logger.info(msg="JWKS Refresh Failure", status='error', ctx={'error': result.error().message})
+        return result
+
+    def load(self, jwks: jwk.JWKSet, max_age: Optional[int]):
+        keys = {key.get('kid'): key for key in jwks['keys']}
+        if set(keys) != set(self.keys):
+            VerifiedTokenCache().invalidate()
+        self.jwks = jwks
+        self.keys = keys
+        self.expires_at = time.monotonic() + (SubjectTokenConfig().jwks_max_age_seconds if max_age is None else max_age)
+        pass
+
+    def stale(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def refresh_permitted(self) -> bool:
+        return self.refreshed_at is None or (time.monotonic() - self.refreshed_at) >= SubjectTokenConfig().jwks_min_refresh_seconds
+
+    def invalidate(self):
+        with self.lock:
+            self.jwks = None
+            self.keys = {}
+            self.expires_at = None
+            self.refreshed_at = None
         pass
 
 
+class VerifiedTokenCache(singleton.Singleton):
+    """
+    A bounded LRU cache of verified IdTokens, keyed on the sha256 digest of the serialised JWT.  A token is held until
+    its exp, after which a lookup evicts it; the least recently used token is evicted when the cache is full.
+    The cache is cleared by jwk_cache_invalidate and on configure (the asserted iss may have changed).
+    """
+    max_size = DEFAULT_VERIFIED_TOKEN_CACHE_SIZE
+    tokens = OrderedDict()
+    lock = threading.Lock()
+
+    def configure(self, max_size: int = DEFAULT_VERIFIED_TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self.invalidate()
+        pass
+
+    def get(self, key: str) -> Optional[crypto.IdToken]:
+        with self.lock:
+            id_token = self.tokens.get(key)
+            if id_token is None:
+                return None
+            if id_token.exp() <= now_epoch():
+                del self.tokens[key]
+                return None
+            self.tokens.move_to_end(key)
+            return id_token
+
+    def put(self, key: str, id_token: crypto.IdToken):
+        if self.max_size <= 0:
+            return None
+        with self.lock:
+            self.tokens[key] = id_token
+            self.tokens.move_to_end(key)
+            while len(self.tokens) > self.max_size:
+                self.tokens.popitem(last=False)
+        pass
+
+    def invalidate(self):
+        with self.lock:
+            self.tokens.clear()
+        pass
+
+    def size(self) -> int:
+        return len(self.tokens)
+
+
 def parse_generate_id_token(serialised_jwt):
     """
-    Takes an encoded JWT and returns an verified id_token
+    Takes an encoded JWT and returns an verified id_token.  A token verified previously (and not yet expired) is
+    returned from the VerifiedTokenCache without verifying the signature again.  Otherwise the signature is verified
+    with the key for the token's kid.
+    """
+    key = token_digest(serialised_jwt)
+    cached_id_token = VerifiedTokenCache().get(key)
+    if cached_id_token is not None:
+        return monad.Right(cached_id_token)
+    return (token_kid(serialised_jwt) >>
+            verification_key >>
+            crypto.decode_jwt(claims_to_assert(), serialised_jwt) >>
+            crypto.to_id_token >>
+            cache_id_token(key))
+
+
+@monad.monadic_try(name="decode_jwt", status=401, error_cls=crypto.JwtDecodingError)
+def token_kid(serialised_jwt: str) -> Optional[str]:
     """
-    return cacheable_jwks() >> crypto.decode_jwt(claims_to_assert(), serialised_jwt) >> crypto.to_id_token
+    The kid from the (unverified) JOSE header of the JWT.
+    """
+    return json.loads(base64url_decode(serialised_jwt.split(".")[0])).get('kid')
+
+
+def verification_key(kid: Optional[str]) -> monad.MEither:
+    """
+    The key for the kid; or, for a token without a kid, the JWKS (from which the key is found by trial).
+    """
+    if kid is None:
+        return cacheable_jwks()
+    return JwksKeyStore().key_for(kid)
+
+
+@curry(2)
+def cache_id_token(key: str, id_token: crypto.IdToken):
+    VerifiedTokenCache().put(key, id_token)
+    return monad.Right(id_token)
+
+
+def token_digest(serialised_jwt: str) -> str:
+    return hashlib.sha256(serialised_jwt.encode('utf-8')).hexdigest()
 
 
 def claims_to_assert():
     return {'iss': SubjectTokenConfig().asserted_iss,
-            'exp': int(chronos.time_now(tz=chronos.tz_utc(), apply=[chronos.epoch()]))}
+            'exp': now_epoch()}
+
+
+def now_epoch() -> int:
+    return int(chronos.time_now(tz=chronos.tz_utc(), apply=[chronos.epoch()]))
 
 
 def cacheable_jwks():
-    return jwks_cache.get()
+    return JwksKeyStore().key_set()
 
 
-@jwks_cache.on_first_access
-def _jwks():
+def fetch_jwks(from_persistence: bool = True):
     """
-    Takes a key id (kid), requests the jwks from the identity jwks well-known service,
-    returning a monadic jwt.JWKkeys
+    Requests the jwks from the identity jwks well-known service (or reads them from the jwks_persistence_provider),
+    returning a monadic (jwk.JWKSet, max_age)
     """
-    return monad.Right(jwks_resource()) >> jwks_from_cache >> get_jwks >> cache_jwks >> jwks_from_json
+    return (monad.Right(jwks_resource()) >>
+            (jwks_from_cache if from_persistence else jwks_not_cached) >>
+            get_jwks >>
+            cache_jwks >>
+            jwks_from_json)
+
+
+def persisted_jwks() -> monad.MEither:
+    """
+    The JWKS held by the jwks_persistence_provider, as a monadic (jwk.JWKSet, None).  A Left when there are none.
+    """
+    _endpoint, jwks = jwks_from_cache(jwks_resource()).value
+    if not jwks:
+        return monad.Left(JwksGetError(message="No persisted JWKS", name="jwks_from_cache"))
+    return jwks_from_json((200, (jwks, None)))
 
 
 def jwk_cache_invalidate():
-    jwks_cache.invalidate()
+    """
+    Invalidates the JWKS, and the tokens verified with them.
+    """
+    JwksKeyStore().invalidate()
+    VerifiedTokenCache().invalidate()
 
-def cache_jwks(jwks: Tuple[int, str]):
-    _status, keys = jwks
+def cache_jwks(jwks: Tuple[int, Tuple[str, Optional[int]]]):
+    _status, (keys, _max_age) = jwks
     if SubjectTokenConfig().jwks_persistence_provider:
         SubjectTokenConfig().jwks_persistence_provider.write(JWKS, keys)
     return monad.Right(jwks)
 
 @monad.monadic_try(name="jwks_from_json")
-def jwks_from_json(jwks: Tuple[int, str]):
+def jwks_from_json(jwks: Tuple[int, Tuple[str, Optional[int]]]):
     """
-    Takes a JSON JWKS keyset and returns a wrapper object
+    Takes a JSON JWKS keyset and returns a wrapper object, with the max-age of the keyset
     """
-    _status, keys = jwks
-    return jwk.JWKSet.from_json(keys)
+    _status, (keys, max_age) = jwks
+    return jwk.JWKSet.from_json(keys), max_age
 
 
 @curry(3)
@@ -111,6 +311,10 @@ def jwks_from_cache(endpoint):
     return monad.Right((endpoint, result.value.value))
 
 
+def jwks_not_cached(endpoint):
+    return monad.Right((endpoint, None))
+
+
 def cache_reader(provider: JwksPersistenceProviderProtocol):
     if not hasattr(provider, 'read'):
         return None
@@ -122,17 +326,22 @@ def get_jwks(endpoint_tuple: Tuple[str, Union[str, None]]):
     Get the JWKS json from the Identity well known resource.
     Inject the http_status_exception to test for a Right from the request, but a failure HTTP status
 
-    The endpoint tuple has the jwks_endpoint and either None or jwks obtained from cache
+    The endpoint tuple has the jwks_endpoint and either None or jwks obtained from cache.  Returns the jwks json with
+    the max-age of the response (None for jwks obtained from cache).
     """
     endpoint, jwks = endpoint_tuple
     if not jwks:
         return http_adapter.get(endpoint=endpoint,
                                 name='jwks_service',
                                 circuit_state_provider=SubjectTokenConfig().circuit_state_provider,
-                                exception_test_fn=http.http_response_monad(__name__, http.extract_fn_raw),
+                                exception_test_fn=http.http_response_monad(__name__, extract_jwks),
                                 error_cls=JwksGetError)
 
-    return monad.Right((200, jwks))
+    return monad.Right((200, (jwks, None)))
+
+
+def extract_jwks(response) -> Tuple[str, Optional[int]]:
+    return http.extract_fn_raw(response), http.cache_control_max_age(response.headers)
 
 
 def jwks_resource():
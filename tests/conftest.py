@@ -1,2 +1,13 @@
 import pytest
 import collections
+
+from pyfuncify import circuit
+
+
+@pytest.fixture(autouse=True)
+def clear_circuits():
+    """
+    In-process circuit state is keyed on the circuit name, which the test providers share.
+    """
+    circuit.clear_in_process_state()
+    yield
@@ -186,4 +186,55 @@ def api_gateway_event_post_with_json_body():
             "apiId": "1234567890",
             "protocol": "HTTP/1.1"
         }
-    }
\ No newline at end of file
+    }
+
+@pytest.fixture
+def sqs_event():
+    return {
+        'Records': [sqs_record("msg-1", "ok"),
+                    sqs_record("msg-2", "fail"),
+                    sqs_record("msg-3", "raise"),
+                    sqs_record("msg-4", "ok")]
+    }
+
+
+@pytest.fixture
+def kinesis_event():
+    return {
+        'Records': [
+            {
+                "kinesis": {
+                    "kinesisSchemaVersion": "1.0",
+                    "partitionKey": "1",
+                    "sequenceNumber": "49590338271490256608559692538361571095921575989136588898",
+                    "data": "eyJ0ZXN0IjoiYm9keSJ9",
+                    "approximateArrivalTimestamp": 1545084650.987
+                },
+                "eventSource": "aws:kinesis",
+                "eventVersion": "1.0",
+                "eventID": "shardId-000000000006:49590338271490256608559692538361571095921575989136588898",
+                "eventName": "aws:kinesis:record",
+                "awsRegion": "us-east-2",
+                "eventSourceARN": "arn:aws:kinesis:us-east-2:123456789012:stream/orders"
+            }
+        ]
+    }
+
+
+def sqs_record(message_id, body, queue="orders"):
+    return {
+        "messageId": message_id,
+        "receiptHandle": "MessageReceiptHandle",
+        "body": body,
+        "attributes": {
+            "ApproximateReceiveCount": "1",
+            "SentTimestamp": "1523232000000",
+            "SenderId": "123456789012",
+            "ApproximateFirstReceiveTimestamp": "1523232000001"
+        },
+        "messageAttributes": {},
+        "md5OfBody": "7b270e59b47ff90a553787216d55d91d",
+        "eventSource": "aws:sqs",
+        "eventSourceARN": "arn:aws:sqs:us-east-1:123456789012:{}".format(queue),
+        "awsRegion": "us-east-1"
+    }
@@ -1,6 +1,6 @@
 from pynamodb.models import Model
 from pynamodb.attributes import (
-    UnicodeAttribute, NumberAttribute, UnicodeSetAttribute, UTCDateTimeAttribute, DiscriminatorAttribute
+    UnicodeAttribute, NumberAttribute, UnicodeSetAttribute, UTCDateTimeAttribute, DiscriminatorAttribute, JSONAttribute
 )
 
 class BaseModel(Model):
@@ -20,3 +20,4 @@ class Circuit(BaseModel, discriminator='Circuit'):
     circuit_state = UnicodeAttribute(null=True)
     last_state_chg_time = UTCDateTimeAttribute(null=True)
     failures = NumberAttribute(null=True)
+    window = JSONAttribute(null=True)
@@ -38,6 +38,7 @@ class DynamoCircuitStore(circuit.CircuitStateProviderProtocol):
         self.circuit_state = self.store.circuit_state
         self.failures = self.store.failures
         self.last_state_chg_time = self.store.last_state_chg_time
+        self.window = self.store.window
 
     def circuit_state(self, new_state):
         self.circuit_state = new_state
@@ -58,6 +59,11 @@ class DynamoCircuitStore(circuit.CircuitStateProviderProtocol):
         self.update()
         return self
 
+    def update_window(self, window):
+        self.window = window
+        self.update()
+        return self
+
     def find_or_create(self):
         return repo.find_or_create_circuit(domain=self)
 
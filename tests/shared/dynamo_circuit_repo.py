@@ -18,7 +18,8 @@ def create_circuit(circuit_name) -> base_model.Circuit:
                               range_key=format_circuit_sk(circuit_name),
                               circuit_state=None,
                               last_state_chg_time=None,
-                              failures=0)
+                              failures=0,
+                              window=None)
     repo.save()
     return repo
 
@@ -26,6 +27,7 @@ def update_circuit(domain, repo: base_model.Circuit) -> base_model.Circuit:
     repo.failures = domain.failures
     repo.last_state_chg_time = domain.last_state_chg_time
     repo.circuit_state = domain.circuit_state
+    repo.window = domain.window
     repo.save()
     return repo
 
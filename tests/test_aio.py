@@ -0,0 +1,38 @@
+import asyncio
+
+from pyfuncify import aio
+
+
+def test_reuses_the_event_loop_across_runs():
+    loop = aio.event_loop()
+
+    assert aio.run(current_loop()) is loop
+    assert aio.run(current_loop()) is loop
+
+
+def test_replaces_a_closed_event_loop():
+    loop = aio.event_loop()
+    loop.close()
+
+    assert aio.event_loop() is not loop
+    assert not aio.event_loop().is_closed()
+
+
+def test_calls_sync_and_async_callables():
+    assert aio.run(aio.call(sync_double, 2)) == 4
+    assert aio.run(aio.call(async_double, 2)) == 4
+
+
+#
+# Helpers
+#
+async def current_loop():
+    return asyncio.get_running_loop()
+
+
+def sync_double(x):
+    return x * 2
+
+
+async def async_double(x):
+    return x * 2
@@ -1,14 +1,20 @@
 import pytest
+import asyncio
+import threading
+import json
 
 from .shared import *
 
-from pyfuncify import app, monad, error, app_serialisers, app_value, pip, subject_token, pdp
+from pyfuncify import app, app_route, monad, error, app_serialisers, app_value, pip, subject_token, pdp
 
 
 class UnAuthorised(app.AppError):
     pass
 
 
+concurrent_barrier = threading.Barrier(4)
+
+
 #
 # Pipeline Functions
 #
@@ -52,6 +58,177 @@ def it_executes_the_noop_path():
     assert result['body'] == '{"error": "no matching route", "code": 404, "step": "", "ctx": {}}'
 
 
+def it_returns_partial_batch_failures_for_an_sqs_event(sqs_event):
+    result = app.pipeline(event=sqs_event,
+                          context={},
+                          env=Env().env,
+                          params_parser=noop_callable,
+                          pip_initiator=noop_callable,
+                          handler_guard_fn=noop_callable)
+
+    assert result == {'batchItemFailures': [{'itemIdentifier': 'msg-2'}, {'itemIdentifier': 'msg-3'}]}
+
+
+def it_fails_all_batch_records_when_the_guard_fails(sqs_event):
+    result = app.pipeline(event=sqs_event,
+                          context={},
+                          env=Env().env,
+                          params_parser=noop_callable,
+                          pip_initiator=noop_callable,
+                          handler_guard_fn=failed_env_expectations)
+
+    assert [failure['itemIdentifier'] for failure in result['batchItemFailures']] == ['msg-1', 'msg-2', 'msg-3', 'msg-4']
+
+
+def it_fails_unrouted_batch_records(sqs_event):
+    sqs_event['Records'].append(sqs_record("msg-5", "ok", queue="unknown"))
+
+    result = app.pipeline(event=sqs_event,
+                          context={},
+                          env=Env().env,
+                          params_parser=noop_callable,
+                          pip_initiator=noop_callable,
+                          handler_guard_fn=noop_callable)
+
+    assert {'itemIdentifier': 'msg-5'} in result['batchItemFailures']
+
+
+def it_fails_only_the_batch_record_with_a_malformed_body():
+    event = {'Records': [sqs_record("msg-1", '{"order": "ok"}', queue="json_orders"),
+                         sqs_record("msg-2", '{"order": ', queue="json_orders"),
+                         sqs_record("msg-3", '{"order": "ok"}', queue="json_orders")]}
+
+    result = app.pipeline(event=event,
+                          context={},
+                          env=Env().env,
+                          params_parser=noop_callable,
+                          pip_initiator=noop_callable,
+                          handler_guard_fn=noop_callable)
+
+    assert result == {'batchItemFailures': [{'itemIdentifier': 'msg-2'}]}
+
+
+def it_stops_an_sqs_fifo_batch_at_the_first_failure(mocker):
+    event = {'Records': [sqs_record("msg-{}".format(i), body, queue="orders.fifo")
+                         for i, body in enumerate(["ok", "fail", "ok", "ok"], start=1)]}
+    invoke = mocker.spy(app, 'invoke_record_route')
+
+    result = app.pipeline(event=event,
+                          context={},
+                          env=Env().env,
+                          params_parser=noop_callable,
+                          pip_initiator=noop_callable,
+                          handler_guard_fn=noop_callable,
+                          batch_concurrency=4)
+
+    assert result == {'batchItemFailures': [{'itemIdentifier': 'msg-2'}, {'itemIdentifier': 'msg-3'}, {'itemIdentifier': 'msg-4'}]}
+    assert invoke.call_count == 2
+
+
+def it_stops_an_sqs_fifo_batch_at_the_first_failure_in_the_async_pipeline():
+    event = {'Records': [sqs_record("msg-1", "fail", queue="async_orders.fifo"),
+                         sqs_record("msg-2", "ok", queue="async_orders.fifo")]}
+
+    result = app.run_aio_pipeline(event=event,
+                                  context={},
+                                  env=Env().env,
+                                  params_parser=aio_noop_callable,
+                                  pip_initiator=aio_noop_callable,
+                                  handler_guard_fn=aio_noop_callable)
+
+    assert result == {'batchItemFailures': [{'itemIdentifier': 'msg-1'}, {'itemIdentifier': 'msg-2'}]}
+
+
+def it_parses_the_decoded_kinesis_data(kinesis_event):
+    kinesis_event['Records'][0]['eventSourceARN'] = "arn:aws:kinesis:us-east-2:123456789012:stream/json_orders"
+
+    request = app.run_pipeline(request=app.build_value(kinesis_event, {}, Env().env), params_parser=noop_callable)
+
+    assert request.value.results[0].value.event.body == {'test': "body"}
+
+
+def it_processes_batch_records_concurrently(sqs_event):
+    event = {'Records': [sqs_record("msg-{}".format(i), "wait", queue="concurrent_orders") for i in range(4)]}
+
+    result = app.pipeline(event=event,
+                          context={},
+                          env=Env().env,
+                          params_parser=noop_callable,
+                          pip_initiator=noop_callable,
+                          handler_guard_fn=noop_callable,
+                          batch_concurrency=4)
+
+    assert result == {'batchItemFailures': []}
+
+
+def it_preserves_record_order_and_spans_when_concurrent(sqs_event):
+    sqs_event['Records'].append(sqs_record("msg-5", "fail", queue="async_orders"))
+    request = app.build_value(sqs_event, {}, Env().env, batch_concurrency=3)
+
+    result = app.run_pipeline(request=request, params_parser=noop_callable)
+
+    assert [record_result.is_right() for record_result in result.value.results] == [True, False, False, True, False]
+    assert [record_result.lift().tracer.kv['item_identifier'] for record_result in result.value.results if record_result.is_right()] == ['msg-1', 'msg-4']
+
+
+def it_invokes_async_batch_handlers():
+    event = {'Records': [sqs_record("msg-1", "ok", queue="async_orders"), sqs_record("msg-2", "fail", queue="async_orders")]}
+
+    result = app.pipeline(event=event,
+                          context={},
+                          env=Env().env,
+                          params_parser=noop_callable,
+                          pip_initiator=noop_callable,
+                          handler_guard_fn=noop_callable,
+                          batch_concurrency=2)
+
+    assert result == {'batchItemFailures': [{'itemIdentifier': 'msg-2'}]}
+
+
+def it_fails_an_async_batch_before_invoking_records_when_called_in_a_running_loop(mocker):
+    event = {'Records': [sqs_record("msg-1", "ok"), sqs_record("msg-2", "ok", queue="async_orders")]}
+    invoke = mocker.spy(app, 'invoke_record_route')
+
+    async def pipeline_in_loop():
+        return app.pipeline(event=event,
+                            context={},
+                            env=Env().env,
+                            params_parser=noop_callable,
+                            pip_initiator=noop_callable,
+                            handler_guard_fn=noop_callable)
+
+    assert asyncio.run(pipeline_in_loop()) == {'batchItemFailures': [{'itemIdentifier': 'msg-1'}, {'itemIdentifier': 'msg-2'}]}
+    assert invoke.call_count == 0
+
+
+def it_returns_the_running_loop_failure_as_a_left():
+    event = {'Records': [sqs_record("msg-1", "ok", queue="async_orders")]}
+    request = app.build_value(event, {}, Env().env)
+
+    async def invoke_in_loop():
+        return app.batch_route_invoker(request.value)
+
+    result = asyncio.run(invoke_in_loop())
+
+    assert result.is_left()
+    assert isinstance(result.error().error, app.AppError)
+    assert "aio_pipeline" in result.error().error.message
+
+
+def it_invokes_sync_batch_handlers_when_called_in_a_running_loop():
+    event = {'Records': [sqs_record("msg-1", "ok"), sqs_record("msg-2", "fail")]}
+
+    async def pipeline_in_loop():
+        return app.pipeline(event=event,
+                            context={},
+                            env=Env().env,
+                            params_parser=noop_callable,
+                            pip_initiator=noop_callable,
+                            handler_guard_fn=noop_callable)
+
+    assert asyncio.run(pipeline_in_loop()) == {'batchItemFailures': [{'itemIdentifier': 'msg-2'}]}
+
+
 def it_adds_the_session_as_a_cookie(set_up_env,
                                     api_gateway_event_get):
     result = app.pipeline(event=api_gateway_event_get,
@@ -75,6 +252,60 @@ def it_returns_a_201_created(set_up_env,
     assert result['statusCode'] == 201
 
 
+#
+# Async Pipeline
+#
+
+def it_executes_an_async_pipeline_with_async_stages(api_gateway_event_get):
+    api_gateway_event_get['path'] = '/resourceBase/async_resource/uuid1'
+
+    result = app.run_aio_pipeline(event=api_gateway_event_get,
+                                  context={},
+                                  env=Env().env,
+                                  params_parser=aio_noop_callable,
+                                  pip_initiator=aio_noop_callable,
+                                  handler_guard_fn=aio_noop_callable)
+
+    assert result['statusCode'] == 200
+    assert result['body'] == '{"resource": "uuid1"}'
+
+
+def it_executes_an_async_pipeline_with_sync_stages(s3_event_hello):
+    result = app.run_aio_pipeline(event=s3_event_hello,
+                                  context={},
+                                  env=Env().env,
+                                  params_parser=noop_callable,
+                                  pip_initiator=noop_callable,
+                                  handler_guard_fn=noop_callable)
+
+    assert result['body'] == '{"hello": "there"}'
+
+
+def it_fails_on_async_guard_expectations():
+    result = app.run_aio_pipeline(event={},
+                                  context={},
+                                  env=Env().env,
+                                  params_parser=aio_noop_callable,
+                                  pip_initiator=aio_noop_callable,
+                                  handler_guard_fn=aio_failed_env_expectations)
+
+    assert result['statusCode'] == 500
+
+
+def it_executes_an_async_pipeline_for_a_concurrent_batch(sqs_event):
+    sqs_event['Records'].append(sqs_record("msg-5", "fail", queue="async_orders"))
+
+    result = app.run_aio_pipeline(event=sqs_event,
+                                  context={},
+                                  env=Env().env,
+                                  params_parser=aio_noop_callable,
+                                  pip_initiator=aio_noop_callable,
+                                  handler_guard_fn=aio_noop_callable,
+                                  batch_concurrency=3)
+
+    assert result == {'batchItemFailures': [{'itemIdentifier': 'msg-2'}, {'itemIdentifier': 'msg-3'}, {'itemIdentifier': 'msg-5'}]}
+
+
 #
 # Authorisation
 #
@@ -157,6 +388,50 @@ def it_finds_the_route_pattern_by_function():
     assert app.template_from_route_fn(route_fn) == ('API', 'GET', '/resourceBase/resource/{id1}')
 
 
+def it_prefers_a_literal_segment_over_a_template_param():
+    template, route_fn, opts = app.route_fn_from_kind(('API', 'GET', '/resourceBase/resource/special'))
+
+    assert template == ('API', 'GET', '/resourceBase/resource/special')
+
+
+def it_falls_back_to_the_template_param_when_the_literal_path_does_not_match():
+    template, route_fn, opts, path_params = app_route.RouteMap().match_route(('API', 'GET', '/resourceBase/resource/special/resource/uuid2'))
+
+    assert template == ('API', 'GET', '/resourceBase/resource/{id1}/resource/{id2}')
+    assert path_params == {'id1': 'special', 'id2': 'uuid2'}
+
+
+def it_rebuilds_the_route_index_when_a_route_is_added():
+    app_route.RouteMap().route_index()
+
+    app.route(pattern=('API', 'DELETE', '/resourceBase/resource/{id1}'))(noop_callable)
+
+    assert app_route.RouteMap().index is None
+
+    template, route_fn, opts = app.route_fn_from_kind(('API', 'DELETE', '/resourceBase/resource/uuid1'))
+
+    assert template == ('API', 'DELETE', '/resourceBase/resource/{id1}')
+
+
+def it_returns_no_matching_route_when_the_path_is_too_short():
+    template, route_fn, opts = app.route_fn_from_kind(('API', 'GET', '/resourceBase'))
+
+    assert template == 'no_matching_routes'
+
+
+def it_compiles_the_template_into_segment_descriptors_when_routed():
+    descriptors = app_route.RouteMap().compiled_templates[('API', 'GET', '/resourceBase/resource/{id1}')]
+
+    assert [(d.literal, d.param) for d in descriptors] == [('resourceBase', None), ('resource', None), (None, 'id1')]
+
+
+def it_extracts_path_params_from_a_template():
+    params = app.path_template_to_params('/resourceBase/resource/uuid1/resource/uuid2',
+                                         '/resourceBase/resource/{id1}/resource/{id2}')
+
+    assert params == {'id1': 'uuid1', 'id2': 'uuid2'}
+
+
 def it_parses_the_json_body(api_gateway_event_post_with_json_body):
     event = app.event_factory(api_gateway_event_post_with_json_body)
 
@@ -194,6 +469,32 @@ def it_identifies_an_s3_event_using_custom_factory(s3_event_hello):
     assert event.objects[0].key == 'hello_file.json'
 
 
+def it_identifies_an_sqs_batch_event(sqs_event):
+    event = app.event_factory(event=sqs_event)
+
+    assert isinstance(event, app.BatchEvent)
+    assert event.kind == 'aws:sqs'
+    assert [record.kind for record in event.records] == ['orders', 'orders', 'orders', 'orders']
+    assert event.records[0].item_identifier == 'msg-1'
+    assert event.records[0].body == 'ok'
+    assert event.records[0].request_function
+
+
+def it_identifies_a_kinesis_batch_event(kinesis_event):
+    event = app.event_factory(event=kinesis_event)
+
+    assert isinstance(event, app.BatchEvent)
+    assert event.records[0].kind == 'orders'
+    assert event.records[0].item_identifier == '49590338271490256608559692538361571095921575989136588898'
+    assert event.records[0].body == b'{"test":"body"}'
+
+
+def it_identifies_a_batch_event_using_custom_factory(sqs_event):
+    event = app.event_factory(event=sqs_event, factory_overrides={'sqs': lambda record: 'hello'})
+
+    assert {record.kind for record in event.records} == {'hello'}
+
+
 def it_identifies_an_api_gateway_get_event(api_gateway_event_get):
     event = app.event_factory(api_gateway_event_get)
 
@@ -250,6 +551,35 @@ def handler_404(request):
     return monad.Left(request.replace('error', app.AppError(message='no matching route', code=404)))
 
 
+@app.route(pattern="orders")
+def orders_handler(request):
+    if request.event.body == "raise":
+        raise Exception("boom")
+    if request.event.body == "fail":
+        return monad.Left(request.replace('error', app.AppError(message='order failed', code=500)))
+    return monad.Right(request.replace('response', monad.Right(app.DictToJsonSerialiser({'order': 'ok'}))))
+
+
+@app.route(pattern="json_orders", opts={'body_parser': json.loads})
+def json_orders_handler(request):
+    return monad.Right(request.replace('response', monad.Right(app.DictToJsonSerialiser(request.event.body))))
+
+
+@app.route(pattern="concurrent_orders")
+def concurrent_orders_handler(request):
+    # Only completes when all 4 records are in flight at the same time
+    concurrent_barrier.wait(timeout=2)
+    return monad.Right(request.replace('response', monad.Right(app.DictToJsonSerialiser({'order': 'ok'}))))
+
+
+@app.route(pattern="async_orders")
+async def async_orders_handler(request):
+    await asyncio.sleep(0)
+    if request.event.body == "fail":
+        return monad.Left(request.replace('error', app.AppError(message='order failed', code=500)))
+    return monad.Right(request.replace('response', monad.Right(app.DictToJsonSerialiser({'order': 'ok'}))))
+
+
 @app.route(pattern=('API', 'GET', '/resourceBase/resource/{id1}'))
 def get_resource(request):
     if request.event:
@@ -258,6 +588,11 @@ def get_resource(request):
     return monad.Right(request.replace('response', monad.Right(app.DictToJsonSerialiser({'resource': 'uuid1'}))))
 
 
+@app.route(pattern=('API', 'GET', '/resourceBase/resource/special'))
+def get_special_resource(request):
+    return monad.Right(request.replace('response', monad.Right(app.DictToJsonSerialiser({'resource': 'special'}))))
+
+
 @app.route(pattern=('API', 'GET', '/resourceBase/authz_resource/{id1}'))
 def get_resource_protected_by_authz(request):
     result = get_authz_resource(request)
@@ -283,10 +618,24 @@ def get_nested_resource(request):
     return monad.Right(request.replace('response', monad.Right(app.DictToJsonSerialiser({'resource': 'uuid1'}))))
 
 
+@app.route(pattern=('API', 'GET', '/resourceBase/async_resource/{id1}'))
+async def get_async_resource(request):
+    await asyncio.sleep(0)
+    return monad.Right(request.replace('response', monad.Right(app.DictToJsonSerialiser({'resource': request.event.path_params['id1']}))))
+
+
 def noop_callable(value):
     return monad.Right(value)
 
 
+async def aio_noop_callable(value):
+    return monad.Right(value)
+
+
+async def aio_failed_env_expectations(value):
+    return monad.Left(app.AppError(message="Env expectations failure", code=500))
+
+
 def failed_env_expectations(value):
     return monad.Left(app.AppError(message="Env expectations failure", code=500))
 
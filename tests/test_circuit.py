@@ -1,4 +1,11 @@
-from pyfuncify import circuit, monad
+import threading
+import pytest
+import time_machine
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from pyfuncify import circuit, monad, chronos
 
 from .shared import *
 
@@ -25,6 +32,222 @@ def test_noop_the_circuit_when_no_provider():
     assert result.is_left
 
 
+def teardown_function(function):
+    circuit.CircuitConfiguration().configure(max_retries=1)
+
+
+def test_stays_half_open_and_counts_further_failures(circuit_state_provider):
+    failure()(circuit_state_provider=circuit_state_provider)
+    failure()(circuit_state_provider=circuit_state_provider)
+
+    assert circuit_state_provider.circuit_state == "half_open"
+    assert circuit_state_provider.failures == 2
+
+#
+# Sliding window
+#
+def test_opens_on_the_failure_count_within_the_window(circuit_state_provider):
+    for _ in range(3):
+        failure()(circuit_state_provider=circuit_state_provider)
+
+    assert circuit_state_provider.circuit_state == "open"
+
+
+def test_opens_when_the_provider_is_rebuilt_from_its_store_on_every_call():
+    store = {}
+
+    results = [failure()(circuit_state_provider=StoredProvider(store)) for _ in range(5)]
+
+    assert store['circuit_state'] == "open"
+    assert isinstance(results[-1].error(), circuit.CircuitOpen)
+
+
+def test_counts_failures_of_a_dataclass_provider():
+    provider = DataclassProvider(circuit_name="dataclass-circuit")
+
+    results = [failure()(circuit_state_provider=provider) for _ in range(4)]
+
+    assert results[0].error() == "boom"
+    assert provider.circuit_state == "open"
+    assert isinstance(results[-1].error(), circuit.CircuitOpen)
+
+
+def test_failures_outside_the_window_are_not_counted(circuit_state_provider):
+    failure()(circuit_state_provider=circuit_state_provider)
+    failure()(circuit_state_provider=circuit_state_provider)
+
+    with time_machine.travel(chronos.time_with_delta(time=chronos.time_now(tz=chronos.tz_utc()), minutes=6)):
+        failure()(circuit_state_provider=circuit_state_provider)
+
+    assert circuit_state_provider.circuit_state == "half_open"
+
+
+def test_opens_on_the_failure_rate(circuit_state_provider):
+    circuit.CircuitConfiguration().configure(failure_rate_threshold=0.5, minimum_calls=4)
+
+    success()(circuit_state_provider=circuit_state_provider)
+    success()(circuit_state_provider=circuit_state_provider)
+    failure()(circuit_state_provider=circuit_state_provider)
+
+    assert circuit_state_provider.circuit_state == "half_open"
+
+    failure()(circuit_state_provider=circuit_state_provider)
+
+    assert circuit_state_provider.circuit_state == "open"
+
+
+def test_opens_on_the_slow_call_rate(circuit_state_provider):
+    circuit.CircuitConfiguration().configure(slow_call_seconds=0.0, slow_call_rate_threshold=1.0, minimum_calls=2)
+
+    success()(circuit_state_provider=circuit_state_provider)
+
+    assert circuit_state_provider.circuit_state == "closed"
+
+    success()(circuit_state_provider=circuit_state_provider)
+
+    assert circuit_state_provider.circuit_state == "open"
+
+
+def test_persists_the_window_through_the_provider():
+    provider = WindowPersistingProvider(circuit_name="test-circuit")
+
+    success()(circuit_state_provider=provider)
+    failure()(circuit_state_provider=provider)
+
+    totals = circuit.SlidingWindow(circuit.CircuitConfiguration().failure_threshold_seconds,
+                                   circuit.CircuitConfiguration().window_buckets,
+                                   provider.window).totals(circuit.window_now())
+    assert (totals.calls, totals.failures) == (2, 1)
+
+
+def test_restores_the_window_of_a_dynamo_backed_circuit(dynamo_mock_empty):
+    for _ in range(2):
+        failure()(circuit_state_provider=DynamoCircuitStore(circuit_name="dynamo-circuit"))
+
+    cold_started = DynamoCircuitStore(circuit_name="dynamo-circuit")
+
+    assert sum(bucket[2] for bucket in cold_started.window) == 2
+
+    failure()(circuit_state_provider=cold_started)
+
+    assert repo.find_circuit_by_id("dynamo-circuit").value.circuit_state == "open"
+
+
+def test_the_window_memory_is_constant():
+    window = circuit.SlidingWindow(window_seconds=60, bucket_count=10)
+
+    for second in range(10_000):
+        window.record(float(second), failed=second % 2 == 0, latency=0.01, slow=False)
+
+    assert len(window.buckets) == 10
+    assert 54 <= window.totals(9_999.0).calls <= 60
+
+
+#
+# Half open probes
+#
+def test_admits_one_probe_after_the_stand_down_period(circuit_state_provider_past_stand_down):
+    admitted = threading.Event()
+    release = threading.Event()
+
+    @circuit.circuit_breaker()
+    def probe(circuit_state_provider=None):
+        admitted.set()
+        release.wait(5)
+        return monad.Right("OK")
+
+    prober = threading.Thread(target=probe, kwargs={'circuit_state_provider': circuit_state_provider_past_stand_down})
+    prober.start()
+    admitted.wait(5)
+
+    short_circuited = [success()(circuit_state_provider=circuit_state_provider_past_stand_down) for _ in range(3)]
+
+    release.set()
+    prober.join()
+
+    assert all(isinstance(result.error(), circuit.CircuitOpen) for result in short_circuited)
+    assert circuit_state_provider_past_stand_down.circuit_state == "half_closed"
+
+
+def test_limits_probes_of_providers_rebuilt_for_every_call():
+    store = {'failures': 0,
+             'last_state_chg_time': chronos.time_with_delta(time=chronos.time_now(tz=chronos.tz_utc()), minutes=10, direction='dec'),
+             'circuit_state': 'open'}
+    admitted = threading.Event()
+    release = threading.Event()
+
+    @circuit.circuit_breaker()
+    def probe(circuit_state_provider=None):
+        admitted.set()
+        release.wait(5)
+        return monad.Right("OK")
+
+    prober = threading.Thread(target=probe, kwargs={'circuit_state_provider': StoredProvider(store)})
+    prober.start()
+    admitted.wait(5)
+
+    short_circuited = success()(circuit_state_provider=StoredProvider(store))
+
+    release.set()
+    prober.join()
+
+    assert isinstance(short_circuited.error(), circuit.CircuitOpen)
+    assert store['circuit_state'] == "half_closed"
+
+
+def test_probes_a_dataclass_provider():
+    provider = DataclassProvider(circuit_state='open',
+                                 last_state_chg_time=chronos.time_with_delta(time=chronos.time_now(tz=chronos.tz_utc()), minutes=10, direction='dec'))
+
+    result = success()(circuit_state_provider=provider)
+
+    assert result.is_right()
+    assert provider.circuit_state == "half_closed"
+
+
+def test_releases_the_probe_when_it_completes(circuit_state_provider_past_stand_down):
+    success()(circuit_state_provider=circuit_state_provider_past_stand_down)
+    success()(circuit_state_provider=circuit_state_provider_past_stand_down)
+
+    assert circuit_state_provider_past_stand_down.circuit_state == "closed"
+
+
+def test_admits_the_configured_number_of_probes(circuit_state_provider_past_stand_down):
+    circuit.CircuitConfiguration().configure(half_open_max_probes=2)
+
+    assert circuit.acquire_probe(circuit_state_provider_past_stand_down)
+    assert circuit.acquire_probe(circuit_state_provider_past_stand_down)
+    assert not circuit.acquire_probe(circuit_state_provider_past_stand_down)
+
+    circuit.release_probe(circuit_state_provider_past_stand_down)
+
+    assert circuit.acquire_probe(circuit_state_provider_past_stand_down)
+
+
+def test_a_failed_probe_reopens_the_circuit(circuit_state_provider_past_stand_down):
+    failure()(circuit_state_provider=circuit_state_provider_past_stand_down)
+
+    assert circuit_state_provider_past_stand_down.circuit_state == "open"
+    assert circuit.circuit_is_standing_down(circuit_state_provider_past_stand_down)
+
+
+def test_a_failed_probe_while_half_closed_reopens_the_circuit(circuit_state_provider_past_stand_down):
+    success()(circuit_state_provider=circuit_state_provider_past_stand_down)
+    failure()(circuit_state_provider=circuit_state_provider_past_stand_down)
+
+    assert circuit_state_provider_past_stand_down.circuit_state == "open"
+    assert circuit.circuit_is_standing_down(circuit_state_provider_past_stand_down)
+
+
+@pytest.fixture
+def circuit_state_provider_past_stand_down():
+    provider = CircuitStateProvider(circuit_name="test-circuit")
+    provider.update_state(failures=0,
+                          last_state_chg_time=chronos.time_with_delta(time=chronos.time_now(tz=chronos.tz_utc()), minutes=10, direction='dec'),
+                          circuit_state='open')
+    return provider
+
+
 def failure():
     @circuit.circuit_breaker()
     def run(circuit_state_provider=None):
@@ -36,3 +259,43 @@ def success():
     def run(circuit_state_provider=None):
         return monad.Right("OK")
     return run
+
+
+class WindowPersistingProvider(CircuitStateProvider):
+    def __init__(self, circuit_name=None):
+        super().__init__(circuit_name)
+        self.window = None
+
+    def update_window(self, window):
+        self.window = window
+        return self
+
+
+class StoredProvider(CircuitStateProvider):
+    """
+    Rebuilt from the store on every call; e.g. a provider reading its state from DynamoDB.
+    """
+    def __init__(self, store):
+        super().__init__("stored-circuit")
+        self.store = store
+        self.failures = store.get('failures', 0)
+        self.last_state_chg_time = store.get('last_state_chg_time')
+        self.circuit_state = store.get('circuit_state')
+
+    def update_state(self, failures, last_state_chg_time, circuit_state):
+        self.store.update(failures=failures, last_state_chg_time=last_state_chg_time, circuit_state=circuit_state)
+        return super().update_state(failures, last_state_chg_time, circuit_state)
+
+
+@dataclass
+class DataclassProvider:
+    circuit_name: Optional[str] = None
+    circuit_state: Optional[str] = None
+    failures: int = 0
+    last_state_chg_time: Optional[datetime] = None
+
+    def update_state(self, failures, last_state_chg_time, circuit_state):
+        self.failures = failures
+        self.last_state_chg_time = last_state_chg_time
+        self.circuit_state = circuit_state
+        return self
@@ -0,0 +1,118 @@
+import time
+
+from pyfuncify import circuit, circuit_state_cache, monad, chronos
+
+from .shared import *
+
+
+def setup_function(function):
+    CountingStore.reset()
+
+
+def it_serves_reads_from_memory_within_the_ttl():
+    provider = circuit_state_cache.CachedCircuitStateProvider(CountingStore, circuit_name="test-circuit")
+
+    for _ in range(5):
+        success()(circuit_state_provider=provider)
+
+    assert CountingStore.reads == 1
+
+
+def it_reloads_after_the_ttl():
+    provider = circuit_state_cache.CachedCircuitStateProvider(CountingStore, circuit_name="test-circuit", ttl_seconds=0.01)
+    CountingStore.store['test-circuit'] = (0, chronos.time_now(tz=chronos.tz_utc()), 'open')
+
+    time.sleep(0.02)
+
+    assert provider.circuit_state == 'open'
+    assert CountingStore.reads == 2
+
+
+def it_writes_state_changes_through():
+    provider = circuit_state_cache.CachedCircuitStateProvider(CountingStore, circuit_name="test-circuit")
+
+    failure()(circuit_state_provider=provider)
+
+    assert CountingStore.writes == 1
+    assert CountingStore.store['test-circuit'][2] == 'half_open'
+
+
+def it_coalesces_failure_count_writes():
+    provider = circuit_state_cache.CachedCircuitStateProvider(CountingStore, circuit_name="test-circuit", write_through_state_changes=False)
+
+    provider.update_state(failures=1, last_state_chg_time=None, circuit_state='half_open')
+    provider.update_state(failures=2, last_state_chg_time=None, circuit_state='half_open')
+    provider.update_state(failures=3, last_state_chg_time=None, circuit_state='half_open')
+
+    assert provider.failures == 3
+    assert CountingStore.writes == 0
+
+    circuit_state_cache.flush_circuits()
+
+    assert CountingStore.writes == 1
+    assert CountingStore.store['test-circuit'][0] == 3
+
+
+def it_flushes_pending_writes_within_the_max_staleness():
+    provider = circuit_state_cache.CachedCircuitStateProvider(CountingStore, circuit_name="test-circuit",
+                                                              max_staleness_seconds=0.01,
+                                                              write_through_state_changes=False)
+
+    provider.update_state(failures=1, last_state_chg_time=None, circuit_state='half_open')
+    time.sleep(0.1)
+
+    assert CountingStore.writes == 1
+
+
+def it_keeps_the_write_pending_when_the_store_fails():
+    provider = circuit_state_cache.CachedCircuitStateProvider(FailingStore, circuit_name="test-circuit",
+                                                              write_through_state_changes=False)
+
+    provider.update_state(failures=1, last_state_chg_time=None, circuit_state='half_open')
+    circuit_state_cache.flush_circuits()
+
+    assert provider.pending.failures == 1
+
+
+#
+# Helpers
+#
+class CountingStore:
+    store = {}
+    reads = 0
+    writes = 0
+
+    def __init__(self, circuit_name=None):
+        self.circuit_name = circuit_name
+        self.failures, self.last_state_chg_time, self.circuit_state = self.store.get(circuit_name, (0, None, None))
+        CountingStore.reads += 1
+
+    def update_state(self, failures, last_state_chg_time, circuit_state):
+        self.store[self.circuit_name] = (failures, last_state_chg_time, circuit_state)
+        CountingStore.writes += 1
+        return self
+
+    @classmethod
+    def reset(cls):
+        cls.store.clear()
+        cls.reads = 0
+        cls.writes = 0
+
+
+class FailingStore(CountingStore):
+    def update_state(self, failures, last_state_chg_time, circuit_state):
+        raise ConnectionError("store unavailable")
+
+
+def failure():
+    @circuit.circuit_breaker()
+    def run(circuit_state_provider=None):
+        return monad.Left("boom")
+    return run
+
+
+def success():
+    @circuit.circuit_breaker()
+    def run(circuit_state_provider=None):
+        return monad.Right("OK")
+    return run
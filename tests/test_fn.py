@@ -1,4 +1,4 @@
-from pyfuncify import fn, chronos, monad
+from pyfuncify import fn, chronos, monad, aio
 
 #
 # fn.identity
@@ -92,3 +92,28 @@ def it_fails_to_find_and_returns_nothing():
     result = fn.find_by_predicate(predicate_fn, [1,2,3])
     assert not result.value
 
+
+
+#
+# fn.aio_either_compose
+#
+def it_composes_sync_and_async_either_fns():
+    result = aio.run(fn.aio_either_compose([aio_inc, lambda x: monad.Right(x * 10)], monad.Right(1)))
+
+    assert result.value == 20
+
+def it_short_circuits_the_async_compose_on_left():
+    skipped = []
+
+    async def skipped_fn(x):
+        skipped.append(x)
+        return monad.Right(x)
+
+    result = aio.run(fn.aio_either_compose([lambda x: monad.Left(x), skipped_fn], monad.Right(1)))
+
+    assert result.is_left()
+    assert skipped == []
+
+
+async def aio_inc(x):
+    return monad.Right(x + 1)
@@ -1,7 +1,13 @@
 import pytest
 import requests
+import asyncio
+import threading
+import tracemalloc
+import itertools
+import io
+import json
 
-from pyfuncify import http_adapter, circuit
+from pyfuncify import http_adapter, http, circuit, retry, monad, aio
 
 from .shared import *
 
@@ -79,6 +85,357 @@ def test_failed_non_retryable_http_call_no_backoff_retry(request_http_non_retrya
     circuit.CircuitConfiguration().configure(max_retries=1)
 
 
+#
+# Async variants
+#
+def test_success_aio_http_call(request_mock):
+    result = aio.run(http_adapter.aio_post(endpoint="https://example.host/resource",
+                                           body={'a': "mock_body"},
+                                           http_timeout=10.0))
+
+    assert result.is_right()
+    assert result.value == (200, {'hello': 'there'})
+
+
+def test_aio_calls_overlap(requests_mock):
+    requests_mock.get("https://example.host/resource", json={'hello': "there"}, headers={'Content-Type': 'application/json'})
+    requests_mock.get("https://other.host/resource", json={'hello': "other"}, headers={'Content-Type': 'application/json'})
+
+    async def fan_out():
+        return await asyncio.gather(http_adapter.aio_get(endpoint="https://example.host/resource"),
+                                    http_adapter.aio_get(endpoint="https://other.host/resource"))
+
+    results = aio.run(fan_out())
+
+    assert [result.value.json() for result in results] == [{'hello': "there"}, {'hello': "other"}]
+
+
+def test_failed_aio_http_call_with_circuit(request_http_failure_mock,
+                                           circuit_state_provider):
+    result = aio.run(http_adapter.aio_post(endpoint="https://example.host/resource",
+                                           body={'a': "mock_body"},
+                                           circuit_state_provider=circuit_state_provider))
+
+    assert result.is_left()
+    assert result.error().code == 401
+    assert circuit_state_provider.circuit_state == 'half_open'
+
+
+def test_aio_call_does_not_invoke_when_circuit_open(request_mock,
+                                                    circuit_state_provider_in_open_state,
+                                                    mocker):
+    post_invoke_spy = mocker.spy(http_adapter, 'post_invoke')
+
+    result = aio.run(http_adapter.aio_post(endpoint="https://example.host/resource",
+                                           body={'a': "mock_body"},
+                                           circuit_state_provider=circuit_state_provider_in_open_state))
+
+    assert result.is_left()
+    assert isinstance(result.error(), circuit.CircuitOpen)
+    assert post_invoke_spy.call_count == 0
+
+
+def test_failed_aio_http_call_performs_backoff_retry(request_http_2_call_retryable_failure_mock,
+                                                     circuit_state_provider,
+                                                     mocker):
+    circuit.CircuitConfiguration().configure(max_retries=2)
+    post_invoke_spy = mocker.spy(http_adapter, 'post_invoke')
+
+    result = aio.run(http_adapter.aio_post(endpoint="https://example.host/resource",
+                                           body={'a': "mock_body"},
+                                           circuit_state_provider=circuit_state_provider))
+
+    assert result.is_left()
+    assert result.error().retryable
+    assert post_invoke_spy.call_count == 2
+    circuit.CircuitConfiguration().configure(max_retries=1)
+
+
+#
+# Batch
+#
+def test_batch_returns_results_in_spec_order(requests_mock):
+    requests_mock.get("https://example.host/resource", json={'hello': "there"}, headers={'Content-Type': 'application/json'})
+    requests_mock.post("https://other.host/resource", json={'hello': "other"}, headers={'Content-Type': 'application/json'})
+
+    results = http_adapter.batch([http_adapter.RequestSpec(endpoint="https://other.host/resource", method='post', body={'a': 1}),
+                                  http_adapter.RequestSpec(endpoint="https://example.host/resource")],
+                                 max_workers=2)
+
+    assert [result.value for result in results] == [(200, {'hello': "other"}), (200, {'hello': "there"})]
+
+
+def test_batch_requests_run_concurrently(mocker):
+    barrier = threading.Barrier(3, timeout=5)
+
+    def wait_for_all(**kwargs):
+        barrier.wait()
+        return monad.Right((200, {'hello': "there"}))
+
+    mocker.patch.object(http_adapter, 'get_invoke', side_effect=wait_for_all)
+
+    results = http_adapter.batch([http_adapter.RequestSpec(endpoint="https://example.host/resource") for _ in range(3)],
+                                 max_workers=3)
+
+    assert all(result.is_right() for result in results)
+
+
+def test_batch_applies_the_circuit_per_spec(request_http_failure_mock,
+                                            requests_mock,
+                                            circuit_state_provider,
+                                            circuit_state_provider_in_open_state):
+    requests_mock.get("https://other.host/resource", json={'hello': "other"}, headers={'Content-Type': 'application/json'})
+
+    failed, circuit_open = http_adapter.batch([http_adapter.RequestSpec(endpoint="https://example.host/resource",
+                                                                        method='post',
+                                                                        circuit_state_provider=circuit_state_provider),
+                                               http_adapter.RequestSpec(endpoint="https://other.host/resource",
+                                                                        circuit_state_provider=circuit_state_provider_in_open_state)])
+
+    assert failed.error().code == 401
+    assert circuit_state_provider.circuit_state == 'half_open'
+    assert isinstance(circuit_open.error(), circuit.CircuitOpen)
+
+
+def test_batch_does_not_retry_a_client_error_get(requests_mock, circuit_state_provider, mocker):
+    requests_mock.get("https://example.host/resource",
+                      json={'status': "boom"},
+                      status_code=404,
+                      headers={'Content-Type': 'application/json'})
+    circuit.CircuitConfiguration().configure(max_retries=2)
+    get_invoke_spy = mocker.spy(http_adapter, 'get_invoke')
+
+    result, = http_adapter.batch([http_adapter.RequestSpec(endpoint="https://example.host/resource",
+                                                           circuit_state_provider=circuit_state_provider)])
+
+    assert result.error().code == 404
+    assert get_invoke_spy.call_count == 1
+    circuit.CircuitConfiguration().configure(max_retries=1)
+
+
+def test_batch_retries_a_server_error_get(requests_mock, circuit_state_provider, mocker):
+    requests_mock.get("https://example.host/resource",
+                      json={'status': "boom"},
+                      status_code=503,
+                      headers={'Content-Type': 'application/json'})
+    circuit.CircuitConfiguration().configure(max_retries=2)
+    get_invoke_spy = mocker.spy(http_adapter, 'get_invoke')
+
+    result, = http_adapter.batch([http_adapter.RequestSpec(endpoint="https://example.host/resource",
+                                                           circuit_state_provider=circuit_state_provider)])
+
+    assert result.error().code == 503
+    assert get_invoke_spy.call_count == 2
+    circuit.CircuitConfiguration().configure(max_retries=1)
+
+
+def test_batch_fails_an_unsupported_method():
+    result, = http_adapter.batch([http_adapter.RequestSpec(endpoint="https://example.host/resource", method='delete')])
+
+    assert result.is_left()
+    assert result.error().code == 500
+
+
+#
+# Request options
+#
+def test_get_sends_headers_and_timeouts(requests_mock, mocker):
+    requests_mock.get("https://example.host/resource", json={'hello': "there"}, headers={'Content-Type': 'application/json'})
+    get_spy = mocker.spy(requests.Session, 'get')
+
+    http_adapter.get(endpoint="https://example.host/resource",
+                     headers={'x-api-key': "key"},
+                     request_options=http.RequestOptions(connect_timeout=1.0, read_timeout=3.0))
+
+    assert requests_mock.last_request.headers['x-api-key'] == "key"
+    assert get_spy.call_args.kwargs['timeout'] == (1.0, 3.0)
+
+
+def test_http_timeout_applies_to_both_phases(request_mock, mocker):
+    post_spy = mocker.spy(requests.Session, 'post')
+
+    http_adapter.post(endpoint="https://example.host/resource", body={'a': 1}, http_timeout=2.0)
+
+    assert post_spy.call_args.kwargs['timeout'] == (2.0, 2.0)
+
+
+def test_timeouts_are_clipped_to_the_lambda_deadline():
+    options = http.request_options(connect_timeout=5.0, read_timeout=10.0, lambda_context=LambdaContext(2500))
+
+    connect_timeout, read_timeout = options.timeout()
+
+    assert 1.9 < connect_timeout <= 2.0
+    assert 1.9 < read_timeout <= 2.0
+
+
+def test_the_earlier_of_the_budget_and_lambda_deadline_applies():
+    options = http.request_options(lambda_context=LambdaContext(60000), budget_ms=1000)
+
+    assert 0.9 < options.remaining() <= 1.0
+
+
+def test_does_not_call_or_retry_when_the_deadline_has_passed(circuit_state_provider, mocker):
+    get_invoke_spy = mocker.spy(http_adapter, 'get_invoke')
+
+    result = http_adapter.get(endpoint="https://example.host/resource",
+                              request_options=http.request_options(lambda_context=LambdaContext(100)))
+
+    assert result.is_left()
+    assert isinstance(result.error(), http.DeadlineExceeded)
+    assert result.error().code == 504
+    assert get_invoke_spy.call_count == 0
+
+
+def test_an_expired_deadline_is_not_a_circuit_failure(circuit_state_provider):
+    expired = http.request_options(lambda_context=LambdaContext(100))
+
+    results = [http_adapter.get(endpoint="https://example.host/resource",
+                                circuit_state_provider=circuit_state_provider,
+                                request_options=expired) for _ in range(3)]
+    results.append(http_adapter.post(endpoint="https://example.host/resource",
+                                     body={'a': "mock_body"},
+                                     circuit_state_provider=circuit_state_provider,
+                                     request_options=expired))
+
+    assert all(isinstance(result.error(), http.DeadlineExceeded) for result in results)
+    assert circuit_state_provider.circuit_state is None
+    assert not circuit_state_provider.failures
+
+
+def test_the_deadline_applies_across_retries(request_http_2_call_retryable_failure_mock, mocker):
+    post_invoke_spy = mocker.spy(http_adapter, 'post_invoke')
+
+    result = http_adapter.post(endpoint="https://example.host/resource",
+                               body={'a': "mock_body"},
+                               request_options=http.request_options(budget_ms=500),
+                               retry_policy=retry.RetryPolicy(max_tries=3, base_delay=1.0))
+
+    assert result.error().code == 500
+    assert post_invoke_spy.call_count == 1
+
+
+class LambdaContext:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+#
+# Streaming
+#
+def test_streams_ndjson(requests_mock):
+    requests_mock.get("https://example.host/resource", content=b'{"a": 1}\n\n{"a": 2}\n', headers={'Content-Type': 'application/x-ndjson'})
+
+    result = http_adapter.get(endpoint="https://example.host/resource", stream='ndjson')
+
+    status, items = result.value
+    assert status == 200
+    assert list(items) == [{'a': 1}, {'a': 2}]
+
+
+def test_streams_json_array_elements(requests_mock):
+    requests_mock.get("https://example.host/resource", content=b'[{"a": 1}, {"a": [1, 2]}, "three", 4]', headers={'Content-Type': 'application/json'})
+
+    status, items = http_adapter.get(endpoint="https://example.host/resource", stream='json_array').value
+
+    assert list(items) == [{'a': 1}, {'a': [1, 2]}, "three", 4]
+
+
+def test_streams_chunks(requests_mock):
+    requests_mock.get("https://example.host/resource", content=b'abc' * 100, headers={'Content-Type': 'application/octet-stream'})
+
+    status, chunks = http_adapter.get(endpoint="https://example.host/resource", stream='chunks').value
+
+    assert b"".join(chunks) == b'abc' * 100
+
+
+def test_streamed_failure_is_a_left(requests_mock):
+    requests_mock.get("https://example.host/resource", json={'status': "boom"}, status_code=404, headers={'Content-Type': 'application/json'})
+
+    result = http_adapter.get(endpoint="https://example.host/resource", stream='json_array')
+
+    assert result.is_left()
+    assert result.error().code == 404
+    assert result.error().ctx == {'status': "boom"}
+
+
+def test_streamed_json_array_memory_is_flat(requests_mock):
+    elements = 100_000
+    requests_mock.get("https://example.host/resource", body=JsonArrayBody(elements), headers={'Content-Type': 'application/json'})
+
+    status, items = http_adapter.get(endpoint="https://example.host/resource", stream='json_array').value
+
+    tracemalloc.start()
+    count = sum(1 for _ in items)
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert count == elements
+    assert peak < 1024 * 1024
+
+
+def test_streams_json_array_float_split_across_chunks():
+    items = http.stream_json_array(ChunkedResponse([b'[1.', b'5, 2]']))
+
+    assert list(items) == [1.5, 2]
+
+
+def test_streams_json_array_exponent_split_across_chunks():
+    items = http.stream_json_array(ChunkedResponse([b'[10, 2.5e', b'3]']))
+
+    assert list(items) == [10, 2500.0]
+
+
+def test_streams_json_array_number_split_before_its_delimiter():
+    items = http.stream_json_array(ChunkedResponse([b'[1', b'2 ', b', -3', b'.25E-1 ', b' ]']))
+
+    assert list(items) == [12, -0.325]
+
+
+def test_streamed_json_array_not_terminated_is_an_error():
+    with pytest.raises(json.JSONDecodeError):
+        list(http.stream_json_array(ChunkedResponse([b'[1, 2.', b'5'])))
+
+
+class ChunkedResponse:
+    """
+    A response whose body arrives in the given chunks, regardless of chunk_size.
+    """
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.encoding = 'utf-8'
+
+    def iter_content(self, chunk_size=None):
+        yield from self.chunks
+
+
+class JsonArrayBody(io.RawIOBase):
+    """
+    Generates a JSON array of elements (~6MB for 100,000) as it is read.
+    """
+    def __init__(self, elements):
+        self.parts = itertools.chain([b'['],
+                                     (b'%s{"id": %d, "name": "element-%d"}' % (b',' if i else b'', i, i) for i in range(elements)),
+                                     [b']'])
+        self.pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while len(self.pending) < len(buffer):
+            part = next(self.parts, None)
+            if part is None:
+                break
+            self.pending += part
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
 @pytest.fixture
 def request_mock(requests_mock):
     requests_mock.post("https://example.host/resource", json={'hello': "there"}, headers={'Content-Type': 'application/json; charset=utf-8'})
@@ -0,0 +1,95 @@
+import pytest
+import requests
+import email
+from requests.cookies import MockRequest, MockResponse
+
+from pyfuncify import http_pool, http_adapter
+
+
+def setup_function(function):
+    http_pool.HttpPoolConfiguration().configure()
+    http_pool.close_sessions()
+
+
+def teardown_function(function):
+    http_pool.HttpPoolConfiguration().configure()
+    http_pool.close_sessions()
+
+
+def it_reuses_the_session_for_the_same_host():
+    session = http_pool.session_for("https://example.host/resource")
+
+    assert http_pool.session_for("https://example.host/other_resource?a=1") is session
+    assert http_pool.pool_stats()['https://example.host']['session_misses'] == 1
+    assert http_pool.pool_stats()['https://example.host']['session_hits'] == 1
+
+
+def it_creates_a_session_per_host():
+    session = http_pool.session_for("https://example.host/resource")
+
+    assert http_pool.session_for("https://idp.example.com/token") is not session
+    assert http_pool.session_for("http://example.host/resource") is not session
+    assert set(http_pool.pool_stats().keys()) == {'https://example.host', 'https://idp.example.com', 'http://example.host'}
+
+
+def it_mounts_an_adapter_with_the_configured_pool():
+    http_pool.HttpPoolConfiguration().configure(pool_maxsize=3, max_retries=1)
+
+    adapter = http_pool.session_for("https://example.host/resource").get_adapter("https://example.host/resource")
+
+    assert adapter.poolmanager.connection_pool_kw['maxsize'] == 3
+    assert adapter.max_retries.total == 1
+
+
+def it_closes_connections_when_keep_alive_is_off():
+    http_pool.HttpPoolConfiguration().configure(keep_alive=False)
+
+    assert http_pool.session_for("https://example.host/resource").headers['Connection'] == 'close'
+
+
+def it_uses_the_transport_factory():
+    session = requests.Session()
+    http_pool.HttpPoolConfiguration().configure(transport_factory=lambda key: session)
+
+    assert http_pool.session_for("https://example.host/resource") is session
+
+
+def it_discards_sessions_on_close():
+    session = http_pool.session_for("https://example.host/resource")
+
+    http_pool.close_sessions()
+
+    assert http_pool.pool_stats() == {}
+    assert http_pool.session_for("https://example.host/resource") is not session
+
+
+def it_makes_adapter_calls_through_the_pooled_session(requests_mock):
+    requests_mock.post("https://example.host/resource", json={'hello': "there"}, headers={'Content-Type': 'application/json'})
+
+    http_adapter.post(endpoint="https://example.host/resource", body={'a': 1})
+    http_adapter.post(endpoint="https://example.host/resource", body={'a': 2})
+
+    assert http_pool.pool_stats()['https://example.host']['session_misses'] == 1
+    assert http_pool.pool_stats()['https://example.host']['session_hits'] == 1
+
+
+def it_does_not_keep_cookies_across_requests():
+    session = http_pool.session_for("https://example.host/resource")
+    request = requests.Request('GET', "https://example.host/login").prepare()
+
+    session.cookies.extract_cookies(MockResponse(email.message_from_string("Set-Cookie: session=abc; Path=/\n\n")),
+                                    MockRequest(request))
+
+    assert len(session.cookies) == 0
+    assert 'Cookie' not in session.prepare_request(requests.Request('GET', "https://example.host/resource")).headers
+
+
+def it_reports_connection_stats_from_the_pools():
+    session = http_pool.session_for("https://example.host/resource")
+    session.get_adapter("https://example.host/resource").poolmanager.connection_from_url("https://example.host/resource")
+
+    stats = http_pool.pool_stats()['https://example.host']
+
+    assert stats['connections'] == 0
+    assert stats['requests'] == 0
+    assert stats['connection_reuse'] is None
@@ -0,0 +1,140 @@
+import json
+import pytest
+
+from pyfuncify import metrics, circuit, http_adapter, retry, monad
+
+from .shared import *
+
+
+def setup_function(function):
+    metrics.MetricsConfiguration().configure(sink=metrics.InMemoryMetricsSink())
+
+
+def teardown_function(function):
+    metrics.MetricsConfiguration().configure()
+    circuit.CircuitConfiguration().configure(max_retries=1)
+
+
+def it_records_calls_outcomes_and_latency(circuit_state_provider):
+    success()(circuit_state_provider=circuit_state_provider)
+    failure()(circuit_state_provider=circuit_state_provider)
+
+    sink = metrics.MetricsConfiguration().sink
+    assert sink.counter('calls', circuit="test-circuit") == 2
+    assert sink.counter('successes', circuit="test-circuit") == 1
+    assert sink.counter('failures', circuit="test-circuit") == 1
+    assert len(sink.histogram('latency', circuit="test-circuit")) == 2
+
+
+def it_records_state_transitions(circuit_state_provider):
+    failure()(circuit_state_provider=circuit_state_provider)
+    success()(circuit_state_provider=circuit_state_provider)
+    success()(circuit_state_provider=circuit_state_provider)
+
+    sink = metrics.MetricsConfiguration().sink
+    assert sink.counter('state_transitions', circuit="test-circuit", to_state="half_open") == 1
+    assert sink.counter('state_transitions', circuit="test-circuit", to_state="closed") == 1
+
+
+def it_records_short_circuits(circuit_state_provider_in_open_state):
+    success()(circuit_state_provider=circuit_state_provider_in_open_state)
+
+    sink = metrics.MetricsConfiguration().sink
+    assert sink.counter('short_circuits', circuit="run") == 1
+    assert sink.counter('calls', circuit="run") == 0
+
+
+def it_names_the_circuit_from_the_call_without_a_provider():
+    success()(name="token_service")
+
+    assert metrics.MetricsConfiguration().sink.counter('calls', circuit="token_service") == 1
+
+
+def it_distinguishes_retries_from_first_attempts(requests_mock):
+    requests_mock.post("https://example.host/resource",
+                       json={'status': "boom"},
+                       status_code=500,
+                       headers={'Content-Type': 'application/json'})
+
+    http_adapter.post(endpoint="https://example.host/resource",
+                      body={},
+                      name="orders",
+                      retry_policy=retry.RetryPolicy(max_tries=3, base_delay=0.001, max_delay=0.002))
+
+    sink = metrics.MetricsConfiguration().sink
+    assert sink.counter('calls', circuit="orders") == 1
+    assert sink.counter('retries', circuit="orders") == 2
+
+
+def it_emits_an_emf_line_per_dimension_set_on_flush(circuit_state_provider):
+    lines = []
+    metrics.MetricsConfiguration().configure(sink=metrics.EmfMetricsSink(namespace="test", writer=lines.append))
+
+    success()(circuit_state_provider=circuit_state_provider)
+    success()(circuit_state_provider=circuit_state_provider)
+
+    assert lines == []
+
+    metrics.flush()
+
+    documents = [json.loads(line) for line in lines]
+    calls = next(document for document in documents if 'calls' in document)
+    assert calls['circuit'] == "test-circuit"
+    assert calls['calls'] == 2
+    assert len(calls['latency']) == 2
+    assert calls['_aws']['CloudWatchMetrics'][0]['Namespace'] == "test"
+    assert calls['_aws']['CloudWatchMetrics'][0]['Dimensions'] == [['circuit']]
+    assert {'Name': 'latency', 'Unit': 'Milliseconds'} in calls['_aws']['CloudWatchMetrics'][0]['Metrics']
+
+    metrics.flush()
+
+    assert len(lines) == len(documents)
+
+
+def it_splits_a_histogram_of_more_than_100_values_across_emf_documents():
+    lines = []
+    sink = metrics.EmfMetricsSink(namespace="test", writer=lines.append)
+    for value in range(250):
+        sink.observe('latency', value, metrics.MILLISECONDS, {'circuit': "orders"})
+    sink.count('calls', 250, {'circuit': "orders"})
+
+    sink.flush()
+
+    documents = [json.loads(line) for line in lines]
+    assert [len(document['latency']) for document in documents] == [100, 100, 50]
+    assert sum((document['latency'] for document in documents), []) == list(range(250))
+    assert [document.get('calls') for document in documents] == [250, None, None]
+    assert [[metric['Name'] for metric in document['_aws']['CloudWatchMetrics'][0]['Metrics']] for document in documents] == [['calls', 'latency'], ['latency'], ['latency']]
+
+
+def it_bounds_the_in_memory_histograms():
+    sink = metrics.InMemoryMetricsSink(max_histogram_values=3)
+    for value in range(5):
+        sink.observe('latency', value, metrics.MILLISECONDS, {'circuit': "orders"})
+
+    assert sink.histogram('latency', circuit="orders") == [2, 3, 4]
+
+
+def it_records_nothing_without_a_sink(circuit_state_provider):
+    metrics.MetricsConfiguration().configure()
+
+    result = success()(circuit_state_provider=circuit_state_provider)
+
+    assert result.is_right()
+
+
+#
+# Helpers
+#
+def failure():
+    @circuit.circuit_breaker()
+    def run(circuit_state_provider=None, name=None):
+        return monad.Left("boom")
+    return run
+
+
+def success():
+    @circuit.circuit_breaker()
+    def run(circuit_state_provider=None, name=None):
+        return monad.Right("OK")
+    return run
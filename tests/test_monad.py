@@ -1,7 +1,7 @@
 import pytest
 from pymonad.tools import curry
 
-from pyfuncify import monad, error
+from pyfuncify import monad, error, aio
 
 def test_try_success():
     assert success_function().is_right()
@@ -16,6 +16,68 @@ def test_exception_calls_error_return_fn():
     assert exception_thrower(error_result_fn_arg={'error_fn': None}) == expected_result
 
 
+def test_traceback_is_formatted_lazily():
+    result = exception_thrower(error_result_fn_arg={'error_fn': None}, error_result_fn=None)
+
+    assert isinstance(result.error()._traceback, error.LazyTraceback)
+    assert "ZeroDivisionError: division by zero" in result.error().traceback
+    assert isinstance(result.error()._traceback, str)
+
+
+def test_call_kwargs_override_the_decorator_config():
+    result = exception_thrower(error_result_fn_arg=None, error_result_fn=None, name="overridden")
+
+    assert result.error().name == "overridden"
+
+
+def test_non_overridable_try_ignores_call_kwargs():
+    result = non_overridable_thrower(name="overridden")
+
+    assert result.error().name == "non_overridable_thrower"
+
+
+def test_either_is_slotted():
+    assert not hasattr(monad.Right(1), '__dict__')
+
+
+def test_either_behaviour():
+    assert (monad.Right(1) >> inc) == monad.Right(2)
+    assert (monad.Left("boom") >> inc).error() == "boom"
+    assert monad.Right(1).map(lambda x: x + 1).value == 2
+    assert monad.Right(1).then(inc).value == 2
+    assert monad.Right(1).then(lambda x: x + 1).value == 2
+    assert monad.Left("boom").lift() == "boom"
+    assert monad.Right(1).lift() == 1
+    assert (monad.Left("boom") | (lambda e: "failed: " + e, lambda v: v)) == "failed: boom"
+    assert monad.Right(1).either(str, lambda v: v + 1) == 2
+
+
+def test_async_bind_chains_sync_and_async_fns():
+    result = aio.run(monad.Right(1).aio_bind(aio_inc) >> inc >> aio_inc)
+
+    assert result.is_right()
+    assert result.value == 4
+
+
+def test_async_bind_short_circuits_on_left():
+    calls = []
+
+    result = aio.run(monad.Right(1).aio_bind(aio_fail) >> recorder(calls))
+
+    assert result.is_left()
+    assert result.error() == "failed at 1"
+    assert calls == []
+
+
+def test_async_bind_on_a_left_does_not_call_the_fn():
+    calls = []
+
+    result = aio.run(monad.Left("boom").aio_bind(recorder(calls)))
+
+    assert result.error() == "boom"
+    assert calls == []
+
+
 #
 # Helpers
 #
@@ -30,6 +92,25 @@ def wrap_error_in_dict(arg, result):
     arg.update({'error_fn': result.error().error()})
     return arg
 
+def inc(x):
+    return monad.Right(x + 1)
+
+
+async def aio_inc(x):
+    return monad.Right(x + 1)
+
+
+async def aio_fail(x):
+    return monad.Left("failed at {}".format(x))
+
+
+def recorder(calls):
+    async def record(x):
+        calls.append(x)
+        return monad.Right(x)
+    return record
+
+
 @monad.monadic_try()
 def success_function():
     return True
@@ -41,5 +122,10 @@ def success_function_with_custom_success():
 
 
 @monad.monadic_try(error_result_fn=wrap_error_in_dict, error_cls=error.PyFuncifyError, status=500)
-def exception_thrower(error_result_fn_arg):
+def exception_thrower(error_result_fn_arg, **kwargs):
+    return 1/0
+
+
+@monad.monadic_try(error_cls=error.PyFuncifyError, overridable=False)
+def non_overridable_thrower(**kwargs):
     return 1/0
@@ -0,0 +1,117 @@
+from pyfuncify import retry, circuit, monad, aio
+
+
+def setup_function(function):
+    retry.RetryConfiguration().configure()
+
+
+def teardown_function(function):
+    retry.RetryConfiguration().configure()
+    circuit.CircuitConfiguration().configure(max_retries=1)
+
+
+def it_resolves_max_tries_from_the_circuit_configuration_per_call():
+    calls = []
+
+    circuit.CircuitConfiguration().configure(max_retries=3)
+    failing_call(calls, endpoint="https://example.host/resource", retry_policy=fast_policy())
+
+    assert len(calls) == 3
+
+
+def it_applies_the_call_policy_over_the_endpoint_policy():
+    calls = []
+    retry.RetryConfiguration().configure(endpoint_policies={'https://example.host': fast_policy(max_tries=4)})
+
+    failing_call(calls, endpoint="https://example.host/resource")
+    failing_call(calls, endpoint="https://example.host/resource", retry_policy=fast_policy(max_tries=2))
+
+    assert len(calls) == 6
+
+
+def it_only_applies_the_endpoint_policy_to_its_host():
+    calls = []
+    retry.RetryConfiguration().configure(policy=fast_policy(max_tries=2),
+                                         endpoint_policies={'https://example.host': fast_policy(max_tries=4)})
+
+    failing_call(calls, endpoint="https://other.host/resource")
+
+    assert len(calls) == 2
+
+
+def it_uses_decorrelated_jitter():
+    policy = retry.RetryPolicy(base_delay=1.0, max_delay=5.0)
+
+    delays = [retry.jittered_delay(policy, 1.5) for _ in range(100)]
+
+    assert all(1.0 <= delay <= 4.5 for delay in delays)
+    assert len(set(delays)) > 1
+    assert retry.jittered_delay(policy, 10.0) <= 5.0
+
+
+def it_doubles_the_delay_without_jitter():
+    policy = retry.RetryPolicy(base_delay=1.0, max_delay=3.0, jitter=None)
+
+    assert [retry.jittered_delay(policy, previous) for previous in [None, 1.0, 2.0]] == [1.0, 2.0, 3.0]
+
+
+def it_does_not_retry_beyond_the_time_budget():
+    calls = []
+
+    failing_call(calls, endpoint="https://example.host/resource",
+                 retry_policy=retry.RetryPolicy(max_tries=5, base_delay=0.2, budget_seconds=0.1))
+
+    assert len(calls) == 1
+
+
+def it_sheds_retries_when_the_token_bucket_is_empty():
+    calls = []
+    retry.RetryConfiguration().configure(bucket_capacity=2)
+
+    for _ in range(3):
+        failing_call(calls, endpoint="https://example.host/resource", retry_policy=fast_policy(max_tries=2))
+
+    assert len(calls) == 5
+    assert retry.RetryConfiguration().bucket("https://example.host").tokens == 0
+
+
+def it_returns_tokens_on_success():
+    retry.RetryConfiguration().configure(bucket_capacity=2, bucket_refill=0.5)
+    bucket = retry.RetryConfiguration().bucket("https://example.host")
+    bucket.acquire(2)
+
+    succeeding_call(endpoint="https://example.host/resource")
+
+    assert bucket.tokens == 0.5
+
+
+def it_retries_async_fns():
+    calls = []
+
+    @retry.aio_retrying(circuit.monad_failure_predicate)
+    async def aio_failing_call(endpoint, retry_policy=None):
+        calls.append(endpoint)
+        return monad.Left("boom")
+
+    result = aio.run(aio_failing_call(endpoint="https://example.host/resource", retry_policy=fast_policy(max_tries=3)))
+
+    assert result.is_left()
+    assert len(calls) == 3
+
+
+#
+# Helpers
+#
+def fast_policy(max_tries=None):
+    return retry.RetryPolicy(max_tries=max_tries, base_delay=0.001, max_delay=0.002)
+
+
+@retry.retrying(circuit.monad_failure_predicate)
+def failing_call(calls, endpoint, retry_policy=None):
+    calls.append(endpoint)
+    return monad.Left("boom")
+
+
+@retry.retrying(circuit.monad_failure_predicate)
+def succeeding_call(endpoint, retry_policy=None):
+    return monad.Right("ok")
@@ -1,23 +1,25 @@
 import os
+import threading
+import time
 import pytest
 import time_machine
 import datetime as dt
 
 from .shared import *
 
-from pyfuncify import self_token, chronos, fn, monad, circuit
+from pyfuncify import self_token, chronos, fn, monad, circuit, app
 
 class TokenPersistenceProvider(self_token.TokenPersistenceProviderProtocol):
     def __init__(self):
-        self.bearer_token = None
+        self.tokens = {}
         pass
 
     def write(self, key, value):
-        self.bearer_token = value
+        self.tokens[key] = value
         return monad.Right(value)
 
     def read(self, key):
-        self.value = self.bearer_token
+        self.value = self.tokens.get(key)
         return monad.Right(self)
 
 class Env():
@@ -40,6 +42,10 @@ class Env():
         os.environ[key] = value
         return ('ok', key, value)
 
+class EnvWithClients(Env):
+    def client_credentials(self, client):
+        return {'payments': ('payments-id', 'payments-secret')}.get(client, (None, None))
+
 class Tracer():
     def serialise(self):
         return {'env': 'test', 'handler_id': 'e5655b5f-e677-4a12-b8d7-0fa0b7e9dd20', 'aws_request_id': 'handler-id-1'}
@@ -50,6 +56,8 @@ def setup_module():
 
 def setup_function():
     self_token.invalidate_cache()
+    self_token.TokenManager().invalidate()
+    self_token.parsed_token.cache_clear()
     if 'BEARER_TOKEN' in os.environ:
         del os.environ['BEARER_TOKEN']
 
@@ -131,6 +139,222 @@ def test_re_get_token_when_in_expired_window(set_up_token_config_with_provider,
 
     traveller.stop()
 
+def test_background_refresh_serves_the_valid_token_while_refreshing(set_up_token_config_with_background_refresh,
+                                                                     set_up_env,
+                                                                     identity_request_mock,
+                                                                     requests_mock):
+    result1 = self_token.token()
+
+    traveller = time_machine.travel(chronos.time_with_delta(time=chronos.time_now(tz=chronos.tz_utc()), hours=23))
+    traveller.start()
+
+    result2 = self_token.token()
+
+    assert result2.value.jwt == result1.value.jwt
+    assert self_token.wait_for_refresh(timeout=5)
+
+    result3 = self_token.token()
+
+    assert result3.value.jwt != result1.value.jwt
+    assert self_token.TokenConfig().token_persistence_provider.read(self_token.BEARER_TOKEN).value.value == result3.value.jwt
+    assert requests_mock.call_count == 2
+
+    traveller.stop()
+
+
+def test_only_one_background_refresh_in_flight(set_up_token_config_with_background_refresh, mocker):
+    release = threading.Event()
+    refresh = mocker.patch.object(self_token, 'refresh_token', side_effect=lambda token_key: release.wait(5))
+
+    token_refresh = self_token.TokenManager().managed(self_token.DEFAULT_TOKEN_KEY).refresh
+
+    assert token_refresh.start()
+    assert not token_refresh.start()
+
+    release.set()
+    assert self_token.wait_for_refresh(timeout=5)
+    assert refresh.call_count == 1
+
+
+def test_background_refresh_gets_an_expired_token_on_the_request_path(set_up_token_config_with_background_refresh,
+                                                                      set_up_env,
+                                                                      identity_request_mock,
+                                                                      generate_expired_signed_jwt):
+    self_token.TokenConfig().token_persistence_provider.write(self_token.BEARER_TOKEN, generate_expired_signed_jwt)
+
+    result = self_token.token()
+
+    assert result.value.expired() == False
+    assert not self_token.TokenManager().managed(self_token.DEFAULT_TOKEN_KEY).refresh.in_flight()
+
+
+def test_failed_background_refresh_keeps_the_valid_token(set_up_token_config_with_background_refresh,
+                                                         set_up_env,
+                                                         requests_mock):
+    requests_mock.post("https://test.host/token",
+                       [{'json': success_token(), 'headers': {'Content-Type': 'application/json; charset=utf-8'}},
+                        {'json': {"error": "access_denied"}, 'status_code': 401, 'headers': {'Content-Type': 'application/json; charset=utf-8'}}])
+    result1 = self_token.token()
+
+    traveller = time_machine.travel(chronos.time_with_delta(time=chronos.time_now(tz=chronos.tz_utc()), hours=23))
+    traveller.start()
+
+    self_token.token()
+    self_token.wait_for_refresh(timeout=5)
+
+    assert self_token.cacheable_token().value == result1.value.jwt
+
+    traveller.stop()
+
+
+def test_refresh_grants_the_replacement_token_outside_the_retry_window(set_up_token_config_with_background_refresh,
+                                                                       set_up_env,
+                                                                       identity_request_mock,
+                                                                       requests_mock):
+    result1 = self_token.token()
+
+    traveller = time_machine.travel(chronos.time_with_delta(time=chronos.time_now(tz=chronos.tz_utc()), hours=1))
+    traveller.start()
+
+    refreshed = self_token.refresh_token()
+
+    assert requests_mock.call_count == 2
+    assert refreshed.value != result1.value.jwt
+    assert self_token.cacheable_token().value == refreshed.value
+    assert self_token.TokenConfig().token_persistence_provider.read(self_token.BEARER_TOKEN).value.value == refreshed.value
+
+    traveller.stop()
+
+
+def test_the_end_of_the_invocation_waits_for_the_refresh_in_flight(set_up_token_config_with_background_refresh, mocker):
+    refreshed = threading.Event()
+    mocker.patch.object(self_token, 'refresh_token', side_effect=lambda token_key: time.sleep(0.1) or refreshed.set())
+
+    assert self_token.start_background_refresh()
+
+    app.end_of_invocation({})
+
+    assert refreshed.is_set()
+
+
+def test_the_end_of_the_invocation_wait_is_bounded(mocker):
+    self_token.TokenConfig().configure(token_persistence_provider=TokenPersistenceProvider(),
+                                       env=Env(),
+                                       background_refresh=True,
+                                       refresh_wait=0.05)
+    release = threading.Event()
+    mocker.patch.object(self_token, 'refresh_token', side_effect=lambda token_key: release.wait(5))
+    self_token.start_background_refresh()
+
+    started = time.monotonic()
+    app.end_of_invocation({})
+
+    assert time.monotonic() - started < 1
+    release.set()
+    assert self_token.wait_for_refresh(timeout=5)
+
+
+def test_the_token_cache_can_be_set():
+    cache_var = self_token.TokenCacheVar("a_token")
+    cache_var.on_first_access(lambda: monad.Right("first"))
+
+    assert cache_var.get().value == "first"
+
+    cache_var.set(monad.Right("swapped"))
+
+    assert cache_var.get().value == "swapped"
+
+
+def test_token_decoded_once_when_granted(set_up_token_config_with_provider, set_up_env, identity_request_mock, mocker):
+    parse_spy = mocker.spy(self_token.crypto, 'parse_generate_id_token')
+
+    self_token.token()
+    self_token.token()
+
+    assert parse_spy.call_count == 1
+
+
+def test_token_decoded_once_when_read_from_cache(set_up_token_config_with_provider,
+                                                 set_up_env,
+                                                 generate_valid_signed_jwt,
+                                                 mocker):
+    self_token.TokenConfig().token_persistence_provider.write(self_token.BEARER_TOKEN, generate_valid_signed_jwt)
+    parse_spy = mocker.spy(self_token.crypto, 'parse_generate_id_token')
+
+    result = self_token.token()
+
+    assert result.value.jwt == generate_valid_signed_jwt
+    assert parse_spy.call_count == 1
+
+
+def test_token_for_another_audience(set_up_token_config_with_provider, set_up_env, identity_request_mock, requests_mock):
+    default_token = self_token.token()
+
+    result = self_token.token_for(audience="https://payments.example.com", scopes="payments:write")
+
+    assert result.is_right()
+    assert requests_mock.call_count == 2
+    assert "audience=https%3A%2F%2Fpayments.example.com" in requests_mock.request_history[-1].text
+    assert "scopes=payments%3Awrite" in requests_mock.request_history[-1].text
+
+    token_key = self_token.TokenKey(audience="https://payments.example.com", scopes="payments:write")
+    provider = self_token.TokenConfig().token_persistence_provider
+    assert provider.tokens[token_key.persistence_key()] == result.value.jwt
+    assert provider.tokens[self_token.BEARER_TOKEN] == default_token.value.jwt
+    assert self_token.token().value.jwt == default_token.value.jwt
+
+
+def test_token_for_a_named_client(set_up_token_config_with_clients, set_up_env, identity_request_mock, requests_mock):
+    result = self_token.token_for(audience="https://payments.example.com", client="payments")
+
+    assert result.is_right()
+    assert requests_mock.request_history[-1].headers['Authorization'] == "Basic cGF5bWVudHMtaWQ6cGF5bWVudHMtc2VjcmV0"
+
+
+def test_token_for_an_unknown_client(set_up_token_config_with_provider, set_up_env):
+    result = self_token.token_for(audience="https://payments.example.com", client="payments")
+
+    assert result.is_left()
+    assert isinstance(result.error(), self_token.TokenEnvError)
+
+
+def test_persistence_key():
+    assert self_token.DEFAULT_TOKEN_KEY.persistence_key() == self_token.BEARER_TOKEN
+    assert self_token.TokenKey(audience="https://payments.example.com").persistence_key() == \
+           self_token.TokenKey(audience="https://payments.example.com").persistence_key()
+    assert self_token.TokenKey(audience="https://payments.example.com").persistence_key() != \
+           self_token.TokenKey(audience="https://payments.example.com", scopes="payments:write").persistence_key()
+
+
+def test_tokens_for_different_keys_are_fetched_concurrently(set_up_token_config_with_provider, set_up_env, mocker):
+    barrier = threading.Barrier(2, timeout=5)
+
+    def grant(**kwargs):
+        barrier.wait()
+        return monad.Right((200, success_token()))
+
+    mocker.patch.object(self_token.http_adapter, 'post', side_effect=grant)
+
+    results = self_token.tokens([self_token.TokenKey(audience="https://a.example.com"),
+                                 self_token.TokenKey(audience="https://b.example.com")])
+
+    assert all(result.is_right() for result in results)
+
+
+def test_concurrent_calls_for_a_token_make_one_grant(set_up_token_config_with_provider, set_up_env, mocker):
+    def grant(**kwargs):
+        time.sleep(0.05)
+        return monad.Right((200, success_token()))
+
+    post = mocker.patch.object(self_token.http_adapter, 'post', side_effect=grant)
+    token_key = self_token.TokenKey(audience="https://a.example.com")
+
+    results = self_token.tokens([token_key] * 4)
+
+    assert post.call_count == 1
+    assert len({result.value.jwt for result in results}) == 1
+
+
 #
 # Failures
 #
@@ -263,6 +487,16 @@ def identity_request_error_mock(requests_mock):
 def set_up_token_config_with_provider():
     self_token.TokenConfig().configure(token_persistence_provider=TokenPersistenceProvider(), env=Env())
 
+@pytest.fixture
+def set_up_token_config_with_clients():
+    self_token.TokenConfig().configure(token_persistence_provider=TokenPersistenceProvider(), env=EnvWithClients())
+
+@pytest.fixture
+def set_up_token_config_with_background_refresh():
+    self_token.TokenConfig().configure(token_persistence_provider=TokenPersistenceProvider(),
+                                       env=Env(),
+                                       background_refresh=True)
+
 @pytest.fixture
 def set_up_token_config_with_provider_and_circuit(circuit_state_provider):
     circuit.CircuitConfiguration().configure()
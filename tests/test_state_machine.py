@@ -24,6 +24,19 @@ def test_transition_with_invalid_state_transition(state_map):
 
     assert result.is_right() == False
 
+def test_transition_to_a_none_state():
+    state_map = state_machine.state_transition_map([("open", "reset", None)])
+
+    result = state_machine.transition(state_map=state_map, from_state="open", with_transition="reset")
+
+    assert result.is_right()
+    assert result.value is None
+
+def test_ambiguous_map_fails_on_construction():
+    with pytest.raises(state_machine.StateMachineError):
+        state_machine.state_transition_map([("half_open", "success", "closed"),
+                                            ("half_open", "success", "half_closed")])
+
 
 @pytest.fixture
 def state_map():
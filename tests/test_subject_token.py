@@ -2,6 +2,7 @@ from pyfuncify import subject_token, monad, singleton, http_adapter
 from pyfuncify import crypto as Cy
 
 from jwcrypto import jwk, jwt
+import requests
 import time
 
 from .shared import *
@@ -95,9 +96,150 @@ def test_token_failed_when_jwks_failure(jwks_request_failure_mock):
     assert id_token.error().message == "http_failure"
 
 
+def test_verified_token_is_cached(jwks_mock, mocker):
+    jwt = crypto_helpers.generate_signed_jwt(crypto_helpers.Idp().jwk)
+    decode_spy = mocker.spy(Cy, 'decode_jwt')
+
+    first = subject_token.parse_generate_id_token(jwt)
+    second = subject_token.parse_generate_id_token(jwt)
+
+    assert second.is_right()
+    assert second.value is first.value
+    assert decode_spy.call_count == 1
+
+
+def test_failed_verification_is_not_cached(jwks_mock):
+    exp = (int(chronos.time_now(tz=chronos.tz_utc(), apply=[chronos.epoch()])) - (60))
+    jwt = crypto_helpers.generate_signed_jwt(crypto_helpers.Idp().jwk, exp)
+
+    subject_token.parse_generate_id_token(jwt)
+
+    assert subject_token.VerifiedTokenCache().size() == 0
+
+
+def test_cached_token_evicted_at_exp(jwks_mock):
+    jwt = crypto_helpers.generate_signed_jwt(crypto_helpers.Idp().jwk)
+    id_token = subject_token.parse_generate_id_token(jwt).value
+    key = subject_token.token_digest(jwt)
+
+    id_token.claims['exp'] = int(chronos.time_now(tz=chronos.tz_utc(), apply=[chronos.epoch()]))
+
+    assert subject_token.VerifiedTokenCache().get(key) is None
+    assert subject_token.VerifiedTokenCache().size() == 0
+
+
+def test_verified_token_cache_is_bounded(jwks_mock):
+    subject_token.VerifiedTokenCache().configure(max_size=2)
+    jwts = [crypto_helpers.generate_signed_jwt(crypto_helpers.Idp().jwk, int(time.time()) + 3600 + i) for i in range(3)]
+
+    for jwt in jwts:
+        subject_token.parse_generate_id_token(jwt)
+
+    assert subject_token.VerifiedTokenCache().size() == 2
+    assert subject_token.VerifiedTokenCache().get(subject_token.token_digest(jwts[0])) is None
+    assert subject_token.VerifiedTokenCache().get(subject_token.token_digest(jwts[2])) is not None
+
+
+def test_jwk_cache_invalidate_clears_verified_tokens(jwks_mock):
+    jwt = crypto_helpers.generate_signed_jwt(crypto_helpers.Idp().jwk)
+    subject_token.parse_generate_id_token(jwt)
+
+    subject_token.jwk_cache_invalidate()
+
+    assert subject_token.VerifiedTokenCache().size() == 0
+
+
+def test_key_for_kid(jwks_mock):
+    key = subject_token.JwksKeyStore().key_for("1")
+
+    assert key.is_right()
+    assert isinstance(key.value, jwk.JWK)
+    assert key.value.get('kid') == "1"
+
+
+def test_unknown_kid_refetches_jwks_once(requests_mock):
+    rotated_jwk = jwk_rsa_key_pair(kid="2")
+    requests_mock.get("https://idp.example.com/.well-known/jwks",
+                      [{'json': crypto_helpers.Idp().jwks(), 'headers': {'Content-Type': 'application/json'}},
+                       {'json': rotated_jwks(rotated_jwk), 'headers': {'Content-Type': 'application/json'}}])
+
+    assert subject_token.parse_generate_id_token(crypto_helpers.generate_signed_jwt(crypto_helpers.Idp().jwk)).is_right()
+    subject_token.JwksKeyStore().refreshed_at = time.monotonic() - 60
+
+    id_token = subject_token.parse_generate_id_token(crypto_helpers.generate_signed_jwt(rotated_jwk))
+
+    assert id_token.is_right()
+    assert requests_mock.call_count == 2
+
+
+def test_unknown_kid_fetches_from_the_endpoint_when_the_jwks_were_persisted(requests_mock):
+    rotated_jwk = jwk_rsa_key_pair(kid="2")
+    subject_token.SubjectTokenConfig().jwks_persistence_provider.write("JWKS", crypto_helpers.Idp().jwks_to_json())
+    requests_mock.get("https://idp.example.com/.well-known/jwks",
+                      json=rotated_jwks(rotated_jwk),
+                      headers={'Content-Type': 'application/json'})
+
+    assert subject_token.parse_generate_id_token(crypto_helpers.generate_signed_jwt(crypto_helpers.Idp().jwk)).is_right()
+    assert requests_mock.call_count == 0
+
+    id_token = subject_token.parse_generate_id_token(crypto_helpers.generate_signed_jwt(rotated_jwk))
+
+    assert id_token.is_right()
+    assert requests_mock.call_count == 1
+
+    unknown = subject_token.parse_generate_id_token(crypto_helpers.generate_signed_jwt(jwk_rsa_key_pair(kid="unknown")))
+
+    assert unknown.error().message == "Unknown kid unknown"
+    assert requests_mock.call_count == 1
+
+
+def test_unknown_kid_refetch_is_rate_limited(jwks_mock):
+    subject_token.parse_generate_id_token(crypto_helpers.generate_signed_jwt(crypto_helpers.Idp().jwk))
+    subject_token.JwksKeyStore().refreshed_at = time.monotonic() - 60
+
+    results = [subject_token.parse_generate_id_token(crypto_helpers.generate_signed_jwt(jwk_rsa_key_pair(kid="unknown")))
+               for _ in range(3)]
+
+    assert all(result.is_left() for result in results)
+    assert results[0].error().message == "Unknown kid unknown"
+    assert results[0].error().code == 401
+    assert jwks_mock.call_count == 2
+
+
+def test_jwks_refetched_after_max_age(requests_mock):
+    requests_mock.get("https://idp.example.com/.well-known/jwks",
+                      json=crypto_helpers.Idp().jwks(),
+                      headers={'Content-Type': 'application/json', 'Cache-Control': 'public, max-age=600'})
+
+    subject_token.cacheable_jwks()
+    assert 599 < subject_token.JwksKeyStore().expires_at - time.monotonic() <= 600
+
+    subject_token.JwksKeyStore().expires_at = time.monotonic() - 1
+    subject_token.JwksKeyStore().refreshed_at = time.monotonic() - 60
+
+    assert subject_token.JwksKeyStore().key_for("1").is_right()
+    assert requests_mock.call_count == 2
+
+
+def test_failed_refetch_keeps_the_jwks(requests_mock):
+    requests_mock.get("https://idp.example.com/.well-known/jwks",
+                      [{'json': crypto_helpers.Idp().jwks(), 'headers': {'Content-Type': 'application/json'}},
+                       {'exc': requests.exceptions.ConnectionError('http_failure')}])
+    subject_token.cacheable_jwks()
+
+    subject_token.JwksKeyStore().expires_at = time.monotonic() - 1
+    subject_token.JwksKeyStore().refreshed_at = time.monotonic() - 60
+
+    assert subject_token.JwksKeyStore().key_for("1").is_right()
+
+
 #
 # Helpers
 #
+def rotated_jwks(rotated_jwk):
+    return {'keys': crypto_helpers.Idp().jwks()['keys'] + crypto_helpers.jwk_key_set(rotated_jwk)['keys']}
+
+
 def set_up_token_config():
     subject_token.SubjectTokenConfig().configure(
         jwks_persistence_provider=JwtPersistenceProvider(),